@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import time
+from typing import List, Optional
+
+
+def atomic_write(filename : str, data : bytes) -> None:
+    """
+    Replaces a file atomically: the data is written to a temporary file in the same directory, flushed to disk
+    and renamed to the target name. Readers (and a crash) see either the old or the new content, never a
+    partially written file.
+    :param filename: The file to (over)write.
+    :param data: The new content.
+    :return: Nothing
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_name = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(filename) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # Keep the permissions of the existing file
+        if os.path.exists(filename):
+            os.chmod(tmp_name, stat.S_IMODE(os.stat(filename).st_mode))
+        os.replace(tmp_name, filename)
+    except BaseException:
+        try:
+            os.remove(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+
+    # Make the rename itself durable
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def content_hash(data : bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class BackupStore:
+    """
+    Keeps the last versions of a file. Versions are stored by content hash, i.e., identical versions are
+    stored only once. The store is a directory containing one file per version (named by its hash) and
+    an index (one JSON object per line, oldest version first).
+    """
+
+    def __init__(self, directory : str, limit : int):
+        """
+        :param directory: Directory of the store. It is created on the first backup.
+        :param limit: Number of versions to keep.
+        """
+        self.directory : str = directory
+        self.limit : int = limit
+        self._index_file : str = os.path.join(directory, "index")
+
+    @staticmethod
+    def for_file(filename : str, limit : int) -> 'BackupStore':
+        """
+        Returns the backup store of a file. It is located next to the file (".<file name>.backups").
+        :param filename: The file to keep versions of.
+        :param limit: Number of versions to keep.
+        :return: The backup store.
+        """
+        directory, name = os.path.split(os.path.abspath(filename))
+        return BackupStore(os.path.join(directory, "." + name + ".backups"), limit)
+
+    def versions(self) -> List[dict]:
+        """
+        Lists the stored versions.
+        :return: List of versions (newest first). Each version is a dictionary with the keys
+                 "hash", "ts" (time of the backup, seconds since the epoch) and "size" (bytes).
+        """
+        if not os.path.isfile(self._index_file):
+            return []
+        versions = []
+        with open(self._index_file) as f:
+            for line in f:
+                try:
+                    versions.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        versions.reverse()
+        return versions
+
+    def add(self, data : bytes) -> str:
+        """
+        Stores a version. If it equals the newest stored version, nothing is written.
+        :param data: The content of the version.
+        :return: The content hash of the version.
+        """
+        digest = content_hash(data)
+        versions = self.versions()
+        if versions and versions[0]['hash'] == digest:
+            return digest
+
+        os.makedirs(self.directory, exist_ok=True)
+        blob = os.path.join(self.directory, digest)
+        if not os.path.isfile(blob):
+            atomic_write(blob, data)
+        with open(self._index_file, "a") as f:
+            f.write(json.dumps({'hash': digest, 'ts': time.time(), 'size': len(data)}) + "\n")
+        if len(versions) + 1 > self.limit:
+            self._prune()
+        return digest
+
+    def _prune(self) -> None:
+        """
+        Removes all but the newest self.limit versions.
+        :return: Nothing
+        """
+        versions = self.versions()
+        keep = versions[:self.limit]
+        index = ''.join(json.dumps(v) + "\n" for v in reversed(keep))
+        atomic_write(self._index_file, index.encode())
+        referenced = set(v['hash'] for v in keep)
+        for v in versions[self.limit:]:
+            if v['hash'] not in referenced:
+                try:
+                    os.remove(os.path.join(self.directory, v['hash']))
+                except FileNotFoundError:
+                    pass
+
+    def find(self, prefix : str) -> Optional[str]:
+        """
+        Finds a version by (a prefix of) its hash.
+        :param prefix: Hash or unambiguous prefix of a hash.
+        :return: The full hash, or None if no version (or more than one version) matches.
+        """
+        matches = set(v['hash'] for v in self.versions() if v['hash'].startswith(prefix))
+        if len(matches) != 1:
+            return None
+        return matches.pop()
+
+    def get(self, digest : str) -> bytes:
+        """
+        Reads a stored version.
+        :param digest: The full content hash.
+        :return: The content.
+        """
+        with open(os.path.join(self.directory, digest), "rb") as f:
+            return f.read()
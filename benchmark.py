@@ -0,0 +1,489 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for WebsiteIndicator. Run with --help to list the available benchmarks.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, List, Optional
+
+from model import Database
+
+
+def build_tree(item_class : Callable[..., Database.Item], size : int, fanout : int = 20,
+               icons : bool = True) -> Database.Item:
+    """
+    Builds a synthetic bookmark tree.
+    Every fanout-th entry is a submenu, all other entries are websites.
+    :param item_class: Class used for the items (Database.Item or a subclass).
+    :param size: Total number of items in the tree.
+    :param fanout: Maximum number of children per menu.
+    :param icons: Whether the websites have (non-existing) icons.
+    :return: The top-level menu.
+    """
+    root = item_class(text="Menu", type=Database.Item.TYPE_MENU)
+    menus = [root]
+    current = 0
+    for i in range(1, size):
+        while len(menus[current].children) >= fanout:
+            current += 1
+        if i % fanout == 0:
+            item = item_class(text="Folder " + str(i), type=Database.Item.TYPE_MENU)
+            menus.append(item)
+        else:
+            item = item_class(text="Bookmark " + str(i), action="https://example.com/" + str(i),
+                              type=Database.Item.TYPE_WEB, icon="logo" + str(i % 50) + ".png" if icons else None)
+        menus[current].add_child(item)
+    return root
+
+
+class _DictItem:
+    """
+    Database.Item as it was before __slots__ was introduced: the same attributes, stored in a per-instance __dict__.
+    Not derived from Database.Item, since the inherited slots would hold the attributes.
+    """
+
+    def __init__(self, text : str = '', action : Optional[str] = None, type : str = Database.Item.TYPE_WEB,
+                 icon : Optional[str] = None):
+        self.text = text
+        self.action = action
+        self.type = type
+        self.children : List['_DictItem'] = []
+        self.icon = icon
+        Database.Item.GLOBAL_ID = Database.Item.GLOBAL_ID + 1
+        self.global_id = Database.Item.GLOBAL_ID
+
+    def add_child(self, child : '_DictItem') -> None:
+        self.children.append(child)
+
+    def get_children(self) -> List['_DictItem']:
+        return self.children
+
+
+def measure_memory(item_class : Callable[..., Database.Item], size : int) -> int:
+    """
+    Measures the memory allocated while building a tree.
+    :param item_class: Class used for the items.
+    :param size: Number of items.
+    :return: Allocated memory in bytes.
+    """
+    tracemalloc.start()
+    tree = build_tree(item_class, size)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tree
+    return current
+
+
+def bench_memory(args : dict) -> None:
+    size = args['size']
+    print(f"Memory for a tree with {size} items:")
+    results = {}
+    for name, item_class in (("__dict__ (old)", _DictItem), ("__slots__", Database.Item)):
+        start = time.perf_counter()
+        results[name] = measure_memory(item_class, size)
+        elapsed = time.perf_counter() - start
+        print(f"  {name:<16} {results[name] / 2**20:8.2f} MiB "
+              f"({results[name] / size:6.1f} bytes/item, built in {elapsed:.2f} s)")
+    saved = 1 - results["__slots__"] / results["__dict__ (old)"]
+    print(f"  saved: {saved * 100:.1f} %")
+
+
+def count_widgets(gtk_menu) -> int:
+    """
+    Counts the menu items of a Gtk menu including all (already created) submenus.
+    :param gtk_menu: The Gtk menu.
+    :return: Number of menu items.
+    """
+    count = 0
+    for widget in gtk_menu.get_children():
+        count += 1
+        submenu = widget.get_submenu()
+        if submenu is not None:
+            count += count_widgets(submenu)
+    return count
+
+
+def bench_menu(args : dict) -> None:
+    from menuview import MenuView
+
+    for size in args['sizes']:
+        database = Database("/dev/null", persistence='full')
+        database.data = build_tree(Database.Item, size, fanout=args['fanout'], icons=False)
+        database._reindex()
+        print(f"Menu for a tree with {size} items:")
+        for lazy in (False, True):
+            start = time.perf_counter()
+            gtk_menu = MenuView(database, lazy=lazy).build()
+            elapsed = time.perf_counter() - start
+            print(f"  {'lazy' if lazy else 'eager':<6} {elapsed * 1000:9.1f} ms, {count_widgets(gtk_menu):7d} widgets")
+            gtk_menu.destroy()
+
+
+def random_titles(count : int, seed : int = 42) -> list:
+    """
+    Creates random bookmark titles consisting of 2 to 5 pseudo words.
+    :param count: Number of titles.
+    :param seed: Seed of the random generator (the same seed gives the same titles).
+    :return: List of titles.
+    """
+    rng = random.Random(seed)
+    syllables = ["ka", "to", "ri", "ne", "mo", "sa", "lu", "pe", "di", "go", "ba", "fi", "wu", "ze", "hy", "qu"]
+    words = [''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).capitalize() for _ in range(3000)]
+    return [' '.join(rng.choice(words) for _ in range(rng.randint(2, 5))) for _ in range(count)]
+
+
+def bench_search(args : dict) -> None:
+    from searchindex import SearchIndex
+
+    for size in args['sizes']:
+        titles = random_titles(size)
+        rng = random.Random(size)
+        queries = [rng.choice(titles).split(' ')[0].lower() for _ in range(args['queries'])]
+
+        start = time.perf_counter()
+        index = SearchIndex()
+        for id, title in enumerate(titles):
+            index.add(id, title)
+        build_time = time.perf_counter() - start
+
+        print(f"Search in {size} items (index built in {build_time:.2f} s), latency per keystroke:")
+        for name in ("scan", "index"):
+            latencies = []
+            for query in queries:
+                # Simulate typing the query character by character
+                for length in range(1, len(query) + 1):
+                    prefix = query[:length]
+                    start = time.perf_counter()
+                    if name == "scan":
+                        [id for id, title in enumerate(titles) if prefix in title.lower()]
+                    else:
+                        index.search(prefix)
+                    latencies.append(time.perf_counter() - start)
+            print(f"  {name:<6} mean {statistics.mean(latencies) * 1000:8.2f} ms, "
+                  f"median {statistics.median(latencies) * 1000:8.2f} ms, max {max(latencies) * 1000:8.2f} ms")
+
+
+"""
+Command line arguments of main.py for the modes measured by the startup benchmark.
+"""
+STARTUP_MODES = {
+    'print-config': ['--print-config'],
+    'search': ['--search'],
+    'add': ['--add'],
+    'query': ['--query', 'kube'],
+    'indicator': [],
+}
+
+
+def run_startup(mode : str, timeout : float) -> Optional[dict]:
+    """
+    Starts main.py once in a mode with --exit-after-startup.
+    :param mode: One of STARTUP_MODES.
+    :param timeout: Maximum time to wait for the process (seconds).
+    :return: The startup times reported by main.py plus the total time of the process ('total'), None on errors.
+    """
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    start = time.perf_counter()
+    try:
+        process = subprocess.run([sys.executable, main] + STARTUP_MODES[mode] + ['--exit-after-startup'],
+                                 capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        print(f"  {mode:<13} timed out after {timeout} s")
+        return None
+    total = time.perf_counter() - start
+    for line in reversed(process.stdout.splitlines()):
+        if line.startswith('{"mode"'):
+            report = json.loads(line)
+            report['total'] = total
+            return report
+    error = process.stderr.strip().splitlines()
+    print(f"  {mode:<13} failed (exit code {process.returncode}): {error[-1] if error else 'no startup report'}")
+    return None
+
+
+def bench_startup(args : dict) -> None:
+    print(f"Startup times (median of {args['runs']} runs):")
+    results = {}
+    for mode in args['modes']:
+        reports = []
+        for _ in range(args['runs']):
+            report = run_startup(mode, args['timeout'])
+            if report is None:
+                break
+            reports.append(report)
+        if not reports:
+            continue
+        results[mode] = {key: statistics.median(report[key] for report in reports)
+                         for key in ('imports', 'first_menu', 'total')}
+        print(f"  {mode:<13} imports {results[mode]['imports'] * 1000:8.1f} ms, "
+              f"first menu/window {results[mode]['first_menu'] * 1000:8.1f} ms, "
+              f"process {results[mode]['total'] * 1000:8.1f} ms")
+
+    if args['save_baseline'] is not None:
+        with open(args['save_baseline'], 'w') as fp:
+            json.dump(results, fp, indent=2)
+        print("Baseline written to '" + args['save_baseline'] + "'.")
+    if args['baseline'] is not None:
+        with open(args['baseline'], 'r') as fp:
+            baseline = json.load(fp)
+        regressions = []
+        for mode, times in results.items():
+            for key, value in times.items():
+                reference = baseline.get(mode, {}).get(key)
+                if reference is not None and value > reference * (1 + args['tolerance']):
+                    regressions.append(f"{mode} {key}: {value * 1000:.1f} ms (baseline {reference * 1000:.1f} ms)")
+        if regressions:
+            print("Regressions (more than " + str(round(args['tolerance'] * 100)) + " % slower than the baseline):")
+            for regression in regressions:
+                print("  " + regression)
+            exit(1)
+        print("No regressions compared to '" + args['baseline'] + "'.")
+
+
+"""
+Storage settings of the modes of the stress benchmark: (storage, persistence, file name).
+"""
+STRESS_MODES = {
+    'full': ('xml', 'full', 'bookmarks.xml'),
+    'journal': ('xml', 'journal', 'bookmarks.xml'),
+    'sqlite': ('sqlite', None, 'bookmarks.sqlite'),
+}
+
+
+def stress_worker(filename : str, mode : str, worker : int, entries : int) -> None:
+    """
+    Loads the bookmark file once and adds entries one by one, saving after every entry (like an indicator whose
+    user adds bookmarks while other processes do the same).
+    :param filename: The bookmark file.
+    :param mode: One of STRESS_MODES.
+    :param worker: Number of the process (used in the names of the entries).
+    :param entries: Number of entries to add.
+    :return: Nothing
+    """
+    storage, persistence, _ = STRESS_MODES[mode]
+    database = Database(filename, persistence=persistence, storage=storage)
+    database.parse_file(loader='iterparse')
+    for i in range(entries):
+        database.add_item(database.data.global_id,
+                          Database.Item(text=f"Stress {worker}-{i}", action=f"https://example.com/{worker}/{i}"))
+        database.save_data()
+    database.compact()
+
+
+def bench_stress(args : dict) -> None:
+    processes, entries = args['processes'], args['entries']
+    failed = False
+    for mode in args['modes']:
+        storage, persistence, name = STRESS_MODES[mode]
+        directory = tempfile.mkdtemp(prefix="WebsiteIndicator-stress-")
+        try:
+            filename = os.path.join(directory, name)
+            Database(filename, persistence=persistence, storage=storage).storage.replace(
+                Database.Item(text="Menu", type=Database.Item.TYPE_MENU))
+            start = time.perf_counter()
+            workers = [multiprocessing.Process(target=stress_worker, args=(filename, mode, worker, entries))
+                       for worker in range(processes)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+
+            database = Database(filename, persistence=persistence, storage=storage)
+            database.parse_file(loader='iterparse')
+            found = {item.text for item in database.data.get_children()}
+            expected = {f"Stress {worker}-{i}" for worker in range(processes) for i in range(entries)}
+            lost = len(expected - found)
+            crashed = sum(1 for worker in workers if worker.exitcode != 0)
+            print(f"  {mode:<8} {processes} processes x {entries} entries: {elapsed:6.2f} s, "
+                  f"{processes * entries / elapsed:8.1f} saves/s, {lost} lost, {crashed} processes failed")
+            failed = failed or lost > 0 or crashed > 0
+        finally:
+            shutil.rmtree(directory)
+    if failed:
+        exit(1)
+
+
+def start_stub_server(hang : float):
+    """
+    Starts an HTTP server on 127.0.0.1 (in a thread) for the link check. Paths:
+    /ok (200), /redirect (301 to /ok), /no-head (405 for HEAD, 200 for GET), /dead (404), /hang (answers after
+    hang seconds).
+    :param hang: Delay of /hang (seconds).
+    :return: The server (see server_address) and a dict counting the requests ('requests', without /hang) and the
+             maximum number of requests being processed at the same time ('max_active').
+    """
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    stats = {'requests': 0, 'active': 0, 'max_active': 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def respond(self):
+            if self.path == '/hang':
+                # Not counted as active: the client gives up after the timeout, while the handler keeps sleeping
+                time.sleep(hang)
+                status, headers = 200, {}
+            else:
+                with lock:
+                    stats['requests'] += 1
+                    stats['active'] += 1
+                    stats['max_active'] = max(stats['max_active'], stats['active'])
+                # Long enough for concurrent requests to overlap
+                time.sleep(0.02)
+                headers = {}
+                if self.path == '/ok' or self.path.startswith('/ok?'):
+                    status = 200
+                elif self.path == '/redirect':
+                    status, headers = 301, {'Location': '/ok'}
+                elif self.path == '/no-head':
+                    status = 405 if self.command == 'HEAD' else 200
+                else:
+                    status = 404
+                # Before responding: the client sends its next request as soon as it has read the response
+                with lock:
+                    stats['active'] -= 1
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            if self.command == 'GET':
+                self.wfile.write(b"ok")
+
+        do_HEAD = respond
+        do_GET = respond
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+def bench_linkcheck(args : dict) -> None:
+    import linkcheck
+    server, stats = start_stub_server(hang=args['timeout'] * 3)
+    base = "http://127.0.0.1:" + str(server.server_address[1])
+    # path -> expected (state, status, location)
+    expected = {
+        '/ok': (linkcheck.STATE_OK, 200, None),
+        '/redirect': (linkcheck.STATE_REDIRECT, 200, base + '/ok'),
+        '/no-head': (linkcheck.STATE_OK, 200, None),
+        '/dead': (linkcheck.STATE_DEAD, 404, None),
+        '/hang': (linkcheck.STATE_ERROR, None, None),
+    }
+    # The same URLs several times in different menus are checked once, add some more to exercise the limits
+    urls = [base + path for path in expected] + [base + '/ok?' + str(i) for i in range(args['extra'])]
+    directory = tempfile.mkdtemp(prefix="WebsiteIndicator-linkcheck-")
+    failures = []
+    try:
+        cache_file = os.path.join(directory, 'links.json')
+        checker = linkcheck.LinkChecker(args['concurrency'], args['per_host'], args['timeout'])
+
+        cache = linkcheck.LinkCache(cache_file, max_age=3600)
+        start = time.perf_counter()
+        for result in checker.run(cache.stale(urls)):
+            cache.update(result)
+        elapsed = time.perf_counter() - start
+        cache.save()
+        print(f"  first run:  {len(urls)} links in {elapsed:.2f} s, {stats['requests']} requests, "
+              f"at most {stats['max_active']} at the same time")
+        for path, (state, status, location) in expected.items():
+            result = cache.get(base + path)
+            print(f"    {path:<10} {result.state:<9} {result.label()}")
+            if (result.state, result.status, result.location) != (state, status, location):
+                failures.append(f"{path}: expected {state} {status} {location}, got {result.state} {result.status} "
+                                f"{result.location} ({result.error})")
+        if stats['max_active'] > args['per_host']:
+            failures.append(f"{stats['max_active']} requests at the same time, at most {args['per_host']} expected")
+
+        # Second run: everything is served from the cache
+        requests = stats['requests']
+        cache = linkcheck.LinkCache(cache_file, max_age=3600)
+        stale = cache.stale(urls)
+        for result in checker.run(stale):
+            cache.update(result)
+        print(f"  second run: {len(stale)} of {len(urls)} links checked, {stats['requests'] - requests} requests")
+        if stale or stats['requests'] != requests:
+            failures.append("second run was not served from the cache")
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(directory)
+
+    if failures:
+        print("Failed:")
+        for failure in failures:
+            print("  " + failure)
+        exit(1)
+    print("All link checks passed.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="benchmark.py", description="Benchmarks for WebsiteIndicator.")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    subparser = subparsers.add_parser('memory', help="Memory used by the item tree (__slots__ vs. __dict__).")
+    subparser.add_argument('--size', type=int, default=100000, help="Number of items in the tree.")
+    subparser.set_defaults(func=bench_memory)
+
+    subparser = subparsers.add_parser('menu', help="Build time and widget count of the indicator menu (lazy vs. eager).")
+    subparser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                           help="Numbers of items in the tree.")
+    subparser.add_argument('--fanout', type=int, default=20, help="Maximum number of entries per menu.")
+    subparser.set_defaults(func=bench_menu)
+
+    subparser = subparsers.add_parser('search', help="Latency per keystroke of the search (index vs. full scan).")
+    subparser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                           help="Numbers of items.")
+    subparser.add_argument('--queries', type=int, default=5, help="Number of typed queries per size.")
+    subparser.set_defaults(func=bench_search)
+
+    subparser = subparsers.add_parser('startup', help="Import time and time to the first menu/window of the command "
+                                                      "line modes (main.py --exit-after-startup).")
+    subparser.add_argument('--modes', nargs='+', choices=list(STARTUP_MODES), default=list(STARTUP_MODES),
+                           help="Modes to measure.")
+    subparser.add_argument('--runs', type=int, default=5, help="Number of runs per mode.")
+    subparser.add_argument('--timeout', type=float, default=60, help="Maximum time per run (seconds).")
+    subparser.add_argument('--save-baseline', metavar='FILE', help="Writes the results to a JSON file.")
+    subparser.add_argument('--baseline', metavar='FILE',
+                           help="Compares the results with a JSON file written by --save-baseline and exits with "
+                                "status 1 if a mode got slower.")
+    subparser.add_argument('--tolerance', type=float, default=0.2,
+                           help="Allowed slowdown compared to the baseline (0.2 = 20 %%).")
+    subparser.set_defaults(func=bench_startup)
+
+    subparser = subparsers.add_parser('stress', help="Several processes adding entries to the same bookmark file at "
+                                                     "the same time (no entry may get lost).")
+    subparser.add_argument('--processes', type=int, default=4, help="Number of processes.")
+    subparser.add_argument('--entries', type=int, default=25, help="Number of entries added by each process.")
+    subparser.add_argument('--modes', nargs='+', choices=list(STRESS_MODES), default=list(STRESS_MODES),
+                           help="Storage backends/persistence modes to test.")
+    subparser.set_defaults(func=bench_stress)
+
+    subparser = subparsers.add_parser('linkcheck', help="Link checker against a local stub HTTP server (checks the "
+                                                        "results, the per-host limit and the cache).")
+    subparser.add_argument('--extra', type=int, default=50, help="Number of additional working links.")
+    subparser.add_argument('--concurrency', type=int, default=20, help="Maximum number of requests in total.")
+    subparser.add_argument('--per-host', type=int, default=4, help="Maximum number of requests per host.")
+    subparser.add_argument('--timeout', type=float, default=0.5, help="Timeout of a request (seconds).")
+    subparser.set_defaults(func=bench_linkcheck)
+
+    args = vars(parser.parse_args())
+    args['func'](args)
@@ -1,6 +1,5 @@
 import os
-
-import yaml
+from typing import Optional
 
 _SCRIPT_DIR = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
 _USER_CONFIG = os.path.join(os.getenv("HOME"), ".config")
@@ -12,31 +11,118 @@ if os.path.isdir(os.path.join(_USER_CONFIG, _APP_NAME)):
 else:
     _CONFIG_DIR = os.path.join(_SCRIPT_DIR)
 
-if os.path.isfile(os.path.join(_CONFIG_DIR, _CONFIG_FILE)):
-    with open(os.path.join(_CONFIG_DIR, _CONFIG_FILE), "r") as file:
-        config = yaml.safe_load(file)
-        # If config file is empty, make an empty dictionary
-        if not config:
-            config = {}
-else:
-    config = {}
+# The configuration, read on first use (see load_config)
+_config : Optional[dict] = None
 
-config['dir'] = _CONFIG_DIR
-config['script_dir'] = _SCRIPT_DIR
 
-# Default value
-if 'general' not in config:
-    config['general'] = {}
-if 'filter' not in config:
-    config['filter'] = {}
+def load_config() -> dict:
+    """
+    Reads the config file (only on the first call) and sets the default values.
+    The configuration can also be imported as "from config import config", which calls this function.
+    :return: The configuration.
+    """
+    global _config
+    if _config is not None:
+        return _config
+
+    if os.path.isfile(os.path.join(_CONFIG_DIR, _CONFIG_FILE)):
+        import yaml
+        with open(os.path.join(_CONFIG_DIR, _CONFIG_FILE), "r") as file:
+            # The C implementation of the loader is much faster, if available
+            config = yaml.load(file, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+            # If config file is empty, make an empty dictionary
+            if not config:
+                config = {}
+    else:
+        config = {}
+
+    config['dir'] = _CONFIG_DIR
+    config['script_dir'] = _SCRIPT_DIR
+
+    # Default value
+    if 'general' not in config:
+        config['general'] = {}
+    if 'filter' not in config:
+        config['filter'] = {}
+    if 'icons' not in config:
+        config['icons'] = {}
+    if 'menu' not in config:
+        config['menu'] = {}
+    if 'search' not in config:
+        config['search'] = {}
+    if 'links' not in config:
+        config['links'] = {}
+
+    if 'file_name' not in config['general']:
+        config['general']['file_name'] = "lesezeichen.xml"
+    if 'loader' not in config['general']:
+        config['general']['loader'] = "iterparse"
+    if 'storage' not in config['general']:
+        config['general']['storage'] = "auto"
+    if 'persistence' not in config['general']:
+        config['general']['persistence'] = "full"
+    if 'journal_max_size' not in config['general']:
+        config['general']['journal_max_size'] = 1024 * 1024
+    if 'journal_max_age' not in config['general']:
+        config['general']['journal_max_age'] = 24 * 60 * 60
+    if 'backup_count' not in config['general']:
+        config['general']['backup_count'] = 10
+    if 'background_load' not in config['general']:
+        config['general']['background_load'] = True
+    if 'watch' not in config['general']:
+        config['general']['watch'] = True
+    if 'watch_delay' not in config['general']:
+        config['general']['watch_delay'] = 500
+    if 'image_dir' not in config['general']:
+        config['general']['image_dir'] = os.path.join(_CONFIG_DIR, "logos")
+    else:
+        config['general']['image_dir'] = config['general']['image_dir']\
+            .replace("${CONFIG_DIR}", _CONFIG_DIR)\
+            .replace("${HOME}", os.getenv("HOME"))
+
+    if 'cache_size' not in config['icons']:
+        config['icons']['cache_size'] = 256
+    if 'thumbnails' not in config['icons']:
+        config['icons']['thumbnails'] = True
+    if 'thumbnail_dir' not in config['icons']:
+        config['icons']['thumbnail_dir'] = os.path.join(os.getenv("XDG_CACHE_HOME") or os.path.join(os.getenv("HOME"), ".cache"),
+                                                        _APP_NAME, "thumbnails")
+    else:
+        config['icons']['thumbnail_dir'] = config['icons']['thumbnail_dir']\
+            .replace("${CONFIG_DIR}", _CONFIG_DIR)\
+            .replace("${HOME}", os.getenv("HOME"))
+    if 'lazy' not in config['menu']:
+        config['menu']['lazy'] = False
+    if 'debounce' not in config['search']:
+        config['search']['debounce'] = 150
+    if 'top_k' not in config['search']:
+        config['search']['top_k'] = 50
+    if 'expand_limit' not in config['search']:
+        config['search']['expand_limit'] = 5000
+    if 'cache_file' not in config['links']:
+        config['links']['cache_file'] = os.path.join(os.getenv("XDG_CACHE_HOME") or os.path.join(os.getenv("HOME"), ".cache"),
+                                                     _APP_NAME, "links.json")
+    else:
+        config['links']['cache_file'] = config['links']['cache_file']\
+            .replace("${CONFIG_DIR}", _CONFIG_DIR)\
+            .replace("${HOME}", os.getenv("HOME"))
+    if 'max_age' not in config['links']:
+        config['links']['max_age'] = 7 * 24 * 60 * 60
+    if 'concurrency' not in config['links']:
+        config['links']['concurrency'] = 20
+    if 'per_host' not in config['links']:
+        config['links']['per_host'] = 2
+    if 'timeout' not in config['links']:
+        config['links']['timeout'] = 10
+
+    config['general']['file_path'] = os.path.join(_CONFIG_DIR, config['general']['file_name'])
+
+    _config = config
+    return config
 
-if 'file_name' not in config['general']:
-    config['general']['file_name'] = "lesezeichen.xml"
-if 'image_dir' not in config['general']:
-    config['general']['image_dir'] = os.path.join(_CONFIG_DIR, "logos")
-else:
-    config['general']['image_dir'] = config['general']['image_dir']\
-        .replace("${CONFIG_DIR}", _CONFIG_DIR)\
-        .replace("${HOME}", os.getenv("HOME"))
 
-config['general']['file_path'] = os.path.join(_CONFIG_DIR, config['general']['file_name'])
+def __getattr__(name : str):
+    # Module attribute "config", created on first access
+    if name == 'config':
+        return load_config()
+    raise AttributeError("module '" + __name__ + "' has no attribute '" + name + "'")
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Export of the bookmarks (or of a single menu) as Netscape bookmark file (HTML, can be imported by all browsers),
+JSON or CSV.
+
+The tree is walked by a generator (see walk) and every entry is written as soon as it is reached, i.e., apart from
+the tree itself, the memory used does not depend on the number of entries.
+"""
+import csv
+import html
+import json
+from typing import Callable, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from model import Database
+
+Item = Database.Item
+
+"""
+Events of walk.
+"""
+ENTER = 'enter'
+LEAVE = 'leave'
+ENTRY = 'entry'
+
+
+class ExportError(Exception):
+    """
+    The export failed (e.g., unknown format or id).
+    """
+    pass
+
+
+def walk(root : Item) -> Iterator[Tuple[str, Item, int]]:
+    """
+    Walks the entries of a menu in the order of the menu (depth-first, without recursion).
+    :param root: The menu. If it is no menu, only the entry itself is returned.
+    :return: (ENTER, menu, depth) when a submenu starts, (LEAVE, menu, depth) after its last entry and
+             (ENTRY, item, depth) for all other entries. The entries of root have depth 0.
+    """
+    entries = root.get_children() if root.type == Item.TYPE_MENU else [root]
+    # Iterators over the entries of the open menus, with the menu
+    stack : List[Tuple[Iterator[Item], Optional[Item]]] = [(iter(entries), None)]
+    while stack:
+        children, menu = stack[-1]
+        item = next(children, None)
+        if item is None:
+            stack.pop()
+            if menu is not None:
+                yield LEAVE, menu, len(stack) - 1
+        elif item.type == Item.TYPE_MENU:
+            yield ENTER, item, len(stack) - 1
+            stack.append((iter(item.get_children()), item))
+        else:
+            yield ENTRY, item, len(stack) - 1
+
+
+def export_html(root : Item, stream : TextIO) -> int:
+    """
+    Writes a Netscape bookmark file. Separators are kept, icons are not exported (browsers expect the image data).
+    :param root: The menu to export (its entries become the top-level entries of the file).
+    :param stream: The output (text).
+    :return: The number of exported entries (without separators).
+    """
+    title = html.escape(root.text or "Bookmarks")
+    stream.write("<!DOCTYPE NETSCAPE-Bookmark-file-1>\n"
+                 "<!-- This is an automatically generated file. It will be read and overwritten. DO NOT EDIT! -->\n"
+                 "<META HTTP-EQUIV=\"Content-Type\" CONTENT=\"text/html; charset=UTF-8\">\n"
+                 "<TITLE>" + title + "</TITLE>\n<H1>" + title + "</H1>\n<DL><p>\n")
+    count = 0
+    for event, item, depth in walk(root):
+        indent = "    " * (depth + 1)
+        if event == ENTER:
+            stream.write(indent + "<DT><H3>" + html.escape(item.text) + "</H3>\n" + indent + "<DL><p>\n")
+            count += 1
+        elif event == LEAVE:
+            stream.write(indent + "</DL><p>\n")
+        elif item.type == Item.TYPE_SEPARATOR:
+            stream.write(indent + "<HR>\n")
+        else:
+            stream.write(indent + "<DT><A HREF=\"" + html.escape(item.action or '') + "\">" + html.escape(item.text) +
+                         "</A>\n")
+            count += 1
+    stream.write("</DL><p>\n")
+    return count
+
+
+def _to_json(item : Item) -> str:
+    # The keys of the journal records (see storage.XmlBackend), without the children
+    return json.dumps({'text': item.text, 'action': item.action, 'type': item.type, 'icon': item.icon},
+                      ensure_ascii=False)
+
+
+def export_json(root : Item, stream : TextIO) -> int:
+    """
+    Writes the tree as JSON: every entry is an object with text, action, type and icon, menus have a list
+    of their entries (children).
+    :param root: The menu to export.
+    :param stream: The output (text).
+    :return: The number of exported entries (without separators).
+    """
+    if root.type != Item.TYPE_MENU:
+        stream.write(_to_json(root) + "\n")
+        return 0 if root.type == Item.TYPE_SEPARATOR else 1
+    # Whether the current list of children is still empty (one per open menu)
+    empty = [True]
+
+    def begin(indent):
+        stream.write("\n" + indent if empty[-1] else ",\n" + indent)
+        empty[-1] = False
+
+    stream.write(_to_json(root)[:-1] + ", \"children\": [")
+    count = 0
+    for event, item, depth in walk(root):
+        indent = "  " * (depth + 1)
+        if event == ENTER:
+            begin(indent)
+            stream.write(_to_json(item)[:-1] + ", \"children\": [")
+            empty.append(True)
+            count += 1
+        elif event == LEAVE:
+            stream.write("]}" if empty.pop() else "\n" + indent + "]}")
+        else:
+            begin(indent)
+            stream.write(_to_json(item))
+            if item.type != Item.TYPE_SEPARATOR:
+                count += 1
+    stream.write("]}\n" if empty[-1] else "\n]}\n")
+    return count
+
+
+def export_csv(root : Item, stream : TextIO) -> int:
+    """
+    Writes one row per entry (without separators): id, text, action, type, icon and folder (the names of the menus
+    containing the entry below root, separated by "/").
+    :param root: The menu to export.
+    :param stream: The output (text, opened with newline='').
+    :return: The number of exported entries.
+    """
+    writer = csv.writer(stream)
+    writer.writerow(['id', 'text', 'action', 'type', 'icon', 'folder'])
+    folder : List[str] = []
+    count = 0
+    for event, item, depth in walk(root):
+        if event == LEAVE:
+            folder.pop()
+            continue
+        if item.type != Item.TYPE_SEPARATOR:
+            writer.writerow([item.global_id, item.text, item.action or '', item.type, item.icon or '',
+                             "/".join(folder)])
+            count += 1
+        if event == ENTER:
+            folder.append(item.text)
+    return count
+
+
+"""
+Available formats: name -> function writing the entries of a menu to a stream.
+"""
+EXPORTERS : Dict[str, Callable[[Item, TextIO], int]] = {
+    'html': export_html,
+    'json': export_json,
+    'csv': export_csv,
+}
+
+
+def export(database : Database, format : str, filename : str, id : Optional[int] = None) -> int:
+    """
+    Exports the bookmarks to a file.
+    :param database: The database.
+    :param format: One of EXPORTERS.
+    :param filename: The output file (overwritten).
+    :param id: If given, only the entry with this id (e.g., a menu) is exported.
+    :return: The number of exported entries (without separators, which only the HTML and JSON formats keep).
+    :raises ExportError: If the format or the id is unknown.
+    :raises OSError: If the file cannot be written.
+    """
+    exporter = EXPORTERS.get(format)
+    if exporter is None:
+        raise ExportError("Unknown format '" + str(format) + "'. Expected one of: " + ", ".join(EXPORTERS))
+    root = database.data if id is None else database.get_item(id)
+    if root is None:
+        raise ExportError("No entry with id " + str(id) + ".")
+    with open(filename, 'w', encoding='utf-8', newline='') as stream:
+        return exporter(root, stream)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+from typing import Callable, List, Optional, Set
+
+import gi
+gi.require_version('Gio', '2.0')
+from gi.repository import Gio, GLib
+
+
+class FileWatcher:
+    """
+    Watches files and directories for changes (Gio.FileMonitor, which uses inotify on Linux).
+
+    Editors and our own saves usually cause a burst of events (e.g., writing a temporary file and renaming it).
+    The events are collected, and the callback is called once no more events arrived for a while.
+    """
+
+    """
+    Events that do not change the contents of a file.
+    """
+    IGNORED_EVENTS = (Gio.FileMonitorEvent.ATTRIBUTE_CHANGED, Gio.FileMonitorEvent.PRE_UNMOUNT,
+                      Gio.FileMonitorEvent.UNMOUNTED)
+
+    def __init__(self, callback : Callable[[Set[str]], None], delay : int):
+        """
+        :param callback: Called with the paths of the changed files (absolute paths).
+        :param delay: Milliseconds without events before the callback is called.
+        """
+        self.callback : Callable[[Set[str]], None] = callback
+        self.delay : int = delay
+        self._monitors : List[Gio.FileMonitor] = []
+        self._changed : Set[str] = set()
+        # Source id of the pending GLib timeout
+        self._timeout : Optional[int] = None
+
+    def watch_file(self, filename : str) -> None:
+        """
+        Watches a file. Replacing the file (e.g., by renaming another file) is reported as change, too.
+        :param filename: The file.
+        :return: Nothing
+        """
+        filename = os.path.abspath(filename)
+        monitor = Gio.File.new_for_path(filename).monitor_file(Gio.FileMonitorFlags.WATCH_MOVES, None)
+        # Report the watched name, whatever file name the event refers to
+        monitor.connect('changed', lambda monitor, file, other_file, event_type:
+                        self._on_event(event_type, [filename]))
+        self._monitors.append(monitor)
+
+    def watch_directory(self, directory : str) -> None:
+        """
+        Watches the files of a directory (not recursive).
+        :param directory: The directory.
+        :return: Nothing
+        """
+        if not os.path.isdir(directory):
+            return
+        monitor = Gio.File.new_for_path(directory).monitor_directory(Gio.FileMonitorFlags.WATCH_MOVES, None)
+        monitor.connect('changed', lambda monitor, file, other_file, event_type:
+                        self._on_event(event_type, [f.get_path() for f in (file, other_file) if f is not None]))
+        self._monitors.append(monitor)
+
+    def _on_event(self, event_type : Gio.FileMonitorEvent, paths : List[str]) -> None:
+        if event_type in FileWatcher.IGNORED_EVENTS:
+            return
+        self._changed.update(paths)
+        # Wait until the burst is over
+        if self._timeout is not None:
+            GLib.source_remove(self._timeout)
+        self._timeout = GLib.timeout_add(self.delay, self._flush)
+
+    def _flush(self) -> bool:
+        self._timeout = None
+        changed, self._changed = self._changed, set()
+        self.callback(changed)
+        return False # do not call again
+
+    def close(self) -> None:
+        """
+        Stops watching. Pending changes are discarded.
+        :return: Nothing
+        """
+        for monitor in self._monitors:
+            monitor.cancel()
+        self._monitors = []
+        if self._timeout is not None:
+            GLib.source_remove(self._timeout)
+            self._timeout = None
+        self._changed = set()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import gi
+
+from config import config
+
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import GdkPixbuf as pixbuf
+
+"""
+Size (width and height) of the icons in the menus.
+"""
+ICON_SIZE = 25
+
+
+class PixbufCache:
+    """
+    Bounded cache of scaled icons (least recently used entries are dropped first).
+    Entries are keyed by (resolved path, modification time, width, height), i.e., a changed file is loaded again.
+    """
+
+    def __init__(self, limit : int):
+        """
+        :param limit: Maximum number of cached icons.
+        """
+        self.limit : int = limit
+        self.hits : int = 0
+        self.misses : int = 0
+        self._entries : OrderedDict[Tuple[str, int, int, int], pixbuf.Pixbuf] = OrderedDict()
+
+    def get(self, filename : str, width : int = ICON_SIZE, height : int = ICON_SIZE) -> pixbuf.Pixbuf:
+        """
+        Returns the icon scaled to the given size. It is only decoded if it is not in the cache.
+        :param filename: Path of the image file.
+        :param width: Target width.
+        :param height: Target height.
+        :return: The scaled image.
+        """
+        path = os.path.realpath(filename)
+        key = (path, os.stat(path).st_mtime_ns, width, height)
+        pb = self._entries.get(key)
+        if pb is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return pb
+
+        self.misses += 1
+        if config['icons']['thumbnails']:
+            pb = thumbnail_cache.get(path, width, height)
+        else:
+            pb = pixbuf.Pixbuf.new_from_file(path)
+            pb = pb.scale_simple(width, height, pixbuf.InterpType.BILINEAR)
+        self._entries[key] = pb
+        while len(self._entries) > self.limit:
+            self._entries.popitem(last=False)
+        return pb
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __str__(self) -> str:
+        return "PixbufCache[entries=" + str(len(self)) + "/" + str(self.limit) + ", hits=" + str(self.hits) + \
+            ", misses=" + str(self.misses) + "]"
+
+
+class ThumbnailCache:
+    """
+    Persistent cache of scaled icons (PNG files) in the user's cache directory, so that large images do not have to
+    be decoded at every start. Like in the freedesktop.org thumbnail specification, the modification time and size
+    of the source file are stored in the thumbnail, and thumbnails of changed files are created again.
+    """
+
+    def __init__(self, directory : str):
+        """
+        :param directory: Directory containing the thumbnails (one subdirectory per size).
+        """
+        self.directory : str = directory
+
+    def path_for(self, filename : str, width : int, height : int) -> str:
+        """
+        :param filename: Resolved path of the source image.
+        :param width: Width of the thumbnail.
+        :param height: Height of the thumbnail.
+        :return: Path of the thumbnail.
+        """
+        name = hashlib.sha1(filename.encode()).hexdigest() + ".png"
+        return os.path.join(self.directory, str(width) + "x" + str(height), name)
+
+    def load(self, filename : str, width : int, height : int) -> Optional[pixbuf.Pixbuf]:
+        """
+        Loads a thumbnail, if it exists and is up to date.
+        :param filename: Resolved path of the source image.
+        :param width: Width of the thumbnail.
+        :param height: Height of the thumbnail.
+        :return: The thumbnail or None.
+        """
+        thumbnail = self.path_for(filename, width, height)
+        if not os.path.isfile(thumbnail):
+            return None
+        st = os.stat(filename)
+        try:
+            pb = pixbuf.Pixbuf.new_from_file(thumbnail)
+        except Exception:
+            # Broken thumbnail, it is replaced on the next create()
+            return None
+        if pb.get_option('tEXt::Thumb::MTime') != str(st.st_mtime_ns) or \
+                pb.get_option('tEXt::Thumb::Size') != str(st.st_size):
+            return None
+        return pb
+
+    def create(self, filename : str, width : int, height : int) -> pixbuf.Pixbuf:
+        """
+        Decodes and scales the source image and stores the result as thumbnail.
+        :param filename: Resolved path of the source image.
+        :param width: Width of the thumbnail.
+        :param height: Height of the thumbnail.
+        :return: The thumbnail.
+        """
+        st = os.stat(filename)
+        pb = pixbuf.Pixbuf.new_from_file_at_scale(filename, width, height, False)
+        thumbnail = self.path_for(filename, width, height)
+        tmp_name = None
+        try:
+            os.makedirs(os.path.dirname(thumbnail), exist_ok=True)
+            # Write to a temporary file first, so that concurrent readers never see partial files.
+            fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(thumbnail), suffix=".tmp")
+            os.close(fd)
+            pb.savev(tmp_name, "png", ['tEXt::Thumb::MTime', 'tEXt::Thumb::Size'],
+                     [str(st.st_mtime_ns), str(st.st_size)])
+            os.replace(tmp_name, thumbnail)
+        except Exception as e:
+            if tmp_name is not None and os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            # The cache is optional, the icon can be used anyway.
+            print("Could not store thumbnail of '" + filename + "':", str(e))
+        return pb
+
+    def get(self, filename : str, width : int = ICON_SIZE, height : int = ICON_SIZE) -> pixbuf.Pixbuf:
+        """
+        Returns the thumbnail of an image and creates it if necessary.
+        :param filename: Path of the source image.
+        :param width: Width of the thumbnail.
+        :param height: Height of the thumbnail.
+        :return: The thumbnail.
+        """
+        filename = os.path.realpath(filename)
+        pb = self.load(filename, width, height)
+        if pb is None:
+            pb = self.create(filename, width, height)
+        return pb
+
+    def rebuild(self, image_dir : str, width : int = ICON_SIZE, height : int = ICON_SIZE) -> int:
+        """
+        Creates missing and outdated thumbnails of all images in a directory.
+        :param image_dir: Directory containing the images.
+        :param width: Width of the thumbnails.
+        :param height: Height of the thumbnails.
+        :return: Number of created thumbnails.
+        """
+        created = 0
+        try:
+            names = os.listdir(image_dir)
+        except OSError:
+            return 0
+        for name in names:
+            filename = os.path.realpath(os.path.join(image_dir, name))
+            if not os.path.isfile(filename):
+                continue
+            try:
+                if self.load(filename, width, height) is None:
+                    self.create(filename, width, height)
+                    created += 1
+            except Exception as e:
+                # E.g., not an image
+                print("Could not create thumbnail of '" + filename + "':", str(e))
+        return created
+
+    def rebuild_in_background(self, image_dir : str) -> threading.Thread:
+        """
+        Runs rebuild() in a background thread.
+        :param image_dir: Directory containing the images.
+        :return: The (started) thread.
+        """
+        thread = threading.Thread(target=self.rebuild, args=(image_dir,), name="thumbnails", daemon=True)
+        thread.start()
+        return thread
+
+
+"""
+Caches shared by all menus and windows.
+"""
+thumbnail_cache = ThumbnailCache(config['icons']['thumbnail_dir'])
+pixbuf_cache = PixbufCache(config['icons']['cache_size'])
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Import of browser bookmarks: Firefox (places.sqlite) and Netscape bookmark files (the HTML format all browsers
+export). The files are read as stream and converted to a detached tree of Database.Item, which can be added to a
+database at once (see main.py --import), i.e., with a single change event and a single save.
+
+Folders become menus (TYPE_MENU), bookmarks become websites (TYPE_WEB), separators are kept.
+"""
+import os
+import sqlite3
+from html.parser import HTMLParser
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.request import pathname2url
+
+from model import Database
+
+Item = Database.Item
+
+"""
+Called with the number of entries read so far (every PROGRESS_INTERVAL entries and at the end).
+"""
+ProgressCallback = Callable[[int], None]
+PROGRESS_INTERVAL = 1000
+
+"""
+Number of characters of HTML files parsed at once.
+"""
+CHUNK_SIZE = 1 << 16
+
+"""
+Names of the root folders of Firefox (by their guid). The tags folder is not imported, tags are no bookmarks.
+"""
+FIREFOX_ROOTS = {
+    'menu________': "Bookmarks Menu",
+    'toolbar_____': "Bookmarks Toolbar",
+    'unfiled_____': "Other Bookmarks",
+    'mobile______': "Mobile Bookmarks",
+}
+FIREFOX_ROOT = 'root________'
+FIREFOX_TAGS = 'tags________'
+
+"""
+Types of moz_bookmarks entries.
+"""
+FIREFOX_BOOKMARK = 1
+FIREFOX_FOLDER = 2
+FIREFOX_SEPARATOR = 3
+
+"""
+Formats supported by import_file.
+"""
+FORMATS = ['firefox', 'html']
+
+
+class BookmarkImportError(Exception):
+    """
+    The file could not be read or has an unsupported format.
+    """
+    pass
+
+
+def guess_format(filename : str) -> str:
+    """
+    :param filename: The file to import.
+    :return: One of FORMATS, chosen by the content of the file.
+    :raises BookmarkImportError: If the file cannot be read.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            header = f.read(16)
+    except OSError as e:
+        raise BookmarkImportError("Could not read '" + filename + "': " + str(e))
+    return 'firefox' if header == b"SQLite format 3\x00" else 'html'
+
+
+def import_file(filename : str, format : Optional[str] = None,
+                progress : Optional[ProgressCallback] = None) -> Item:
+    """
+    Reads the bookmarks of a file.
+    :param filename: The file.
+    :param format: One of FORMATS. If not given, it is guessed from the content (see guess_format).
+    :param progress: Called with the number of entries read so far.
+    :return: A menu (named after the file) containing the bookmarks.
+    :raises BookmarkImportError: If the file cannot be read.
+    """
+    if format is None:
+        format = guess_format(filename)
+    if format == 'firefox':
+        root, count = import_firefox(filename, progress)
+    elif format == 'html':
+        root, count = import_html(filename, progress)
+    else:
+        raise BookmarkImportError("Unknown format '" + str(format) + "'. Expected one of: " + ", ".join(FORMATS))
+    if progress is not None:
+        progress(count)
+    return root
+
+
+def import_firefox(filename : str, progress : Optional[ProgressCallback] = None) -> Tuple[Item, int]:
+    """
+    Reads the bookmarks of a Firefox profile.
+    The database is opened read-only as immutable, i.e., it can be read while Firefox is running (changes that
+    Firefox has not written to the database file yet are missing).
+    :param filename: The places.sqlite file.
+    :param progress: Called with the number of entries read so far.
+    :return: A menu containing the bookmarks and the number of entries.
+    :raises BookmarkImportError: If the file cannot be read.
+    """
+    root = Item(text=os.path.basename(filename), type=Item.TYPE_MENU)
+    # id -> item (the root folder of Firefox is replaced by our menu)
+    items : Dict[int, Item] = {}
+    # (parent id, item) in the order of the file. The entries are attached at the end, since a folder may have
+    # been moved into a folder created later (i.e., the parent is not always read first).
+    rows : List[Tuple[int, Item]] = []
+    try:
+        connection = sqlite3.connect("file:" + pathname2url(os.path.abspath(filename)) + "?immutable=1", uri=True)
+        try:
+            cursor = connection.execute(
+                "SELECT b.id, b.type, b.parent, b.title, b.guid, p.url FROM moz_bookmarks b "
+                "LEFT JOIN moz_places p ON b.fk = p.id ORDER BY b.parent, b.position")
+            for id, type, parent, title, guid, url in cursor:
+                if guid == FIREFOX_ROOT:
+                    items[id] = root
+                    continue
+                if guid == FIREFOX_TAGS:
+                    # The tag folders below are not attached to the tree
+                    continue
+                if type == FIREFOX_FOLDER:
+                    item = Item(text=FIREFOX_ROOTS.get(guid, title or ''), type=Item.TYPE_MENU)
+                elif type == FIREFOX_SEPARATOR:
+                    item = Item(text='', type=Item.TYPE_SEPARATOR)
+                elif url is None or url.startswith("place:"):
+                    # Queries ("smart bookmarks") and broken entries
+                    continue
+                else:
+                    item = Item(text=title or url, action=url, type=Item.TYPE_WEB)
+                items[id] = item
+                rows.append((parent, item))
+                if progress is not None and len(rows) % PROGRESS_INTERVAL == 0:
+                    progress(len(rows))
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        raise BookmarkImportError("Could not read the Firefox bookmarks in '" + filename + "': " + str(e))
+
+    for parent, item in rows:
+        if parent in items:
+            items[parent].add_child(item)
+    return root, count_entries(root)
+
+
+def count_entries(root : Item) -> int:
+    """
+    :param root: A menu.
+    :return: The number of entries in the menu and its submenus (without the menu itself).
+    """
+    count = 0
+    stack = [root]
+    while stack:
+        children = stack.pop().get_children()
+        count += len(children)
+        stack.extend(children)
+    return count
+
+
+class NetscapeParser(HTMLParser):
+    """
+    Streaming parser of Netscape bookmark files:
+
+        <DL><p>
+            <DT><H3>Folder</H3>
+            <DL><p>
+                <DT><A HREF="https://example.com" ICON="data:...">Title</A>
+                <HR>
+            </DL><p>
+        </DL><p>
+
+    The entries are added to the tree while reading (feed the file in pieces).
+    """
+
+    def __init__(self, root : Item, progress : Optional[ProgressCallback] = None):
+        super().__init__(convert_charrefs=True)
+        self.root : Item = root
+        self.progress : Optional[ProgressCallback] = progress
+        self.count : int = 0
+        # The menus of the open <DL> tags. The top-level list is added to the root.
+        self._menus : List[Item] = []
+        # The last folder (<H3>), whose entries follow in the next <DL>
+        self._folder : Optional[Item] = None
+        # The entry whose text is being read (<H3> or <A>)
+        self._current : Optional[Item] = None
+        self._text : List[str] = []
+
+    def _add(self, item : Item) -> None:
+        (self._menus[-1] if self._menus else self.root).add_child(item)
+        self.count += 1
+        if self.progress is not None and self.count % PROGRESS_INTERVAL == 0:
+            self.progress(self.count)
+
+    def handle_starttag(self, tag : str, attrs : List[Tuple[str, Optional[str]]]) -> None:
+        if tag == 'dl':
+            if self._folder is not None:
+                self._menus.append(self._folder)
+                self._folder = None
+            elif self._menus:
+                # A list without folder title, keep its entries in the current menu
+                self._menus.append(self._menus[-1])
+            else:
+                self._menus.append(self.root)
+        elif tag == 'h3':
+            self._folder = None
+            self._current = Item(text='', type=Item.TYPE_MENU)
+            self._text = []
+        elif tag == 'a':
+            href = dict(attrs).get('href')
+            if href and not href.startswith("place:"):
+                self._current = Item(text='', action=href, type=Item.TYPE_WEB)
+                self._text = []
+        elif tag == 'hr' and self._menus:
+            self._add(Item(text='', type=Item.TYPE_SEPARATOR))
+
+    def handle_endtag(self, tag : str) -> None:
+        if tag == 'dl':
+            if self._menus:
+                self._menus.pop()
+            self._folder = None
+        elif tag in ('h3', 'a') and self._current is not None:
+            item = self._current
+            self._current = None
+            item.text = "".join(self._text).strip() or (item.action or '')
+            self._add(item)
+            if tag == 'h3':
+                self._folder = item
+
+    def handle_data(self, data : str) -> None:
+        if self._current is not None:
+            self._text.append(data)
+
+
+def import_html(filename : str, progress : Optional[ProgressCallback] = None) -> Tuple[Item, int]:
+    """
+    Reads a Netscape bookmark file (exported by Firefox, Chrome and most other browsers).
+    :param filename: The HTML file.
+    :param progress: Called with the number of entries read so far.
+    :return: A menu containing the bookmarks and the number of entries.
+    :raises BookmarkImportError: If the file cannot be read.
+    """
+    root = Item(text=os.path.basename(filename), type=Item.TYPE_MENU)
+    parser = NetscapeParser(root, progress)
+    try:
+        with open(filename, 'r', encoding='utf-8', errors='replace') as f:
+            while True:
+                data = f.read(CHUNK_SIZE)
+                if not data:
+                    break
+                parser.feed(data)
+        parser.close()
+    except OSError as e:
+        raise BookmarkImportError("Could not read '" + filename + "': " + str(e))
+    return root, parser.count
@@ -0,0 +1,611 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The graphical modes of WebsiteIndicator: the indicator and its menu, the search window and the window to add a new
+entry (see main.py). The windows and the menu view are imported on first use.
+"""
+import os
+import signal
+import threading
+from typing import Callable, List, Optional, TYPE_CHECKING
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk as gtk
+from gi.repository import GLib
+
+from config import config
+from model import Database
+
+if TYPE_CHECKING:
+    from gi.repository import AyatanaAppIndicator3 as appindicator
+    from filewatch import FileWatcher
+    import ipc
+    from menuview import MenuView
+
+
+APPINDICATOR_ID = 'lesezeichen'
+
+# The data of the current indicator menu (None while loading)
+_database : Optional[Database] = None
+# The view of the current indicator menu (used to update the menu after changes)
+_menu_view : Optional['MenuView'] = None
+# Watches the bookmark file and the images of the current menu, see watch_files
+_watcher : Optional['FileWatcher'] = None
+# Number of the current background load (results of older loads are discarded), see load_database_in_background
+_load_number : int = 0
+# Actions waiting for the background load to finish (e.g., "Search" was clicked while loading)
+_pending_actions : List[Callable[[Database], None]] = []
+# Called once when the first window or the complete indicator menu has been shown (see startup_done)
+on_startup : Optional[Callable[[], None]] = None
+
+
+def quit(source = None, database : Optional[Database] = None) -> None:
+    """
+    Quit the whole program.
+    :param source: Source widget, if called via a button click. Currently not used.
+    :param database: If given, pending changes (journal) are written to the bookmark file before quitting.
+    :return: Nothing
+    """
+    if database is not None:
+        database.compact()
+    gtk.main_quit()
+
+
+def ensure_file_exists() -> None:
+    """
+    If bookmark database file does not exist, ask whether it should be created or not.
+    If the user chooses "yes", then an empty file is created (could be improved later ...), otherwise the program
+    is quit.
+    :return: Nothing
+    """
+    if os.path.isfile(config['general']['file_path']):
+        return
+    # FIXME: If parent is none, the message dialog is shown in background ...
+    # This is why a temporary window is created ... but a better solution should be found ...
+    parent = gtk.Window()
+    parent.set_default_size(0, 0)
+    parent.show()
+    dialog = gtk.MessageDialog(parent, gtk.DialogFlags.MODAL,
+                               gtk.MessageType.QUESTION, gtk.ButtonsType.YES_NO)
+    dialog.set_title("Bookmark file does not exist")
+    dialog.set_markup("File '" + config['general']['file_path'] + "' does not exist. " +
+                      "Create it?\n\nNote: If you choose 'No', the program is quited.")
+    dialog.set_icon_name("dialog-question")
+    response = dialog.run()
+    dialog.destroy()
+    if response == gtk.ResponseType.YES:
+        with open(config['general']['file_path'], 'w') as fp:
+            pass
+        parent.destroy()
+    else:
+        parent.destroy()
+        quit()
+        exit(0)
+
+
+def create_database() -> Database:
+    """
+    Read the (database) file and return a database object.
+    :return: database containing the bookmark entries
+    """
+    try:
+        database = Database(config['general']['file_path'])
+
+        ensure_file_exists()
+
+        # If the file was empty, ask how to proceed.
+        if not database.parse_file():
+            # FIXME: If parent is none, the message dialog is shown in background ...
+            # This is why a temporary window is created ... but a better solution should be found ...
+            parent = gtk.Window()
+            parent.set_default_size(0, 0)
+            parent.show()
+            dialog = gtk.MessageDialog(parent, gtk.DialogFlags.MODAL,
+                                       gtk.MessageType.QUESTION, gtk.ButtonsType.YES_NO)
+            dialog.set_title("Bookmark file empty")
+            dialog.set_markup("File '" + config['general']['file_path'] + "' was empty. " +
+                                   "Hence, a new menu was created. If this is an error and there should be an existing "
+                                   "database file, please check the config file '"+str(config['dir'])+"/config.yml'.\n"
+                                   "Do you want to proceed?")
+            dialog.set_icon_name("dialog-question")
+            response = dialog.run()
+            dialog.destroy()
+            if response != gtk.ResponseType.YES:
+                parent.destroy()
+                quit()
+                exit(0)
+            else:
+                parent.destroy()
+    except Exception as e:
+        # File not found, not access rights etc.
+        print("Exception: ",str(e))
+        # FIXME: If parent is none, the message dialog is shown in background ...
+        # This is why a temporary window is created ... but a better solution should be found ...
+        parent = gtk.Window()
+        parent.set_default_size(0,0)
+        parent.show()
+        md = gtk.MessageDialog(parent, gtk.DialogFlags.MODAL, gtk.MessageType.ERROR,
+                               gtk.ButtonsType.CLOSE)
+        md.set_title("Error parsing XML file")
+        md.set_markup("Error parsing XML file '"+config['general']['file_path']+"':\n" + str(e))
+        md.run()
+        md.destroy()
+        exit(1)
+    return database
+
+
+def create_menu(indicator : Optional['appindicator.Indicator'], database : Optional[Database] = None) -> None:
+    """
+    Create the menu for the indicator and sets it.
+    :param indicator: Gtk indicator (AyatanaAppIndicator3 or AppIndicator3).
+    :param database: Data to be displayed in the menu, if already available.
+    :return: Nothing
+    """
+    # At first call, when the input file has not been read, read the file.
+    # If we, on the other hand, already have read the data, use it from the parameter.
+    if database is None:
+        database = create_database()
+    # If the search window was started using --search, then create_menu is called with indicator=None.
+    # We do not have to create a new menu and can return.
+    if indicator is None:
+        return
+
+    from menuview import MenuView
+    global _menu_view, _database
+    _database = database
+    _menu_view = MenuView(database)
+    menu = _menu_view.build()
+    menu.append(gtk.SeparatorMenuItem())
+
+    # Add default entries
+    menu.append(create_menu_item('Search', gtk.Image.new_from_icon_name("search", gtk.IconSize.MENU),
+                                 lambda source: show_search_window(indicator, database)))
+    menu.append(create_menu_item('Reload file', image_from_file('reload.png'),
+                                 lambda source: reload_file(indicator, database)))
+    menu.append(create_menu_item('New entry', image_from_file('add.png'),
+                                 lambda source: add_new_entry_window(indicator, database)))
+    # Quit-Button
+    menu.append(create_menu_item('Beenden', gtk.Image.new_from_icon_name("window-close", gtk.IconSize.MENU),
+                                 lambda source: quit(source, database)))
+
+    menu.show_all()
+
+    indicator.set_menu(menu)
+    watch_files(indicator, database)
+    startup_done()
+
+
+def create_menu_item(label : str, image : gtk.Image, callback : Callable[[gtk.MenuItem], None]) -> gtk.MenuItem:
+    """
+    Creates one of the default entries of the indicator menu.
+    :param label: Text of the entry.
+    :param image: Icon of the entry.
+    :param callback: Called when the entry is clicked.
+    :return: The menu item.
+    """
+    item = gtk.ImageMenuItem(label)
+    item.set_image(image)
+    item.set_always_show_image(True)
+    item.connect('activate', callback)
+    return item
+
+
+def image_from_file(name : str) -> gtk.Image:
+    img = gtk.Image()
+    img.set_from_file(os.path.join(config['script_dir'], 'default_images', name))
+    return img
+
+
+def load_menu(indicator : 'appindicator.Indicator') -> None:
+    """
+    (Re)reads the bookmark file and creates the menu of the indicator, in the background if
+    config['general']['background_load'] is set.
+    :param indicator: Gtk indicator (AyatanaAppIndicator3 or AppIndicator3).
+    :return: Nothing
+    """
+    if config['general']['background_load']:
+        load_database_in_background(indicator)
+    else:
+        create_menu(indicator)
+
+
+def create_placeholder_menu(indicator : 'appindicator.Indicator', status : str) -> None:
+    """
+    Sets a minimal menu that is shown while the bookmark file is read (or if it could not be read).
+    :param indicator: Gtk indicator (AyatanaAppIndicator3 or AppIndicator3).
+    :param status: Text of the first (inactive) entry, e.g., "Loading…".
+    :return: Nothing
+    """
+    global _menu_view, _database
+    _menu_view = None
+    _database = None
+    menu = gtk.Menu()
+    item = gtk.MenuItem(status)
+    item.set_sensitive(False)
+    menu.append(item)
+    menu.append(gtk.SeparatorMenuItem())
+    menu.append(create_menu_item('Search', gtk.Image.new_from_icon_name("search", gtk.IconSize.MENU),
+                                 lambda source: when_loaded(lambda database: show_search_window(indicator, database))))
+    menu.append(create_menu_item('Reload file', image_from_file('reload.png'), lambda source: load_menu(indicator)))
+    menu.append(create_menu_item('Beenden', gtk.Image.new_from_icon_name("window-close", gtk.IconSize.MENU),
+                                 lambda source: quit(source)))
+    menu.show_all()
+    indicator.set_menu(menu)
+
+
+def when_loaded(action : Callable[[Database], None]) -> None:
+    """
+    Runs an action as soon as the background load has finished successfully.
+    :param action: Function receiving the database.
+    :return: Nothing
+    """
+    _pending_actions.append(action)
+
+
+def with_database(action : Callable[[Database], None]) -> None:
+    """
+    Runs an action with the database of the indicator menu, as soon as it is loaded.
+    :param action: Function receiving the database.
+    :return: Nothing
+    """
+    if _database is not None:
+        action(_database)
+    else:
+        when_loaded(action)
+
+
+def load_database_in_background(indicator : 'appindicator.Indicator') -> None:
+    """
+    Shows a placeholder menu and reads the bookmark file in a worker thread. The real menu is created on the Gtk
+    main loop when reading is done (see on_database_loaded).
+    :param indicator: Gtk indicator (AyatanaAppIndicator3 or AppIndicator3).
+    :return: Nothing
+    """
+    global _load_number
+    _load_number += 1
+    number = _load_number
+    create_placeholder_menu(indicator, "Loading…")
+    ensure_file_exists()
+
+    def load():
+        database, result, error = None, False, None
+        try:
+            database = Database(config['general']['file_path'])
+            result = database.parse_file()
+        except Exception as e:
+            # File not found, not access rights etc.
+            error = e
+        GLib.idle_add(on_database_loaded, indicator, number, database, result, error)
+
+    threading.Thread(target=load, name="loader", daemon=True).start()
+
+
+def on_database_loaded(indicator : 'appindicator.Indicator', number : int, database : Optional[Database],
+                       result : bool, error : Optional[Exception]) -> bool:
+    """
+    Called on the Gtk main loop when the worker thread of load_database_in_background is done.
+    :param indicator: Gtk indicator (AyatanaAppIndicator3 or AppIndicator3).
+    :param number: Number of the load.
+    :param database: The database (None, if it could not be created).
+    :param result: Return value of Database.parse_file (False if the file was empty).
+    :param error: The exception, if reading failed.
+    :return: False (do not call again)
+    """
+    if number != _load_number:
+        # The file has been reloaded in the meantime
+        return False
+    if error is not None:
+        print("Exception: ", str(error))
+        _pending_actions.clear()
+        create_placeholder_menu(indicator, "Error reading file")
+        show_message(gtk.MessageType.ERROR, gtk.ButtonsType.CLOSE, "Error parsing XML file",
+                     "Error parsing XML file '" + config['general']['file_path'] + "':\n" + str(error))
+        return False
+
+    def ready():
+        create_menu(indicator, database)
+        for action in _pending_actions:
+            action(database)
+        _pending_actions.clear()
+
+    if result:
+        ready()
+    else:
+        def on_response(response):
+            if response == gtk.ResponseType.YES:
+                ready()
+            else:
+                quit()
+
+        show_message(gtk.MessageType.QUESTION, gtk.ButtonsType.YES_NO, "Bookmark file empty",
+                     "File '" + config['general']['file_path'] + "' was empty. " +
+                     "Hence, a new menu was created. If this is an error and there should be an existing "
+                     "database file, please check the config file '" + str(config['dir']) + "/config.yml'.\n"
+                     "Do you want to proceed?", on_response)
+    return False
+
+
+def show_message(message_type : gtk.MessageType, buttons : gtk.ButtonsType, title : str, markup : str,
+                 on_response : Optional[Callable[[gtk.ResponseType], None]] = None) -> None:
+    """
+    Shows a message dialog without blocking the main loop (in contrast to dialog.run()).
+    :param message_type: Type of the message.
+    :param buttons: Buttons of the dialog.
+    :param title: Title of the dialog.
+    :param markup: The message.
+    :param on_response: Called with the response when the dialog is closed (optional).
+    :return: Nothing
+    """
+    dialog = gtk.MessageDialog(None, 0, message_type, buttons)
+    dialog.set_title(title)
+    dialog.set_markup(markup)
+
+    def response(source, response_id):
+        dialog.destroy()
+        if on_response is not None:
+            on_response(response_id)
+
+    dialog.connect('response', response)
+    dialog.show()
+
+
+def update_menu(indicator : Optional['appindicator.Indicator'], database : Database) -> None:
+    """
+    Updates the menu of the indicator after the database was changed (e.g., an entry was added).
+    Only the changed entries are updated. If the database did not change, nothing is done.
+    :param indicator: Gtk indicator (AyatanaAppIndicator3 or AppIndicator3).
+    :param database: Data displayed in the menu.
+    :return: Nothing
+    """
+    if indicator is None:
+        return
+    if _menu_view is not None and _menu_view.database is database:
+        _menu_view.sync()
+    else:
+        create_menu(indicator, database)
+
+
+def reload_file(indicator : 'appindicator.Indicator', database : Database) -> None:
+    """
+    Reads the bookmark file again and updates the menu. Only the changed entries are updated (see Database.reload).
+    :param indicator: Gtk indicator (AyatanaAppIndicator3 or AppIndicator3).
+    :param database: Data displayed in the menu.
+    :return: Nothing
+    """
+    try:
+        if database.reload():
+            update_menu(indicator, database)
+    except Exception as e:
+        # E.g., the file is not valid (anymore)
+        print("Exception: ", str(e))
+        show_message(gtk.MessageType.ERROR, gtk.ButtonsType.CLOSE, "Error parsing XML file",
+                     "Error parsing XML file '" + database.filename + "':\n" + str(e))
+
+
+def watch_files(indicator : 'appindicator.Indicator', database : Database) -> None:
+    """
+    Reloads the bookmark file and the icons of the menu when they are changed by another program (e.g., the file
+    is edited by hand or another process appends to the journal), if config['general']['watch'] is set. Changes are
+    applied after config['general']['watch_delay'] milliseconds without further changes. Our own saves are ignored.
+    :param indicator: Gtk indicator (AyatanaAppIndicator3 or AppIndicator3).
+    :param database: Data displayed in the menu.
+    :return: Nothing
+    """
+    global _watcher
+    if _watcher is not None:
+        _watcher.close()
+        _watcher = None
+    if not config['general']['watch']:
+        return
+    from filewatch import FileWatcher
+    image_dir = os.path.abspath(config['general']['image_dir'])
+    # The bookmark file and, e.g., its journal, to which other processes in "journal" mode append their changes
+    files = [os.path.abspath(filename) for filename in database.storage.watched_files()]
+
+    def on_change(paths):
+        if any(filename in paths for filename in files) and database.storage.changed_externally():
+            try:
+                if database.reload():
+                    update_menu(indicator, database)
+            except Exception as e:
+                # E.g., the file is saved while being edited and not valid (yet). It is read again on the next change.
+                print("Could not reload '" + database.filename + "':", str(e))
+        icons = set(os.path.relpath(path, image_dir) for path in paths if os.path.dirname(path) == image_dir)
+        if icons and _menu_view is not None:
+            _menu_view.refresh_icons(icons)
+
+    _watcher = FileWatcher(on_change, config['general']['watch_delay'])
+    for filename in files:
+        _watcher.watch_file(filename)
+    _watcher.watch_directory(image_dir)
+
+
+def add_new_entry_window(indicator : Optional['appindicator.Indicator'], database : Database):
+    """
+    Open the window to add a new entry.
+    :param indicator: Reference to indicator, in order to update the entries there.
+    :param database: Data to be displayed in the menu.
+    :return: Nothing
+    """
+    from newentry import NewEntryWindow
+    window = NewEntryWindow(database)
+    window.connect('destroy', lambda source: update_menu(indicator, database))
+    window.show_all()
+    window.present()
+    return window
+
+
+def show_search_window(indicator : Optional['appindicator.Indicator'], database : Database) -> gtk.Window:
+    """
+    Open the window to search / filter for an entry.
+    :param indicator: Indicator that might be updated when the search window is closed (necessary after deleting) (optional)
+    :param database: Data to be displayed in the menu.
+    :return: Nothing
+    """
+    from searchwindow import SearchWindow
+    window = SearchWindow(database)
+    window.connect('destroy', lambda source: update_menu(indicator, database))
+    window.show_all()
+    window.present()
+    return window
+
+
+def startup_done() -> None:
+    """
+    Calls on_startup (only once) as soon as Gtk is idle, i.e., after the first window or menu has been drawn.
+    :return: Nothing
+    """
+    global on_startup
+    if on_startup is None:
+        return
+    callback, on_startup = on_startup, None
+
+    def idle():
+        callback()
+        return False # do not call again
+
+    GLib.idle_add(idle)
+
+
+def run_search_window() -> None:
+    """
+    Opens the search window only (without indicator) and runs the Gtk main loop until it is closed.
+    :return: Nothing
+    """
+    database = create_database()
+    show_search_window(None, database).connect('destroy', gtk.main_quit)
+    startup_done()
+    gtk.main()
+    database.compact()
+
+
+def run_new_entry_window() -> None:
+    """
+    Opens the window for adding a new entry only (without indicator) and runs the Gtk main loop until it is closed.
+    :return: Nothing
+    """
+    database = create_database()
+    add_new_entry_window(None, database).connect('destroy', gtk.main_quit)
+    startup_done()
+    gtk.main()
+    database.compact()
+
+
+def serve_commands(indicator : 'appindicator.Indicator') -> Optional['ipc.Server']:
+    """
+    Executes the commands of later invocations of main.py (see ipc), so that all windows use the database of the
+    indicator.
+    :param indicator: Gtk indicator (AyatanaAppIndicator3 or AppIndicator3).
+    :return: The running server, None if another indicator is running for the bookmark file already.
+    """
+    import ipc
+
+    def require_database():
+        if _database is None:
+            raise ipc.CommandError("The bookmark file has not been loaded, yet.")
+        return _database
+
+    def query(request):
+        database = require_database()
+        return (database.describe(item) for item in database.query(request['query']))
+
+    def list_entries(request):
+        database = require_database()
+        # In the order of the file, like the index of querycache
+        stack = list(reversed(database.data.get_children()))
+        while stack:
+            item = stack.pop()
+            if item.type != database.Item.TYPE_SEPARATOR:
+                yield database.describe(item)
+            stack.extend(reversed(item.get_children()))
+
+    def get_entry(request):
+        database = require_database()
+        item = database.get_item(request['id'])
+        if item is None or item is database.data or item.type == database.Item.TYPE_SEPARATOR:
+            raise ipc.CommandError("No entry with id " + str(request['id']) + ".")
+        return [database.describe(item)]
+
+    def export(request):
+        import exporters
+        try:
+            count = exporters.export(require_database(), request['format'], request['path'], request.get('id'))
+        except (exporters.ExportError, OSError) as e:
+            raise ipc.CommandError(str(e))
+        return [{'entries': count, 'path': request['path']}]
+
+    def import_bookmarks(request):
+        import importers
+        require_database()
+        answer = ipc.PendingAnswer()
+
+        def add(imported):
+            # On the Gtk main loop. One change and one save for the whole tree, like main.py --import without
+            # indicator.
+            try:
+                database = require_database()
+                database.add_item(database.data.global_id, imported)
+                database.save_data()
+                database.compact()
+            except Exception as e:
+                return answer.finish(error=e)
+            return answer.finish([{'entries': importers.count_entries(imported), 'menu': imported.text,
+                                   'id': imported.global_id, 'path': request['path']}])
+
+        def read():
+            # Large files take a while, the menu and other commands must not be blocked meanwhile
+            try:
+                imported = importers.import_file(request['path'])
+            except importers.BookmarkImportError as e:
+                GLib.idle_add(answer.finish, None, ipc.CommandError(str(e)))
+            else:
+                GLib.idle_add(add, imported)
+
+        threading.Thread(target=read, name="importer", daemon=True).start()
+        return answer
+
+    server = ipc.Server(config['general']['file_path'], {
+        'ping': lambda request: None,
+        'search': lambda request: with_database(lambda database: show_search_window(indicator, database)),
+        'add': lambda request: with_database(lambda database: add_new_entry_window(indicator, database)),
+        'reload': lambda request: reload_file(indicator, require_database()),
+        'query': query,
+        'list': list_entries,
+        'get': get_entry,
+        'export': export,
+        'import': import_bookmarks,
+    })
+    if not server.start():
+        return None
+    return server
+
+
+def run_indicator() -> None:
+    """
+    Creates the indicator and runs the Gtk main loop.
+    :return: Nothing
+    """
+    # gi.require_version('AppIndicator3', '0.1')
+    gi.require_version('AyatanaAppIndicator3', '0.1')
+    from gi.repository import AyatanaAppIndicator3 as appindicator
+    # from gi.repository import AppIndicator3 as appindicator
+    from iconcache import thumbnail_cache
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    indicator = appindicator.Indicator.new(APPINDICATOR_ID,
+                                           os.path.join(config['script_dir'], 'default_images', 'lesezeichen.jpg'),
+                                           appindicator.IndicatorCategory.SYSTEM_SERVICES)
+    server = serve_commands(indicator)
+    if server is None:
+        print("WebsiteIndicator is already running for '" + config['general']['file_path'] + "'.")
+        return
+    indicator.set_status(appindicator.IndicatorStatus.ACTIVE)
+
+    if config['icons']['thumbnails']:
+        thumbnail_cache.rebuild_in_background(config['general']['image_dir'])
+
+    load_menu(indicator)
+
+    gtk.main()
+    server.stop()
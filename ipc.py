@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Communication with the running indicator, so that there is only one process (and one in-memory Database) per
+bookmark file. The indicator listens on a Unix socket (see Server), later invocations of main.py forward their
+command (see send_command) and exit.
+
+Protocol: the client sends one request as JSON line, e.g. {"command": "query", "query": "kube"}. The server answers
+with any number of result lines (JSON objects) followed by a status line {"status": "ok"} or
+{"status": "error", "message": "..."}.
+
+The client part does not need Gtk, i.e., forwarding a command is fast.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import socket
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+"""
+Seconds a client waits for the answer (opening a window may take a moment), and a server waits for a request.
+"""
+CLIENT_TIMEOUT = 10.0
+SERVER_TIMEOUT = 1.0
+
+
+class NotRunningError(Exception):
+    """
+    No indicator is running for the bookmark file.
+    """
+    pass
+
+
+class CommandError(Exception):
+    """
+    The indicator could not execute a command.
+    """
+    pass
+
+
+def socket_path(filename : str) -> str:
+    """
+    :param filename: The bookmark file.
+    :return: Path of the socket of the indicator using the file (in $XDG_RUNTIME_DIR, if set).
+    """
+    directory = os.getenv("XDG_RUNTIME_DIR") or os.getenv("TMPDIR") or "/tmp"
+    digest = hashlib.sha1(os.path.realpath(filename).encode()).hexdigest()[:12]
+    return os.path.join(directory, "WebsiteIndicator-" + str(os.getuid()) + "-" + digest + ".sock")
+
+
+def send_command(filename : str, command : str, timeout : Optional[float] = CLIENT_TIMEOUT,
+                 **arguments) -> Iterator[dict]:
+    """
+    Sends a command to the indicator using a bookmark file.
+    :param filename: The bookmark file.
+    :param command: The command (e.g., "search", see Server).
+    :param timeout: Seconds to wait for the answer, None to wait until the command is done (e.g., a large import).
+    :param arguments: Further values of the request (e.g., query="kube").
+    :return: The result lines of the answer (read while iterating).
+    :raises NotRunningError: If no indicator is running for the file.
+    :raises CommandError: If the indicator reported an error or did not answer in time.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path(filename))
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        raise NotRunningError("No indicator is running for '" + filename + "'.")
+    except socket.timeout:
+        sock.close()
+        raise CommandError("The indicator did not answer in time (it may be busy).")
+
+    def answer():
+        with sock, sock.makefile('rb') as stream:
+            request = dict(arguments, command=command)
+            try:
+                sock.sendall(json.dumps(request).encode() + b"\n")
+                for line in stream:
+                    message = json.loads(line)
+                    status = message.get('status')
+                    if status == 'ok':
+                        return
+                    elif status == 'error':
+                        raise CommandError(message.get('message', 'Unknown error'))
+                    yield message
+            except socket.timeout:
+                raise CommandError("The indicator did not answer in time (it may be busy).")
+            raise CommandError("Connection closed by the indicator.")
+
+    return answer()
+
+
+class PendingAnswer:
+    """
+    Returned by a handler whose command is completed later (e.g., after reading a file in a worker thread). The
+    connection is kept open until finish() is called.
+    """
+
+    def __init__(self):
+        self._callback : Optional[Callable[[Optional[Iterable[dict]], Optional[Exception]], None]] = None
+
+    def finish(self, lines : Optional[Iterable[dict]] = None, error : Optional[Exception] = None) -> bool:
+        """
+        Sends the answer. Must be called on the Gtk main loop (e.g., by GLib.idle_add).
+        :param lines: The result lines (or None).
+        :param error: If given, the command failed (the message is sent to the client).
+        :return: False (i.e., GLib.idle_add does not call it again)
+        """
+        self._callback(lines, error)
+        return False
+
+
+class Server:
+    """
+    Listens for commands of other invocations of main.py (on the Gtk main loop).
+    Only one server can run per bookmark file, which is ensured by a lock on a file next to the socket.
+    """
+
+    def __init__(self, filename : str, handlers : Dict[str, Callable[[dict], Optional[Iterable[dict]]]]):
+        """
+        :param filename: The bookmark file.
+        :param handlers: Command -> function receiving the request and returning the result lines (or None), or a
+                         PendingAnswer if the command is completed later.
+        """
+        self.path : str = socket_path(filename)
+        self.handlers : Dict[str, Callable[[dict], Optional[Iterable[dict]]]] = handlers
+        self._lock : Optional[int] = None
+        self._socket : Optional[socket.socket] = None
+        self._watch : Optional[int] = None
+
+    def start(self) -> bool:
+        """
+        Starts listening.
+        :return: False if another server is already running for the file, True otherwise.
+        :raises OSError: If the lock file or the socket cannot be created (e.g., the lock file is a link).
+        """
+        from gi.repository import GLib
+        # The directory may be shared (e.g., /tmp without XDG_RUNTIME_DIR): do not follow links placed there and do
+        # not use a lock file created by someone else
+        lock = os.open(self.path + ".lock", os.O_CREAT | os.O_RDWR | os.O_NOFOLLOW, 0o600)
+        try:
+            if os.fstat(lock).st_uid != os.getuid():
+                raise PermissionError("The lock file '" + self.path + ".lock' belongs to another user.")
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lock)
+            return False
+        except BaseException:
+            os.close(lock)
+            raise
+        self._lock = lock
+        # Left over by a crashed instance
+        if os.path.lexists(self.path):
+            os.remove(self.path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Created accessible for the user only (chmod after bind would leave a moment in which others can connect)
+        umask = os.umask(0o077)
+        try:
+            self._socket.bind(self.path)
+        finally:
+            os.umask(umask)
+        self._socket.listen()
+        self._watch = GLib.io_add_watch(self._socket, GLib.PRIORITY_DEFAULT, GLib.IO_IN, self._on_connection)
+        return True
+
+    def stop(self) -> None:
+        """
+        Stops listening and removes the socket.
+        :return: Nothing
+        """
+        from gi.repository import GLib
+        if self._watch is not None:
+            GLib.source_remove(self._watch)
+            self._watch = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        if self._lock is not None:
+            os.close(self._lock)
+            self._lock = None
+
+    def _on_connection(self, source, condition) -> bool:
+        try:
+            connection, address = self._socket.accept()
+        except OSError:
+            return True
+        connection.settimeout(SERVER_TIMEOUT)
+        stream = connection.makefile('rwb')
+        try:
+            request = json.loads(stream.readline())
+            handler = self.handlers.get(request.get('command'))
+            if handler is None:
+                raise CommandError("Unknown command '" + str(request.get('command')) + "'.")
+            lines = handler(request)
+        except Exception as e:
+            self._answer(connection, stream, None, e)
+            return True
+        if isinstance(lines, PendingAnswer):
+            lines._callback = lambda lines, error: self._answer(connection, stream, lines, error)
+        else:
+            self._answer(connection, stream, lines, None)
+        return True # keep listening
+
+    @staticmethod
+    def _answer(connection : socket.socket, stream, lines : Optional[Iterable[dict]],
+                error : Optional[Exception]) -> None:
+        """
+        Sends the result lines and the status line, and closes the connection.
+        :param connection: The connection to the client.
+        :param stream: The file object of the connection.
+        :param lines: The result lines (or None).
+        :param error: If given, the command failed.
+        :return: Nothing
+        """
+        def send(message):
+            stream.write(json.dumps(message).encode() + b"\n")
+
+        try:
+            with connection, stream:
+                try:
+                    if error is not None:
+                        raise error
+                    for line in lines or ():
+                        send(line)
+                except Exception as e:
+                    send({'status': 'error', 'message': str(e)})
+                else:
+                    send({'status': 'ok'})
+                stream.flush()
+        except Exception as e:
+            # E.g., the client went away
+            print("IPC error:", str(e))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+import time
+from typing import Iterator, List, Optional
+
+
+class Journal:
+    """
+    Append-only log of mutations, stored next to the bookmark file (one JSON object per line).
+
+    Instead of rewriting the whole bookmark file on every change, the changes are appended here and replayed
+    when the file is read. Database.compact() folds the journal back into the bookmark file.
+    """
+
+    def __init__(self, filename : str):
+        """
+        :param filename: Path of the journal file.
+        """
+        self.filename : str = filename
+        # Timestamp of the oldest record in the journal (None if unknown or empty)
+        self.started : Optional[float] = None
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.filename)
+
+    def size(self) -> int:
+        """
+        :return: Size of the journal file in bytes (0 if it does not exist).
+        """
+        try:
+            return os.path.getsize(self.filename)
+        except FileNotFoundError:
+            return 0
+
+    def age(self) -> float:
+        """
+        :return: Seconds since the oldest record was written (0 if the journal is empty).
+        """
+        if self.started is None:
+            return 0
+        return time.time() - self.started
+
+    def append(self, records : List[dict]) -> None:
+        """
+        Appends records to the journal and flushes them to disk.
+        :param records: Records to append. A timestamp ("ts") is added to each record.
+        :return: Nothing
+        """
+        if not records:
+            return
+        now = time.time()
+        lines = []
+        for record in records:
+            record['ts'] = now
+            lines.append(json.dumps(record, separators=(',', ':')) + "\n")
+        with open(self.filename, "a") as f:
+            f.write(''.join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        if self.started is None:
+            self.started = now
+
+    def read(self) -> Iterator[dict]:
+        """
+        Reads all records of the journal.
+        A torn last line (e.g., after a crash while writing) is skipped.
+        :return: Iterator over the records in the order they were written.
+        """
+        self.started = None
+        if not self.exists():
+            return
+        with open(self.filename) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    print("Skipping incomplete journal record in '" + self.filename + "'")
+                    continue
+                if self.started is None:
+                    self.started = record.get('ts')
+                yield record
+
+    def clear(self) -> None:
+        """
+        Removes the journal (after its records have been written to the bookmark file).
+        :return: Nothing
+        """
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+        self.started = None
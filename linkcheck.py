@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Checks whether the websites of the bookmarks are still reachable.
+
+The URLs are requested concurrently with asyncio (HEAD, falling back to GET for servers that do not answer HEAD
+properly), using a minimal HTTP/1.1 client: connections are kept alive and reused per host, and the number of
+requests at the same time is limited per host and in total. Redirects are followed.
+
+The results are cached with the time of the check (see LinkCache), so that a second run only checks URLs that
+were not checked recently.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote, urljoin, urlsplit
+
+USER_AGENT = "WebsiteIndicator-LinkCheck/1.0"
+MAX_REDIRECTS = 5
+MAX_HEADERS = 100
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+"""
+States of a result (see LinkResult.state).
+"""
+STATE_OK = 'ok'
+STATE_REDIRECT = 'redirect'
+STATE_DEAD = 'dead'
+STATE_ERROR = 'error'
+STATES = [STATE_OK, STATE_REDIRECT, STATE_DEAD, STATE_ERROR]
+
+
+class HttpError(Exception):
+    """
+    The server sent an invalid response or the URL cannot be requested (e.g., unsupported scheme).
+    """
+    pass
+
+
+class LinkResult(NamedTuple):
+    """
+    Result of checking a URL.
+    """
+    url : str
+    # Status code of the last response (after following redirects), None if the request failed
+    status : Optional[int]
+    # The URL redirected to (after following all redirects), None if there was no redirect
+    location : Optional[str]
+    # Why the request failed (e.g., timeout), None if there was a response
+    error : Optional[str]
+    # Time of the check (seconds since the epoch)
+    checked : float
+
+    @property
+    def state(self) -> str:
+        """
+        :return: One of STATES: ok (2xx), redirect (redirected to a working URL), dead (4xx/5xx) or error (no
+                 response, e.g., unknown host or timeout).
+        """
+        if self.status is None:
+            return STATE_ERROR
+        if self.status >= 400:
+            return STATE_DEAD
+        if self.location is not None:
+            return STATE_REDIRECT
+        return STATE_OK
+
+    def label(self) -> str:
+        """
+        :return: A short description, e.g., "200", "404" or "200 → https://example.com/new" (status after the
+                 redirect).
+        """
+        if self.status is None:
+            return "error: " + str(self.error)
+        if self.location is not None:
+            return str(self.status) + " → " + self.location
+        return str(self.status)
+
+
+class LinkCache:
+    """
+    The last result for every URL, stored as JSON file (url -> [status, location, error, checked]).
+    """
+
+    def __init__(self, filename : str, max_age : float):
+        """
+        :param filename: The cache file (read if it exists).
+        :param max_age: Results older than this (seconds) are stale, i.e., the URL is checked again.
+        """
+        self.filename : str = filename
+        self.max_age : float = max_age
+        self.results : Dict[str, LinkResult] = {}
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                for url, values in json.load(f).items():
+                    self.results[url] = LinkResult(url, *values)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError) as e:
+            print("Ignoring the link cache '" + filename + "':", str(e))
+
+    def get(self, url : str) -> Optional[LinkResult]:
+        return self.results.get(url)
+
+    def stale(self, urls : Iterable[str]) -> List[str]:
+        """
+        :param urls: URLs.
+        :return: The URLs without a result or with an outdated one (each URL once).
+        """
+        limit = time.time() - self.max_age
+        result = []
+        for url in dict.fromkeys(urls):
+            cached = self.results.get(url)
+            if cached is None or cached.checked < limit:
+                result.append(url)
+        return result
+
+    def update(self, result : LinkResult) -> None:
+        self.results[result.url] = result
+
+    def save(self) -> None:
+        """
+        Writes the cache file.
+        :return: Nothing
+        """
+        from backup import atomic_write
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        data = {url: [result.status, result.location, result.error, result.checked]
+                for url, result in self.results.items()}
+        atomic_write(self.filename, json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+
+class ConnectionPool:
+    """
+    Idle keep-alive connections per (scheme, host, port).
+    """
+
+    def __init__(self):
+        self._idle : Dict[Tuple[str, str, int], list] = {}
+        self._ssl_context = None
+
+    async def request(self, method : str, url : str) -> Tuple[int, Dict[str, str]]:
+        """
+        Sends a request and reads the head of the response. The body is not read: the connection is kept for
+        the next request after a HEAD request, and closed otherwise.
+        :param method: HEAD or GET.
+        :param url: An http or https URL.
+        :return: The status code and the headers (names in lower case).
+        :raises HttpError: If the URL is not supported or the response is invalid.
+        :raises OSError: If the connection failed.
+        """
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ('http', 'https') or not parts.hostname:
+            raise HttpError("unsupported URL")
+        host = parts.hostname
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, host, port)
+        target = quote(parts.path or '/', safe="/%:@!$&'()*+,;=~-._") + \
+            ('?' + quote(parts.query, safe="/%:@!$&'()*+,;=?~-._") if parts.query else '')
+        host_header = host.encode('idna').decode('ascii')
+        if port != (443 if scheme == 'https' else 80):
+            host_header += ":" + str(port)
+        request = (method + " " + target + " HTTP/1.1\r\nHost: " + host_header + "\r\nUser-Agent: " + USER_AGENT +
+                   "\r\nAccept: */*\r\nConnection: keep-alive\r\n\r\n").encode('ascii')
+
+        while True:
+            connection = self._take(key)
+            reused = connection is not None
+            if connection is None:
+                connection = await self._open(key)
+            reader, writer = connection
+            try:
+                writer.write(request)
+                await writer.drain()
+                version, status, headers = await self._read_head(reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    # The server closed the idle connection, try again with a new one
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if method == 'HEAD' and version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close':
+                self._idle.setdefault(key, []).append(connection)
+            else:
+                writer.close()
+            return status, headers
+
+    def _take(self, key : Tuple[str, str, int]):
+        connections = self._idle.get(key)
+        while connections:
+            reader, writer = connections.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        return None
+
+    async def _open(self, key : Tuple[str, str, int]):
+        scheme, host, port = key
+        if scheme == 'https':
+            if self._ssl_context is None:
+                import ssl
+                self._ssl_context = ssl.create_default_context()
+            return await asyncio.open_connection(host, port, ssl=self._ssl_context, server_hostname=host)
+        return await asyncio.open_connection(host, port)
+
+    @staticmethod
+    async def _read_head(reader) -> Tuple[str, int, Dict[str, str]]:
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionResetError("connection closed by the server")
+            try:
+                version, status = line.decode('latin-1').split(None, 2)[:2]
+                status = int(status)
+            except ValueError:
+                raise HttpError("invalid response")
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                if len(headers) >= MAX_HEADERS:
+                    raise HttpError("too many headers")
+                name, _, value = line.decode('latin-1').partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if not 100 <= status < 200:
+                return version, status, headers
+            # Interim response (e.g., 100 Continue), the actual response follows
+
+    def close(self) -> None:
+        for connections in self._idle.values():
+            for reader, writer in connections:
+                writer.close()
+        self._idle = {}
+
+
+class LinkChecker:
+    """
+    Checks URLs concurrently (see the module documentation).
+    """
+
+    def __init__(self, concurrency : int, per_host : int, timeout : float):
+        """
+        :param concurrency: Maximum number of requests at the same time.
+        :param per_host: Maximum number of requests to the same host at the same time.
+        :param timeout: Maximum time of a single request (seconds).
+        """
+        self.concurrency : int = concurrency
+        self.per_host : int = per_host
+        self.timeout : float = timeout
+        self._cancelled : bool = False
+
+    def cancel(self) -> None:
+        """
+        Stops a running check (from any thread): URLs that are not being checked are skipped.
+        :return: Nothing
+        """
+        self._cancelled = True
+
+    def run(self, urls : Iterable[str], callback : Optional[Callable[[LinkResult], None]] = None) -> List[LinkResult]:
+        """
+        Checks URLs (runs an asyncio event loop until all URLs are checked).
+        :param urls: The URLs.
+        :param callback: Called with every result as soon as it is known.
+        :return: The results (in the order of the given URLs, without duplicates and skipped URLs).
+        """
+        return asyncio.run(self.check_all(urls, callback))
+
+    async def check_all(self, urls : Iterable[str],
+                        callback : Optional[Callable[[LinkResult], None]] = None) -> List[LinkResult]:
+        self._cancelled = False
+        pool = ConnectionPool()
+        limit = asyncio.Semaphore(self.concurrency)
+        hosts : Dict[str, asyncio.Semaphore] = {}
+
+        async def request(method, url):
+            host = (urlsplit(url).hostname or '').lower()
+            if host not in hosts:
+                hosts[host] = asyncio.Semaphore(self.per_host)
+            # Waiting for a busy host does not block the requests to other hosts
+            async with hosts[host], limit:
+                return await asyncio.wait_for(pool.request(method, url), self.timeout)
+
+        async def check(url):
+            if self._cancelled:
+                return None
+            try:
+                current = url
+                for _ in range(MAX_REDIRECTS + 1):
+                    status, headers = await request('HEAD', current)
+                    if status >= 400:
+                        # Some servers do not support HEAD (405, 501) or answer it differently
+                        status, headers = await request('GET', current)
+                    if status not in REDIRECT_CODES or 'location' not in headers:
+                        break
+                    current = urljoin(current, headers['location'])
+                else:
+                    raise HttpError("too many redirects")
+                result = LinkResult(url, status, current if current != url else None, None, time.time())
+            except asyncio.TimeoutError:
+                result = LinkResult(url, None, None, "timeout", time.time())
+            except (OSError, EOFError, HttpError, ValueError, UnicodeError) as e:
+                result = LinkResult(url, None, None, str(e) or e.__class__.__name__, time.time())
+            if callback is not None:
+                callback(result)
+            return result
+
+        try:
+            results = await asyncio.gather(*(check(url) for url in dict.fromkeys(urls)))
+        finally:
+            pool.close()
+        return [result for result in results if result is not None]
+
+
+def web_actions(database) -> List[str]:
+    """
+    :param database: A model.Database.
+    :return: The URLs of all websites (each URL once).
+    """
+    from model import Database
+    urls = []
+    stack = [database.data]
+    while stack:
+        item = stack.pop()
+        if item.type == Database.Item.TYPE_WEB and item.action:
+            urls.append(item.action)
+        stack.extend(reversed(item.get_children()))
+    return list(dict.fromkeys(urls))
@@ -1,194 +1,26 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 # this is an indicator
-import argparse
-from typing import Optional
-
-import gi
-gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk as gtk
+import time
+# Start of the program, see --exit-after-startup
+_START = time.perf_counter()
 
-# gi.require_version('AppIndicator3', '0.1')
-gi.require_version('AyatanaAppIndicator3', '0.1')
-from gi.repository import AyatanaAppIndicator3 as appindicator
-# from gi.repository import AppIndicator3 as appindicator
-import signal
+import argparse
+import json
 import sys
 
-from searchwindow import SearchWindow
-from newentry import NewEntryWindow
-from model import Database
-from config import *
-
-
-APPINDICATOR_ID = 'lesezeichen'
-
-
-def quit(source = None) -> None:
-    """
-    Quit the whole program.
-    :param source: Source widget, if called via a button click. Currently not used.
-    :return: Nothing
-    """
-    gtk.main_quit()
-
-
-def create_database() -> Database:
-    """
-    Read the (database) file and return a database object.
-    :return: database containing the bookmark entries
-    """
-    try:
-        database = Database(config['general']['file_path'])
-
-        # If bookmark database file does not exist, ask whether it should be created or not.
-        # If the user chooses "yes", then an empty file is created (could be improved later ...).
-        if not os.path.isfile(config['general']['file_path']):
-            # FIXME: If parent is none, the message dialog is shown in background ...
-            # This is why a temporary window is created ... but a better solution should be found ...
-            parent = gtk.Window()
-            parent.set_default_size(0, 0)
-            parent.show()
-            dialog = gtk.MessageDialog(parent, gtk.DialogFlags.MODAL,
-                                       gtk.MessageType.QUESTION, gtk.ButtonsType.YES_NO)
-            dialog.set_title("Bookmark file does not exist")
-            dialog.set_markup("File '" + config['general']['file_path'] + "' does not exist. " +
-                              "Create it?\n\nNote: If you choose 'No', the program is quited.")
-            dialog.set_icon_name("dialog-question")
-            response = dialog.run()
-            dialog.destroy()
-            if response == gtk.ResponseType.YES:
-                with open(config['general']['file_path'], 'w') as fp:
-                    pass
-                parent.destroy()
-            else:
-                parent.destroy()
-                quit()
-                exit(0)
-
-        # If the file was empty, ask how to proceed.
-        if not database.parse_file():
-            # FIXME: If parent is none, the message dialog is shown in background ...
-            # This is why a temporary window is created ... but a better solution should be found ...
-            parent = gtk.Window()
-            parent.set_default_size(0, 0)
-            parent.show()
-            dialog = gtk.MessageDialog(parent, gtk.DialogFlags.MODAL,
-                                       gtk.MessageType.QUESTION, gtk.ButtonsType.YES_NO)
-            dialog.set_title("Bookmark file empty")
-            dialog.set_markup("File '" + config['general']['file_path'] + "' was empty. " +
-                                   "Hence, a new menu was created. If this is an error and there should be an existing "
-                                   "database file, please check the config file '"+str(config['dir'])+"/config.yml'.\n"
-                                   "Do you want to proceed?")
-            dialog.set_icon_name("dialog-question")
-            response = dialog.run()
-            dialog.destroy()
-            if response != gtk.ResponseType.YES:
-                parent.destroy()
-                quit()
-                exit(0)
-            else:
-                parent.destroy()
-    except Exception as e:
-        # File not found, not access rights etc.
-        print("Exception: ",str(e))
-        # FIXME: If parent is none, the message dialog is shown in background ...
-        # This is why a temporary window is created ... but a better solution should be found ...
-        parent = gtk.Window()
-        parent.set_default_size(0,0)
-        parent.show()
-        md = gtk.MessageDialog(parent, gtk.DialogFlags.MODAL, gtk.MessageType.ERROR,
-                               gtk.ButtonsType.CLOSE)
-        md.set_title("Error parsing XML file")
-        md.set_markup("Error parsing XML file '"+config['general']['file_path']+"':\n" + str(e))
-        md.run()
-        md.destroy()
-        exit(1)
-    return database
-
-
-def create_menu(indicator : Optional[appindicator.Indicator], database : Optional[Database] = None) -> None:
-    """
-    Create the menu for the indicator and sets it.
-    :param indicator: Gtk indicator (AyatanaAppIndicator3 or AppIndicator3).
-    :param database: Data to be displayed in the menu, if already available.
-    :return: Nothing
-    """
-    # At first call, when the input file has not been read, read the file.
-    # If we, on the other hand, already have read the data, use it from the parameter.
-    if database is None:
-        database = create_database()
-    # If the search window was started using --search, then create_menu is called with indicator=None.
-    # We do not have to create a new menu and can return.
-    if indicator is None:
-        return
-
-    menu = database.to_gtk_menu()
-    menu.append(gtk.SeparatorMenuItem())
-
-    # Add default entries
-    item = gtk.ImageMenuItem('Search')
-    img = gtk.Image.new_from_icon_name("search", gtk.IconSize.MENU)
-    item.set_image(img)
-    item.set_always_show_image(True)
-    item.connect('activate', lambda source: show_search_window(indicator, database))
-    menu.append(item)
-
-    img = gtk.Image()
-    img.set_from_file(os.path.join(config['script_dir'], 'default_images', 'reload.png'))
-    item = gtk.ImageMenuItem('Reload file')
-    item.set_image(img)
-    item.set_always_show_image(True)
-    item.connect('activate', lambda source: create_menu(indicator))
-    menu.append(item)
-
-    img = gtk.Image()
-    img.set_from_file(os.path.join(config['script_dir'], 'default_images', 'add.png'))
-    item = gtk.ImageMenuItem('New entry')
-    item.set_image(img)
-    item.set_always_show_image(True)
-    item.connect('activate', lambda source: add_new_entry_window(indicator, database))
-    menu.append(item)
-
-    # Quit-Button
-    item = gtk.ImageMenuItem('Beenden')
-    img = gtk.Image.new_from_icon_name("window-close", gtk.IconSize.MENU)
-    item.set_image(img)
-    item.set_always_show_image(True)
-    item.connect('activate', quit)
-    menu.append(item)
-
-    menu.show_all()
-
-    indicator.set_menu(menu)
-
-
-def add_new_entry_window(indicator : Optional[appindicator.Indicator], database : Database):
-    """
-    Open the window to add a new entry.
-    :param indicator: Reference to indicator, in order to update the entries there.
-    :param database: Data to be displayed in the menu.
-    :return: Nothing
-    """
-    window = NewEntryWindow(database)
-    window.connect('destroy', lambda source: create_menu(indicator, database))
-    window.show_all()
-    window.present()
-    return window
+from config import load_config
 
 
-def show_search_window(indicator : Optional[appindicator.Indicator], database : Database) -> gtk.Window:
+def report_startup(mode : str, imported : float) -> None:
     """
-    Open the window to search / filter for an entry.
-    :param indicator: Indicator that might be updated when the search window is closed (necessary after deleting) (optional)
-    :param database: Data to be displayed in the menu.
+    Prints the startup times (for benchmark.py startup) as JSON.
+    :param mode: The command line mode.
+    :param imported: time.perf_counter() after the modules of the mode were imported.
     :return: Nothing
     """
-    window = SearchWindow(database)
-    window.connect('destroy', lambda source: create_menu(indicator, database))
-    window.show_all()
-    window.present()
-    return window
+    print(json.dumps({'mode': mode, 'imports': imported - _START, 'first_menu': time.perf_counter() - _START}))
+    sys.stdout.flush()
 
 
 if __name__ == "__main__":
@@ -199,30 +31,265 @@ if __name__ == "__main__":
     #parser.add_argument('--no-indicator', action='store_true', help="Does NOT start the indicator.")
     parser.add_argument('--add', action='store_true', help="Opens the window for adding a new bookmark only.")
     parser.add_argument('--search', action='store_true', help="Opens the window for searching and filtering only.")
+    parser.add_argument('--reload', action='store_true', help="Makes the running indicator read the bookmark file again.")
+    parser.add_argument('--query', metavar='QUERY',
+                        help="Prints the entries matching a query (e.g., 'site:github.com kube') as JSON lines.")
+    parser.add_argument('--list', action='store_true', help="Prints all entries as JSON lines.")
+    parser.add_argument('--get', metavar='ID', type=int, help="Prints the entry with the id ID as JSON line.")
     parser.add_argument('--print-config', action='store_true', help="Prints the current runtime configuration to screen.")
+    parser.add_argument('--list-backups', action='store_true', help="Lists the stored versions of the bookmark file.")
+    parser.add_argument('--restore-backup', metavar='HASH', help="Restores a stored version of the bookmark file.")
+    parser.add_argument('--migrate', nargs=2, metavar=('SRC', 'DST'),
+                        help="Copies all bookmarks from SRC to the new file DST. The storage (XML or SQLite) is chosen "
+                             "by the file extension (.sqlite, .sqlite3, .db: SQLite).")
+    parser.add_argument('--import', metavar='FILE', dest='import_file',
+                        help="Adds the bookmarks of a Firefox profile (places.sqlite) or a bookmark HTML file "
+                             "exported by a browser as new menu.")
+    parser.add_argument('--export', nargs=2, metavar=('FORMAT', 'PATH'),
+                        help="Writes the bookmarks to the file PATH. FORMAT: html (bookmark file for browsers), json "
+                             "or csv.")
+    parser.add_argument('--subtree', metavar='ID', type=int,
+                        help="With --export: exports only the entry with the id ID (e.g., a menu, see --query).")
+    parser.add_argument('--check-links', nargs='?', const='stale', choices=['stale', 'all'],
+                        help="Checks whether the websites are still reachable and prints the dead links and redirects. "
+                             "By default, only links not checked recently are requested (see links.max_age), "
+                             "'all' checks every link.")
+    # Used by benchmark.py: quit as soon as the first window or menu is shown and print the startup times
+    parser.add_argument('--exit-after-startup', action='store_true', help=argparse.SUPPRESS)
     args = vars(parser.parse_args())
+    config = load_config()
+
+    # Modes printing entries as JSON lines (e.g., for launchers like rofi), they do not need Gtk
+    headless = args['query'] is not None or args['list'] or args['get'] is not None
+    gui = args['search'] or args['add'] or not (args['print_config'] or args['list_backups'] or args['reload'] or
+                                                headless or args['restore_backup'] is not None or
+                                                args['migrate'] is not None or args['import_file'] is not None or
+                                                args['export'] is not None or args['check_links'] is not None)
+
+    if args['export'] is not None or args['import_file'] is not None:
+        import os
+        # The indicator may run in another directory
+        if args['export'] is not None:
+            args['export'][1] = os.path.abspath(args['export'][1])
+        if args['import_file'] is not None:
+            args['import_file'] = os.path.abspath(args['import_file'])
+
+    if gui or args['reload'] or headless or args['export'] is not None or args['import_file'] is not None:
+        # If the indicator is running, it executes the command (there is only one process using the file)
+        import ipc
+        mode = 'search' if args['search'] else 'add' if args['add'] else 'reload' if args['reload'] else \
+            'query' if args['query'] is not None else 'list' if args['list'] else 'get' if args['get'] is not None \
+            else 'export' if args['export'] is not None else 'import' if args['import_file'] is not None \
+            else 'indicator'
+        try:
+            for result in ipc.send_command(config['general']['file_path'], 'ping' if mode == 'indicator' else mode,
+                                           # Importing a large file may take longer than the default timeout
+                                           timeout=None if mode == 'import' else ipc.CLIENT_TIMEOUT,
+                                           query=args['query'],
+                                           id=args['subtree'] if mode == 'export' else args['get'],
+                                           format=args['export'][0] if mode == 'export' else None,
+                                           path=args['export'][1] if mode == 'export' else
+                                           args['import_file'] if mode == 'import' else None):
+                print(json.dumps(result, ensure_ascii=False))
+            if mode == 'indicator':
+                print("WebsiteIndicator is already running for '" + config['general']['file_path'] + "'.")
+            if args['exit_after_startup']:
+                report_startup(mode, time.perf_counter())
+            exit(0)
+        except ipc.NotRunningError:
+            pass
+        except ipc.CommandError as e:
+            print(str(e), file=sys.stderr)
+            exit(1)
 
-    if args['search']:
-        database = create_database()
-        show_search_window(None, database).connect('destroy', gtk.main_quit)
-        gtk.main()
-    elif args['add']:
-        database = create_database()
-        add_new_entry_window(None, database).connect('destroy', gtk.main_quit)
-        gtk.main()
+    if gui:
+        # Graphical modes
+        import indicator
+        if args['exit_after_startup']:
+            mode = 'search' if args['search'] else 'add' if args['add'] else 'indicator'
+            imported = time.perf_counter()
+            indicator.on_startup = lambda: (report_startup(mode, imported), indicator.quit())
+        if args['search']:
+            indicator.run_search_window()
+        elif args['add']:
+            indicator.run_new_entry_window()
+        else:
+            indicator.run_indicator()
+    elif args['reload']:
+        print("WebsiteIndicator is not running for '" + config['general']['file_path'] + "'.", file=sys.stderr)
+        exit(1)
+    elif headless:
+        from querycache import QueryCache
+        imported = time.perf_counter()
+        cache = QueryCache.open(config['general']['file_path'])
+        if args['get'] is not None:
+            entry = cache.get(args['get'])
+            if entry is None:
+                print("No entry with id " + str(args['get']) + ".", file=sys.stderr)
+                exit(1)
+            results = [entry]
+        elif args['list']:
+            results = cache.list()
+        else:
+            results = cache.query(args['query'])
+        try:
+            for result in results:
+                print(json.dumps(result, ensure_ascii=False))
+        except BrokenPipeError:
+            # The reader quit early (e.g., head), which is fine
+            sys.stdout = None
+        if args['exit_after_startup']:
+            report_startup(mode, imported)
+        exit(0)
     elif args['print_config']:
+        import yaml
+        imported = time.perf_counter()
         print("##### config.yml of WebsiteIndicator #####")
         yaml.dump(config, stream=sys.stdout)
         print()
+        if args['exit_after_startup']:
+            report_startup('print-config', imported)
+        exit(0)
+    elif args['list_backups']:
+        from model import Database
+        database = Database(config['general']['file_path'])
+        if database.backups is None:
+            print("The storage of '" + config['general']['file_path'] + "' does not keep backups.", file=sys.stderr)
+            exit(1)
+        for version in database.backups.versions():
+            print(version['hash'][:12], time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(version['ts'])),
+                  str(version['size']) + " bytes")
+        exit(0)
+    elif args['restore_backup'] is not None:
+        from model import Database
+        database = Database(config['general']['file_path'])
+        if database.backups is None:
+            print("The storage of '" + config['general']['file_path'] + "' does not keep backups.", file=sys.stderr)
+            exit(1)
+        digest = database.backups.find(args['restore_backup'])
+        if digest is None:
+            print("No unique backup found for '" + args['restore_backup'] + "'. Use --list-backups.", file=sys.stderr)
+            exit(1)
+        # Fold the journal into the file first, so that the current state is kept as backup, too.
+        database.parse_file()
+        database.compact()
+        database.restore_backup(digest)
+        print("Restored version " + digest[:12] + " of '" + config['general']['file_path'] + "'.")
+        exit(0)
+    elif args['migrate'] is not None:
+        import os
+        from model import Database
+        source_file, target_file = args['migrate']
+        if os.path.exists(target_file) and os.path.getsize(target_file) > 0:
+            print("'" + target_file + "' already exists. Choose a new file.", file=sys.stderr)
+            exit(1)
+        source = Database(source_file, storage='auto')
+        source.parse_file()
+        target = Database(target_file, storage='auto')
+        target.storage.replace(source.data)
+        target.storage.compact()
+        # Read the result again to make sure nothing was lost
+        check = Database(target_file, storage='auto')
+        check.parse_file()
+        if len(check) != len(source):
+            print("Migration incomplete: " + str(len(source)) + " entries read, " + str(len(check)) + " written.",
+                  file=sys.stderr)
+            exit(1)
+        print("Migrated " + str(len(source)) + " entries from '" + source_file + "' to '" + target_file + "'.")
         exit(0)
-    else:
-        # Create indicator
-        signal.signal(signal.SIGINT, signal.SIG_DFL)
-        indicator = appindicator.Indicator.new(APPINDICATOR_ID,
-                                               os.path.join(config['script_dir'], 'default_images', 'lesezeichen.jpg'),
-                                               appindicator.IndicatorCategory.SYSTEM_SERVICES)
-        indicator.set_status(appindicator.IndicatorStatus.ACTIVE)
+    elif args['import_file'] is not None:
+        import importers
+        from model import Database
+        start = time.perf_counter()
 
-        create_menu(indicator)
+        def report_progress(count):
+            elapsed = time.perf_counter() - start
+            print("\rRead " + str(count) + " entries (" + str(round(count / max(elapsed, 1e-6))) + " entries/s)",
+                  end='', file=sys.stderr, flush=True)
 
-        gtk.main()
+        try:
+            imported = importers.import_file(args['import_file'], progress=report_progress)
+        except importers.BookmarkImportError as e:
+            print(file=sys.stderr)
+            print(str(e), file=sys.stderr)
+            exit(1)
+        print(file=sys.stderr)
+        count = importers.count_entries(imported)
+        read = time.perf_counter()
+        database = Database(config['general']['file_path'])
+        database.parse_file()
+        # One change and one save for the whole tree
+        database.add_item(database.data.global_id, imported)
+        database.save_data()
+        database.compact()
+        elapsed = time.perf_counter() - start
+        print("Imported " + str(count) + " entries from '" + args['import_file'] + "' as menu '" + imported.text +
+              "' in " + str(round(elapsed, 2)) + " s (reading " + str(round(read - start, 2)) + " s, " +
+              str(round(count / max(elapsed, 1e-6))) + " entries/s).")
+        exit(0)
+    elif args['export'] is not None:
+        import exporters
+        from model import Database
+        database = Database(config['general']['file_path'])
+        database.parse_file()
+        try:
+            count = exporters.export(database, args['export'][0], args['export'][1], args['subtree'])
+        except (exporters.ExportError, OSError) as e:
+            print(str(e), file=sys.stderr)
+            exit(1)
+        print(json.dumps({'entries': count, 'path': args['export'][1]}))
+        exit(0)
+    elif args['check_links'] is not None:
+        import linkcheck
+        from model import Database
+        database = Database(config['general']['file_path'])
+        database.parse_file()
+        urls = linkcheck.web_actions(database)
+        cache = linkcheck.LinkCache(config['links']['cache_file'], config['links']['max_age'])
+        to_check = urls if args['check_links'] == 'all' else cache.stale(urls)
+        checker = linkcheck.LinkChecker(config['links']['concurrency'], config['links']['per_host'],
+                                        config['links']['timeout'])
+        start = time.perf_counter()
+        checked = 0
+
+        def report_progress(result):
+            global checked
+            checked += 1
+            cache.update(result)
+            print("\rChecked " + str(checked) + " of " + str(len(to_check)) + " links", end='', file=sys.stderr,
+                  flush=True)
+
+        try:
+            checker.run(to_check, report_progress)
+        finally:
+            # Keep what was checked, even if interrupted
+            cache.save()
+        elapsed = time.perf_counter() - start
+        if to_check:
+            print(file=sys.stderr)
+        print("Checked " + str(len(to_check)) + " of " + str(len(urls)) + " links in " + str(round(elapsed, 2)) +
+              " s (" + str(len(urls) - len(to_check)) + " from the cache).")
+
+        # Report: every link that is not ok, grouped by state, with the entries using it
+        entries = {}
+        stack = [database.data]
+        while stack:
+            item = stack.pop()
+            if item.type == Database.Item.TYPE_WEB and item.action:
+                entries.setdefault(item.action, []).append(item)
+            stack.extend(reversed(item.get_children()))
+        counts = {state: 0 for state in linkcheck.STATES}
+        for state in (linkcheck.STATE_DEAD, linkcheck.STATE_ERROR, linkcheck.STATE_REDIRECT):
+            for url in urls:
+                result = cache.get(url)
+                if result is None or result.state != state:
+                    continue
+                for item in entries[url]:
+                    folder = "/".join(menu.text for menu in database.get_path(item.global_id)[1:-1])
+                    print(f"{state:<9} {result.label()}  {url}  {item.text}" + (" (" + folder + ")" if folder else ""))
+        for url in urls:
+            result = cache.get(url)
+            if result is not None:
+                counts[result.state] += 1
+        print(", ".join(str(count) + " " + state for state, count in counts.items()) + ".")
+        exit(0)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import webbrowser
+from typing import Dict, List, Optional, Set
+
+import gi
+
+from config import config
+from iconcache import pixbuf_cache
+from model import Database
+
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk as gtk
+
+
+class MenuView:
+    """
+    Creates the Gtk menu (e.g., for the indicator) of a database.
+
+    In lazy mode, only the top-level entries are created up front. The contents of a submenu are created when it is
+    shown for the first time and are kept until the corresponding menu item of the database changes.
+
+    The view remembers which Gtk widget belongs to which entry, so that changes of the database can be applied to
+    an existing menu (see sync()).
+    """
+
+    def __init__(self, database : Database, lazy : Optional[bool] = None):
+        """
+        :param database: The data to be displayed.
+        :param lazy: Whether to create submenus on first use. If not given, config['menu']['lazy'] is used.
+        """
+        if lazy is None:
+            lazy = config['menu']['lazy']
+        self.database : Database = database
+        self.lazy : bool = lazy
+        # global id of a menu -> revision of the menu item (see Database.get_revision) its widgets were created for
+        self._built : Dict[int, int] = {}
+        # global id of a menu -> Gtk menu containing its entries (only menus whose contents have been created)
+        self._menus : Dict[int, gtk.Menu] = {}
+        # global id of a menu -> global ids of the displayed entries (in the same order as in the Gtk menu)
+        self._children : Dict[int, List[int]] = {}
+        # global id -> Gtk menu item
+        self._widgets : Dict[int, gtk.MenuItem] = {}
+        # global id -> values of the entry its Gtk menu item was created for
+        self._values : Dict[int, tuple] = {}
+        # Database.generation the menu is up to date with
+        self._generation : int = database.generation
+
+    def build(self, data : Optional[Database.Item] = None) -> gtk.Menu:
+        """
+        Exports the data as a Gtk menu.
+        :param data: The menu to start with. If not given, the top-level menu of the database is used.
+        :return: The Gtk menu containing all (sub)entries of data (in lazy mode: its direct entries).
+        """
+        if data is None:
+            data = self.database.data
+        gtk_menu = gtk.Menu()
+        self._populate(gtk_menu, data)
+        return gtk_menu
+
+    def sync(self) -> bool:
+        """
+        Applies the changes of the database since the menu was created (or last synchronized) to the Gtk menu.
+        Only entries that were added, removed or changed are updated, all other widgets are kept.
+        :return: False if the database has not changed (and nothing was done), True otherwise.
+        """
+        if self._generation == self.database.generation:
+            return False
+        for menu_id in list(self._menus):
+            if menu_id not in self._menus:
+                # Removed while synchronizing its parent menu
+                continue
+            item = self.database.get_item(menu_id)
+            if item is None:
+                continue
+            if self._built.get(menu_id) != self.database.get_revision(menu_id):
+                self._reconcile(item)
+        self._generation = self.database.generation
+        return True
+
+    def _reconcile(self, data : Database.Item) -> None:
+        """
+        Updates the entries of a (created) Gtk menu to match the children of a menu entry.
+        :param data: The menu entry.
+        :return: Nothing
+        """
+        gtk_menu = self._menus[data.global_id]
+        new_ids = [item.global_id for item in data.get_children()]
+        new_id_set = set(new_ids)
+        old_ids = self._children[data.global_id]
+
+        # Changed entries are created again, renamed menus keep their contents
+        for item in data.get_children():
+            values = self._values.get(item.global_id)
+            if values is None or values == self._get_values(item):
+                continue
+            if item.type == Database.Item.TYPE_MENU and values[0] == item.type and values[3] == item.icon:
+                self._widgets[item.global_id].set_label(item.text)
+                self._values[item.global_id] = self._get_values(item)
+            else:
+                new_id_set.discard(item.global_id)
+
+        # Removals
+        for removed_id in old_ids:
+            if removed_id not in new_id_set:
+                widget = self._widgets[removed_id]
+                gtk_menu.remove(widget)
+                widget.destroy()
+                self._forget(removed_id)
+        kept_ids = [id for id in old_ids if id in new_id_set]
+        if kept_ids != [id for id in new_ids if id in self._widgets]:
+            # Entries were reordered: create the menu again.
+            for widget in gtk_menu.get_children()[:len(kept_ids)]:
+                gtk_menu.remove(widget)
+                widget.destroy()
+            for id in kept_ids:
+                self._forget(id)
+            kept_ids = []
+
+        # Insertions (the remaining entries are in the right order)
+        kept = set(kept_ids)
+        for position, item in enumerate(data.get_children()):
+            if item.global_id not in kept:
+                widget = self._create_widget(item)
+                gtk_menu.insert(widget, position)
+                widget.show_all()
+        self._children[data.global_id] = new_ids
+        self._built[data.global_id] = self.database.get_revision(data.global_id)
+
+    def _forget(self, id : int) -> None:
+        """
+        Removes an entry and all its sub-entries from the lookup tables (after its widget was removed).
+        :param id: The global id of the entry.
+        :return: Nothing
+        """
+        stack = [id]
+        while stack:
+            id = stack.pop()
+            self._widgets.pop(id, None)
+            self._values.pop(id, None)
+            self._menus.pop(id, None)
+            self._built.pop(id, None)
+            stack.extend(self._children.pop(id, []))
+
+    def _populate(self, gtk_menu : gtk.Menu, data : Database.Item) -> None:
+        for item in data.get_children():
+            gtk_menu.append(self._create_widget(item))
+        self._menus[data.global_id] = gtk_menu
+        self._children[data.global_id] = [item.global_id for item in data.get_children()]
+        self._built[data.global_id] = self.database.get_revision(data.global_id)
+
+    def refresh_icons(self, icons : Set[str]) -> None:
+        """
+        Loads the icons of the displayed entries again, e.g., after the image files were changed.
+        :param icons: The changed icons (relative to config['general']['image_dir']).
+        :return: Nothing
+        """
+        for id, widget in self._widgets.items():
+            item = self.database.get_item(id)
+            if item is None or item.icon not in icons or not isinstance(widget, gtk.ImageMenuItem):
+                continue
+            try:
+                widget.set_image(self._create_image(item.icon))
+            except Exception as e:
+                # E.g., the image was deleted
+                print("Could not load icon '" + item.icon + "':", str(e))
+
+    @staticmethod
+    def _get_values(item : Database.Item) -> tuple:
+        return item.type, item.text, item.action, item.icon
+
+    def _create_image(self, icon : str) -> gtk.Image:
+        img = gtk.Image()
+        img.set_from_pixbuf(pixbuf_cache.get(os.path.join(config['general']['image_dir'], icon)))
+        return img
+
+    def _create_widget(self, item : Database.Item) -> gtk.MenuItem:
+        """
+        Creates the menu item for an entry (and, if not in lazy mode, its submenu).
+        :param item: The entry.
+        :return: The Gtk menu item.
+        """
+        self._values[item.global_id] = self._get_values(item)
+        if item.type == Database.Item.TYPE_SEPARATOR:
+            gtk_menu_item = gtk.SeparatorMenuItem()
+            self._widgets[item.global_id] = gtk_menu_item
+            return gtk_menu_item
+
+        if item.icon is not None:
+            gtk_menu_item = gtk.ImageMenuItem(item.text)
+            gtk_menu_item.set_image(self._create_image(item.icon))
+            gtk_menu_item.set_always_show_image(True)
+        else:
+            gtk_menu_item = gtk.MenuItem(item.text)
+        self._widgets[item.global_id] = gtk_menu_item
+
+        if item.type == Database.Item.TYPE_WEB:
+            gtk_menu_item.connect('activate', lambda source, action=item.action: webbrowser.open(action))
+        elif item.type == Database.Item.TYPE_MENU:
+            submenu = gtk.Menu()
+            if self.lazy:
+                # A submenu without entries would not be shown as submenu, hence the placeholder.
+                placeholder = gtk.MenuItem("…")
+                placeholder.set_sensitive(False)
+                submenu.append(placeholder)
+                gtk_menu_item.connect('activate', lambda source, submenu=submenu, item=item:
+                                      self._ensure_populated(submenu, item))
+                submenu.connect('show', lambda source, item=item: self._ensure_populated(source, item))
+            else:
+                self._populate(submenu, item)
+            gtk_menu_item.set_submenu(submenu)
+        return gtk_menu_item
+
+    def _ensure_populated(self, submenu : gtk.Menu, item : Database.Item) -> None:
+        """
+        Creates the contents of a submenu (lazy mode), unless they are up to date.
+        :param submenu: The Gtk submenu.
+        :param item: The corresponding menu entry.
+        :return: Nothing
+        """
+        if self._built.get(item.global_id) == self.database.get_revision(item.global_id):
+            return
+        for id in self._children.pop(item.global_id, []):
+            self._forget(id)
+        for child in submenu.get_children():
+            submenu.remove(child)
+            child.destroy()
+        self._populate(submenu, item)
+        submenu.show_all()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Three-way merge of bookmark trees, used when the bookmark file was changed by another process since it was read
+(see storage.XmlBackend).
+
+Entries of a menu are matched by their key (websites by their URL, menus by their name, see merge_key). An entry
+is kept if it was added on one side or if it was kept on both sides. Entries deleted on one side are dropped,
+unless the other side changed them. If both sides changed a value of an entry, our value wins.
+"""
+from typing import Dict, List, Optional, Tuple
+
+from model import Database
+
+Item = Database.Item
+
+
+def merge_key(item : Item) -> tuple:
+    """
+    :param item: An entry.
+    :return: The values identifying the entry in all versions of a menu.
+    """
+    if item.type == Item.TYPE_WEB and item.action:
+        return item.type, item.action
+    if item.type == Item.TYPE_SEPARATOR:
+        return item.type,
+    return item.type, item.text
+
+
+def _keyed(children : List[Item]) -> List[Tuple[tuple, Item]]:
+    """
+    :param children: The entries of a menu.
+    :return: (key, entry) for each entry. Keys occurring more than once are numbered (e.g., separators).
+    """
+    counts : Dict[tuple, int] = {}
+    result = []
+    for child in children:
+        key = merge_key(child)
+        count = counts.get(key, 0)
+        counts[key] = count + 1
+        result.append((key + (count,), child))
+    return result
+
+
+def _values(item : Item) -> tuple:
+    return item.text, item.action, item.type, item.icon
+
+
+def equal(a : Item, b : Item) -> bool:
+    """
+    :return: Whether two entries have the same values and the same sub-entries.
+    """
+    stack = [(a, b)]
+    while stack:
+        a, b = stack.pop()
+        if _values(a) != _values(b) or len(a.get_children()) != len(b.get_children()):
+            return False
+        stack.extend(zip(a.get_children(), b.get_children()))
+    return True
+
+
+def copy(item : Item) -> Item:
+    """
+    :return: A copy of an entry and its sub-entries (with new global ids).
+    """
+    result = Item(text=item.text, action=item.action, type=item.type, icon=item.icon)
+    for child in item.get_children():
+        result.add_child(copy(child))
+    return result
+
+
+def merge(base : Optional[Item], ours : Item, theirs : Item) -> Item:
+    """
+    Merges two versions of an entry that were both derived from base.
+    :param base: The common version (None if the entry was added on both sides).
+    :param ours: Our version.
+    :param theirs: The other version.
+    :return: The merged version (a new tree).
+    """
+    if base is None:
+        values = _values(ours)
+    else:
+        values = tuple(o if o != b else t for b, o, t in zip(_values(base), _values(ours), _values(theirs)))
+    text, action, type, icon = values
+    result = Item(text=text, action=action, type=type, icon=icon)
+    for child in _merge_children(base.get_children() if base is not None else [], ours.get_children(),
+                                 theirs.get_children()):
+        result.add_child(child)
+    return result
+
+
+def _merge_children(base : List[Item], ours : List[Item], theirs : List[Item]) -> List[Item]:
+    base_items = dict(_keyed(base))
+    our_keys = _keyed(ours)
+    our_items = dict(our_keys)
+    their_keys = _keyed(theirs)
+    their_items = dict(their_keys)
+
+    def keep(key):
+        if key in our_items and key in their_items:
+            return True
+        if key not in base_items:
+            # Added on one side
+            return True
+        # Deleted on one side: keep it only if the other side changed it
+        if key in our_items:
+            return not equal(base_items[key], our_items[key])
+        return not equal(base_items[key], their_items[key])
+
+    # Their order first (it is what the file contains now) ...
+    order = [key for key, item in their_keys if keep(key)]
+    kept = set(order)
+    # ... and our additions after the entry preceding them in our version.
+    previous = None
+    for key, item in our_keys:
+        if key not in kept and keep(key):
+            order.insert(order.index(previous) + 1 if previous is not None else 0, key)
+            kept.add(key)
+        if key in kept:
+            previous = key
+
+    result = []
+    for key in order:
+        ours_item, theirs_item = our_items.get(key), their_items.get(key)
+        if ours_item is not None and theirs_item is not None:
+            result.append(merge(base_items.get(key), ours_item, theirs_item))
+        else:
+            result.append(copy(ours_item if ours_item is not None else theirs_item))
+    return result
@@ -1,26 +1,46 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import os
-import pprint
-import shutil
-import webbrowser
-from typing import Optional, TypeVar, List
+import difflib
+import heapq
+from typing import Optional, TypeVar, List, Dict, Iterable, Set, NamedTuple, Callable, TYPE_CHECKING
 
-import gi
-import xmltodict
-import xml.etree.ElementTree as ET
+from query import FieldIndex, ItemFields, compile_query, get_host
+from searchindex import SearchIndex, fuzzy_match, normalize, PENALTY_ACTION
 
-from config import config
-
-gi.require_version('Gtk', '3.0')
-gi.require_version('Pango', '1.0')
-from gi.repository import Gtk as gtk
-from gi.repository import Pango
-from gi.repository import GdkPixbuf as pixbuf
+if TYPE_CHECKING:
+    # The model itself does not need Gtk (e.g., for the command line modes), see to_gtk_menu and get_*_hierarchy.
+    from gi.repository import Gtk as gtk
+    import backup
+    import storage
+    import treemodels
 
 T = TypeVar('T')
 
 
+class FuzzyMatch(NamedTuple):
+    """
+    Result of Database.fuzzy_search.
+    """
+    score : int
+    global_id : int
+    # Positions of the matched characters in the text and in the action (empty if not matched there)
+    text_positions : List[int]
+    action_positions : List[int]
+
+
+class ChangeEvent(NamedTuple):
+    """
+    Notification about a change of the database (see Database.subscribe).
+    """
+    # One of Database.ITEM_ADDED, Database.ITEM_REMOVED, Database.ITEM_CHANGED
+    kind : str
+    item : 'Database.Item'
+    # Parent of the item (for removals: the former parent)
+    parent : 'Database.Item'
+    # Position of the item among the children of the parent (for removals: the former position)
+    index : int
+
+
 class Database:
     """
     Stores the data (menu entries) and is able to convert it to e.g. Gtk menu entries, ...
@@ -49,6 +69,9 @@ class Database:
         """
         GLOBAL_ID = 0
 
+        # No per-instance __dict__: large bookmark trees consist of many small items.
+        __slots__ = ('text', 'action', 'type', 'children', 'icon', 'global_id')
+
         def __init__(self : T, text : str = '', action : Optional[str] = None, type : str = TYPE_WEB, icon : Optional[str] = None):
             """
 
@@ -90,231 +113,428 @@ class Database:
         def has_submenus(self) -> bool:
             return any(x for x in self.children if x.type == Database.Item.TYPE_MENU)
 
-    def __init__(self, filename : str):
+    """
+    Available persistence modes of the XML storage. "full" rewrites the whole file on every save, "journal" appends
+    the changes to a journal file next to it (see journal.Journal) and rewrites the file only when compacting.
+    """
+    PERSISTENCE_MODES = ['full', 'journal']
+
+    """
+    Available storage backends (see the module storage). "auto" chooses by the file extension.
+    """
+    STORAGES = ['auto', 'xml', 'sqlite']
+
+    """
+    Kinds of change events. For ITEM_ADDED and ITEM_REMOVED, the event is only sent for the top-most item, i.e.,
+    its sub-entries were added or removed along with it.
+    """
+    ITEM_ADDED = 'added'
+    ITEM_REMOVED = 'removed'
+    ITEM_CHANGED = 'changed'
+
+    def __init__(self, filename : str, persistence : Optional[str] = None, storage : Optional[str] = None):
+        """
+        :param filename: The file containing the bookmarks.
+        :param persistence: One of Database.PERSISTENCE_MODES (XML storage only). If not given,
+                            config['general']['persistence'] is used.
+        :param storage: One of Database.STORAGES. If not given, config['general']['storage'] is used.
+        """
         super()
+        # Imported here, since the storage backends build on this module
+        from storage import create_backend
         self.filename : str = filename
         self.data : Database.Item = Database.Item()
+        # Lookup tables, kept up to date on every mutation: global id -> item, global id -> parent item.
+        self._items : Dict[int, Database.Item] = {}
+        self._parents : Dict[int, Database.Item] = {}
+        # global id -> number of changes of the item (e.g., of its children). Missing ids have revision 0.
+        self._revisions : Dict[int, int] = {}
+        # Number of changes of the whole database
+        self.generation : int = 0
+        # Created on first use, see search() and query()
+        self._search_index : Optional[SearchIndex] = None
+        self._field_index : Optional[FieldIndex] = None
+        # Callbacks receiving a ChangeEvent for every mutation, see subscribe()
+        self._observers : List[Callable[[ChangeEvent], None]] = []
+        # Cached models of the views, see get_item_hierarchy() and get_menu_hierarchy()
+        self._item_hierarchy = None
+        self._menu_hierarchy = None
+        self._reindex()
+        self.storage : 'storage.StorageBackend' = create_backend(self, filename, storage, persistence)
+        # The storage has to see every change before the views do
+        self.subscribe(self.storage.on_change)
+
+    @property
+    def backups(self) -> Optional['backup.BackupStore']:
+        """
+        :return: The stored versions of the file, None if the storage backend does not keep backups.
+        """
+        return self.storage.backups
+
+    """
+    Available loaders for parse_file (XML storage only). "iterparse" streams the file and builds the items while
+    reading, "xmltodict" is the old loader that converts the whole document to a dictionary first.
+    """
+    LOADERS = ['iterparse', 'xmltodict']
 
-    def parse_file(self) -> bool:
+    def parse_file(self, loader : Optional[str] = None) -> bool:
         """
-        Read the entries / data from an XML file.
+        Read the entries / data from the file.
+        :param loader: One of Database.LOADERS. If not given, config['general']['loader'] is used.
         :return: False if the file was empty and the menu was newly created, True otherwise
         """
-        with open(self.filename) as fd:
-            contents = fd.read()
-            # File is empty
-            if not contents.strip(" "):
-                self.data = Database.Item(type=Database.Item.TYPE_MENU)
-                self.data.set_text("Menu")
-                return False
-            doc = xmltodict.parse(contents)
-            xml_menu = doc['menu']
-        self.data = self._parse_file_recursive(xml_menu)
-        print(self.data)
-        return True
+        self.data = self.storage.load(loader)
+        found = self.data is not None
+        if not found:
+            self.data = Database.Item(type=Database.Item.TYPE_MENU)
+            self.data.set_text("Menu")
+        self._reindex()
+        self.storage.attach(self.data)
+        return found
+
+    def _reindex(self) -> None:
+        """
+        Rebuilds the lookup tables for the whole tree (self.data).
+        :return: Nothing
+        """
+        self._items = {}
+        self._parents = {}
+        self._revisions = {}
+        self._search_index = None
+        self._field_index = None
+        self.generation += 1
+        self._index_subtree(self.data, None)
+
+    def _index_subtree(self, item : Item, parent : Optional[Item]) -> None:
+        stack = [(item, parent)]
+        while stack:
+            item, parent = stack.pop()
+            self._items[item.global_id] = item
+            if parent is not None:
+                self._parents[item.global_id] = parent
+            if self._search_index is not None and item.type != Database.Item.TYPE_SEPARATOR:
+                self._search_index.add(item.global_id, item.text)
+            if self._field_index is not None and parent is not None and item.type != Database.Item.TYPE_SEPARATOR:
+                self._field_index.add(item.global_id, self._get_fields(item, parent))
+            stack.extend((child, item) for child in item.get_children())
+
+    def _unindex_subtree(self, item : Item) -> None:
+        stack = [item]
+        while stack:
+            item = stack.pop()
+            self._items.pop(item.global_id, None)
+            self._parents.pop(item.global_id, None)
+            self._revisions.pop(item.global_id, None)
+            if self._search_index is not None:
+                self._search_index.remove(item.global_id)
+            if self._field_index is not None:
+                self._field_index.remove(item.global_id)
+            stack.extend(item.get_children())
+
+    def _get_fields(self, item : Item, parent : Item) -> ItemFields:
+        """
+        Computes the fields used by query() for an entry. The fields of the parent must already be known.
+        :param item: The entry.
+        :param parent: The parent of the entry.
+        :return: The fields.
+        """
+        if parent is self.data:
+            folder = ()
+        else:
+            folder = self._field_index.fields[parent.global_id].folder + (normalize(parent.text),)
+        return ItemFields(text=normalize(item.text), action=item.action or '', type=item.type,
+                          host=get_host(item.action) if item.type == Database.Item.TYPE_WEB else None,
+                          folder=folder)
+
+    def query(self, query : str) -> List[Item]:
+        """
+        Finds all entries matching a structured query, e.g., 'site:github.com type:www in:"Work/Infra" kube'
+        (see the module query for the syntax). The fields needed are computed on the first call and then updated
+        on every change.
+        :param query: The query (searched for as plain text if it is invalid, see query.parse_or_text).
+        :return: The matching entries (in the order they were created).
+        """
+        if self._field_index is None:
+            self._field_index = FieldIndex()
+            # Parents first, since the folder of an entry is derived from its parent
+            stack = [(child, self.data) for child in reversed(self.data.get_children())]
+            while stack:
+                item, parent = stack.pop()
+                if item.type != Database.Item.TYPE_SEPARATOR:
+                    self._field_index.add(item.global_id, self._get_fields(item, parent))
+                stack.extend((child, item) for child in reversed(item.get_children()))
+        plan = compile_query(query, self._field_index)
+        return [self._items[id] for id in plan.run(self._field_index)]
+
+    def search(self, query : str, candidates : Optional[Iterable[int]] = None) -> Set[int]:
+        """
+        Finds all entries (except separators) whose text contains the query (case-insensitive).
+        The search index (see searchindex.SearchIndex) is created on the first call and then updated on every change.
+        :param query: The text to search for.
+        :param candidates: If given, only these ids are considered.
+        :return: Global ids of the matching entries.
+        """
+        if self._search_index is None:
+            self._search_index = SearchIndex()
+            for item in self._items.values():
+                if item.type != Database.Item.TYPE_SEPARATOR:
+                    self._search_index.add(item.global_id, item.text)
+        return self._search_index.search(query, candidates)
+
+    def fuzzy_search(self, query : str, limit : int) -> List[FuzzyMatch]:
+        """
+        Fuzzy search over the texts and actions (e.g., URLs) of all entries (see searchindex.fuzzy_match).
+        Only the best results are kept (bounded heap), i.e., broad queries do not return thousands of entries.
+        :param query: The query.
+        :param limit: Maximum number of results.
+        :return: The best matches, best first.
+        """
+        query = query.lower()
+
+        def matches():
+            for item in self._items.values():
+                if item.type == Database.Item.TYPE_SEPARATOR or item is self.data:
+                    continue
+                text_match = fuzzy_match(query, item.text)
+                action_match = fuzzy_match(query, item.action)
+                if text_match is None and action_match is None:
+                    continue
+                text_score = text_match[0] if text_match is not None else None
+                action_score = action_match[0] - PENALTY_ACTION if action_match is not None else None
+                score = max(s for s in (text_score, action_score) if s is not None)
+                # Ties are broken by the order of the entries (older first)
+                yield (score, -item.global_id,
+                       text_match[1] if text_match is not None else [],
+                       action_match[1] if action_match is not None else [])
+
+        return [FuzzyMatch(score, -negative_id, text_positions, action_positions)
+                for score, negative_id, text_positions, action_positions in heapq.nlargest(limit, matches())]
+
+    def get_revision(self, id : int) -> int:
+        """
+        Returns the revision of an entry, which is increased whenever the entry (e.g., its list of children) changes.
+        Can be used to check whether something derived from the entry (e.g., a submenu) is still up to date.
+        :param id: The global id of the item.
+        :return: The revision.
+        """
+        return self._revisions.get(id, 0)
+
+    def _touch(self, item : Item) -> None:
+        self._revisions[item.global_id] = self._revisions.get(item.global_id, 0) + 1
+        self.generation += 1
+
+    def subscribe(self, callback : Callable[[ChangeEvent], None]) -> None:
+        """
+        Registers a callback that is called after every change of an entry (added, removed or changed), e.g., to
+        update a view. Reloading the whole file (parse_file) is not reported, it only increases the generation.
+        :param callback: Function receiving a ChangeEvent.
+        :return: Nothing
+        """
+        self._observers.append(callback)
+
+    def unsubscribe(self, callback : Callable[[ChangeEvent], None]) -> None:
+        """
+        Removes a callback registered with subscribe(). Unknown callbacks are ignored.
+        :param callback: The callback.
+        :return: Nothing
+        """
+        if callback in self._observers:
+            self._observers.remove(callback)
+
+    def _notify(self, kind : str, item : Item, parent : Item, index : int) -> None:
+        event = ChangeEvent(kind, item, parent, index)
+        # Copy, since callbacks may unsubscribe
+        for callback in list(self._observers):
+            callback(event)
 
-    def _parse_file_recursive(self, xml_menu : dict) -> Item:
-        menu = Database.Item(type=Database.Item.TYPE_MENU)
-        for key, value in xml_menu.items():
-            if key == '@name':
-                menu.set_text(value)
-            elif key == 'item':
-                if not isinstance(value, list):
-                    value = [value]
-                for item in value:
-                    dbitem = Database.Item()
-                    item_key = ''
-                    for item_key, item_value in item.items():
-                        if item_key == 'text':
-                            dbitem.set_text(item_value)
-                        elif item_key == 'action':
-                            for action_key, action_value in item_value.items():
-                                if action_key == '#text':
-                                    dbitem.set_action(action_value)
-                                elif action_key == '@type':
-                                    dbitem.set_type(action_value)
-                        elif item_key == 'icon':
-                            dbitem.set_icon(item_value)
-                        elif item_key == 'separator':
-                            menu.add_child(Database.Item(type=Database.Item.TYPE_SEPARATOR))
-                            break
-                    if item_key != 'separator':
-                        menu.add_child(dbitem)
-            elif key == 'menu':
-                if not isinstance(value, list):
-                    value = [value]
-                for item in value:
-                    menu.add_child(self._parse_file_recursive(item))
-
-        return menu
+    def get_item(self, id : int) -> Optional[Item]:
+        """
+        Look up an entry by ID.
+        :param id: The global id of the item.
+        :return: The item or None, if there is no item with this id.
+        """
+        return self._items.get(id)
+
+    def get_parent(self, id : int) -> Optional[Item]:
+        """
+        Look up the parent of an entry.
+        :param id: The global id of the item.
+        :return: The parent item or None for the top-level menu and unknown ids.
+        """
+        return self._parents.get(id)
+
+    def get_path(self, id : int) -> List[Item]:
+        """
+        Returns the path from the top-level menu to an entry.
+        :param id: The global id of the item.
+        :return: List of items, starting with the top-level menu and ending with the item itself.
+                 Empty if the item does not exist.
+        """
+        item = self._items.get(id)
+        path = []
+        while item is not None:
+            path.append(item)
+            item = self._parents.get(item.global_id)
+        path.reverse()
+        return path
+
+    def describe(self, item : Item) -> dict:
+        """
+        Converts an entry to a dictionary (e.g., to print it as JSON).
+        :param item: The entry.
+        :return: id (global id), text, action, type, icon and folder (the names of the menus containing the entry,
+                 without the top-level menu).
+        """
+        return {'id': item.global_id, 'text': item.text, 'action': item.action, 'type': item.type, 'icon': item.icon,
+                'folder': [menu.text for menu in self.get_path(item.global_id)[1:-1]]}
 
     def save_data(self) -> None:
         """
-        Writes the current data to the XML file.
+        Saves the changes (see the storage backend, e.g., storage.XmlBackend.save).
+        :return: Nothing
+        """
+        self.storage.save()
+
+    def compact(self) -> None:
+        """
+        Brings the file into its final form, e.g., folds the journal into the XML file (see storage.XmlBackend).
+        Should be called on exit.
+        :return: Nothing
+        """
+        self.storage.compact()
 
-        Note, that this function saves the old file (as "filename~") to avoid data loss.
-        This could perhaps be improved (e.g., keep more versions) ...
+    def restore_backup(self, digest : str) -> None:
+        """
+        Replaces the file by a version from the backup store. The data of this object is not reloaded.
+        :param digest: Content hash of the version (see self.backups.versions()).
         :return: Nothing
+        :raises ValueError: If the storage backend does not keep backups.
+        """
+        self.storage.restore_backup(digest)
+
+    def get_index_path(self, id : int) -> List[int]:
+        """
+        The position of an item in the tree as list of child indices (starting at the top-level menu).
+        In contrast to global ids, index paths are the same every time the file is read.
+        :param id: The global id of the item.
+        :return: List of child indices (empty for the top-level menu).
+        """
+        path = self.get_path(id)
+        return [next(idx for idx, child in enumerate(path[i].get_children()) if child is path[i + 1])
+                for i in range(len(path) - 1)]
+
+    def get_item_by_index_path(self, index_path : List[int]) -> Optional[Item]:
+        """
+        :param index_path: List of child indices (see get_index_path).
+        :return: The item at this position or None, if there is none.
         """
-        data = ET.Element("menu")
-        data.set("name", self.data.text)
-        self._save_data_recursive(self.data, data)
-        ET.indent(data, space=" ", level=0)
-
-        # Make a copy of the file to not loose content just in case
-        shutil.copy(self.filename, self.filename + "~")
-
-        with open(self.filename, "wb") as f:
-            f.write(ET.tostring(data))
-
-    def _save_data_recursive(self, parent : Item, parent_tag : ET.Element):
-        for item in parent.get_children():
-            if item.type == Database.Item.TYPE_MENU:
-                element = ET.SubElement(parent_tag, 'menu')
-                element.set('name', item.text)
-                if item.icon is not None:
-                    ET.SubElement(element, 'icon').text = item.icon
-                self._save_data_recursive(item, element)
-            elif item.type == Database.Item.TYPE_WEB:
-                element = ET.SubElement(parent_tag, 'item')
-                ET.SubElement(element, 'text').text = item.text
-                if item.icon is not None:
-                    ET.SubElement(element, 'icon').text = item.icon
-                se = ET.SubElement(element, 'action')
-                se.text = item.action
-                se.set('type', 'www')
-            elif item.type == Database.Item.TYPE_SEPARATOR:
-                element = ET.SubElement(parent_tag, 'item')
-                ET.SubElement(element, 'separator')
-
-    def to_gtk_menu(self, data : Optional[Item] = None) -> gtk.Menu:
+        item = self.data
+        for idx in index_path:
+            if idx >= len(item.get_children()):
+                return None
+            item = item.get_children()[idx]
+        return item
+
+    def to_gtk_menu(self, data : Optional[Item] = None, lazy : Optional[bool] = None) -> 'gtk.Menu':
         """
         Exports the data as a Gtk menu.
         :param data: The menu to start with. If not given, self.data is used.
+        :param lazy: Create submenus on first use (see menuview.MenuView). If not given, config['menu']['lazy'] is used.
         :return: The Gtk menu containing all (sub)entries of data or self.data.
         """
-        if data is None:
-            data = self.data
-
-        gtk_menu = gtk.Menu()
-        for item in data.get_children():
-            if item.type == Database.Item.TYPE_WEB:
-
-                if item.icon is not None:
-
-                    pb = pixbuf.Pixbuf.new_from_file(
-                        os.path.join(os.path.join(config['general']['image_dir'], item.icon)))
-                    pb = pb.scale_simple(25, 25, pixbuf.InterpType.BILINEAR)
-                    img = gtk.Image()
-                    img.set_from_pixbuf(pb)
-                    gtk_menu_item = gtk.ImageMenuItem(item.text)
-                    gtk_menu_item.set_image(img)
-                    gtk_menu_item.set_always_show_image(True)
-                else:
-                    gtk_menu_item = gtk.MenuItem(item.text)
-                gtk_menu_item.connect('activate', lambda source, action=item.action: webbrowser.open(action))
-                gtk_menu.append(gtk_menu_item)
-
-            elif item.type == Database.Item.TYPE_SEPARATOR:
-                gtk_menu.append(gtk.SeparatorMenuItem())
-
-            elif item.type == Database.Item.TYPE_MENU:
-                submenu = self.to_gtk_menu(item)
-                if item.icon is not None:
-                    pb = pixbuf.Pixbuf.new_from_file(
-                        os.path.join(os.path.join(config['general']['image_dir'], item.icon)))
-                    pb = pb.scale_simple(25, 25, pixbuf.InterpType.BILINEAR)
-                    img = gtk.Image()
-                    img.set_from_pixbuf(pb)
-                    submenu_item = gtk.ImageMenuItem(item.text)
-                    submenu_item.set_image(img)
-                    submenu_item.set_always_show_image(True)
-                else:
-                    submenu_item = gtk.MenuItem(item.text)
-                submenu_item.set_submenu(submenu)
-                gtk_menu.append(submenu_item)
-        return gtk_menu
-
-    def get_menu_hierarchy(self) -> gtk.TreeStore:
-        """
-        Exports all submenus (without entries) as TreeStore.
+        from menuview import MenuView
+        return MenuView(self, lazy).build(data)
+
+    def get_menu_hierarchy(self) -> 'treemodels.MenuHierarchy':
+        """
+        Exports all submenus (without entries) as TreeStore (MenuHierarchy.store).
         This is used, e.g., for the form where you can choose where to add the bookmark.
         The treestore contains (0) the text (str) and (1) the global id (int).
+        The model is created once and then kept up to date with the changes of the database.
         :return: Treestore containing all menus.
         """
-        treestore = gtk.TreeStore.new(types=[str,int])
-        toplevel = treestore.append(None)
-        treestore.set_value(toplevel, 0, self.data.text)
-        treestore.set_value(toplevel, 1, self.data.global_id)
-        self._get_menu_hierarchy_recursive(self.data, treestore, toplevel)
-        return treestore
-
-    def _get_menu_hierarchy_recursive(self, parent_entry : Item, treestore : gtk.TreeStore, parent_level : gtk.TreeIter) -> None:
-        for menu_entry in parent_entry.get_children():
-            if menu_entry.type != Database.Item.TYPE_MENU:
-                continue
-            newlevel = treestore.append(parent_level)
-            treestore.set_value(newlevel, 0, menu_entry.text)
-            treestore.set_value(newlevel, 1, menu_entry.global_id)
-            if menu_entry.has_submenus():
-                self._get_menu_hierarchy_recursive(menu_entry, treestore, newlevel)
-
-    def get_item_hierarchy(self) -> gtk.TreeStore:
-        """
-        Exports all entries as TreeStore. It is used for filtering.
+        from treemodels import MenuHierarchy
+        if self._menu_hierarchy is None or self._menu_hierarchy.generation != self.generation:
+            if self._menu_hierarchy is not None:
+                self._menu_hierarchy.close()
+            self._menu_hierarchy = MenuHierarchy(self)
+        return self._menu_hierarchy
+
+    def get_item_hierarchy(self) -> 'treemodels.ItemHierarchy':
+        """
+        Exports all entries as Gtk tree model. It is used for filtering.
         The structure is:
         (1) str:            label/text
         (2) str:            item type (www/menu/...)
         (3) str:            action
-        (4) bool:           always true on return; can be used to hide some elements in the view
-        (5) Pango.Weight:   not set on return; can be used to print some entries bold
+        (4) bool:           true, unless changed by a view; can be used to hide some elements in the view
+        (5) Pango.Weight:   normal, unless changed by a view; can be used to print some entries bold
         (6) int:            global ID
+        The model reads the entries directly (without copying them) and is kept up to date. It is shared, i.e., a
+        view that changes the columns (4) and (5) has to acquire it (see treemodels.ItemHierarchy.acquire) and
+        reset them when done.
         :return: Menu entries
         """
-        treestore = gtk.TreeStore.new(types=[str, str, str, bool, Pango.Weight, int])
-        toplevel : gtk.TreeIter = treestore.append(None)
-        treestore.set_value(toplevel, 0, self.data.text)
-        if self.data.type is not None:
-            treestore.set_value(toplevel, 1, self.data.type)
-        if self.data.action is not None:
-            treestore.set_value(toplevel, 2, self.data.action)
-        treestore.set_value(toplevel, 3, True)
-        treestore.set_value(toplevel, 5, self.data.global_id)
-        self._get_item_hierarchy_recursive(self.data, treestore, toplevel)
-        return treestore
-
-    def _get_item_hierarchy_recursive(self, parent_entry : Item, treestore : gtk.TreeStore, parent_level : gtk.TreeIter) -> None:
-        for menu_entry in parent_entry.get_children():
-            if menu_entry.type == Database.Item.TYPE_SEPARATOR:
-                continue
-            newlevel = treestore.append(parent_level)
-            treestore.set_value(newlevel, 0, menu_entry.text)
-            if menu_entry.type is not None:
-                treestore.set_value(newlevel, 1, menu_entry.type)
-            if menu_entry.action is not None:
-                treestore.set_value(newlevel, 2, menu_entry.action)
-            treestore.set_value(newlevel, 3, True)
-            treestore.set_value(newlevel, 5, menu_entry.global_id)
-            self._get_item_hierarchy_recursive(menu_entry, treestore, newlevel)
-
-    def add_item(self, parent_id : int, item : Item) -> bool:
+        from treemodels import ItemHierarchy
+        if self._item_hierarchy is None or self._item_hierarchy.generation != self.generation:
+            if self._item_hierarchy is not None:
+                self._item_hierarchy.close()
+            self._item_hierarchy = ItemHierarchy(self)
+        return self._item_hierarchy
+
+    def add_item(self, parent_id : int, item : Item, position : Optional[int] = None) -> bool:
         """
         Add a new entry.
-        :param parent_id: The id of the parent item. The item is appended as a child element.
+        :param parent_id: The id of the parent item. The item is added as a child element.
         :param item: Item to add.
+        :param position: Position among the children of the parent. If not given, the item is appended.
         :return: True when the item could be added, False otherwise (e.g., the parent item does not exist)
         """
-        return self._add_item_recursive(parent_id, item, self.data)
+        parent = self._items.get(parent_id)
+        if parent is None:
+            return False
+        self._insert_item(parent, item, position)
+        return True
 
-    def _add_item_recursive(self, parent_id : int, item : Item, data : Item) -> bool:
-        if data.global_id == parent_id:
-            data.add_child(item)
-            return True
+    def _insert_item(self, parent : Item, item : Item, position : Optional[int] = None) -> None:
+        children = parent.get_children()
+        if position is None or position >= len(children):
+            position = len(children)
+        children.insert(position, item)
+        self._index_subtree(item, parent)
+        self._touch(parent)
+        self._notify(Database.ITEM_ADDED, item, parent, position)
 
-        for child in data.get_children():
-            if self._add_item_recursive(parent_id, item, child):
-                return True
-        return False
+    def update_item(self, id : int, text : str, action : Optional[str], type : str, icon : Optional[str]) -> bool:
+        """
+        Changes the values of an entry (its sub-entries are kept).
+        :param id: The id of the item.
+        :param text: The new text.
+        :param action: The new action.
+        :param type: The new type.
+        :param icon: The new icon.
+        :return: True when the item could be changed, False otherwise (e.g., the item does not exist)
+        """
+        item = self._items.get(id)
+        if item is None:
+            return False
+        self._update_item(item, text, action, type, icon)
+        return True
+
+    def _update_item(self, item : Item, text : str, action : Optional[str], type : str, icon : Optional[str]) -> None:
+        item.set_text(text)
+        item.set_action(action)
+        item.set_type(type)
+        item.set_icon(icon)
+        parent = self._parents.get(item.global_id)
+        # Updates the search index and the fields (the folder of all sub-entries contains the text)
+        self._index_subtree(item, parent)
+        self._touch(item)
+        index = 0
+        if parent is not None:
+            self._touch(parent)
+            index = next(i for i, child in enumerate(parent.get_children()) if child is item)
+        self._notify(Database.ITEM_CHANGED, item, parent, index)
 
     def delete_item_by_id(self, id : int) -> bool:
         """
@@ -322,23 +542,122 @@ class Database:
         :param id: The id of the item to be deleted.
         :return: True when the item could be deleted, False otherwise (e.g., the item does not exist)
         """
-        return self._delete_item_recursive(id, self.data)
+        parent = self._parents.get(id)
+        if parent is None:
+            # Unknown id or the top-level menu (which cannot be deleted)
+            return False
+        self._remove_item(parent, self._items[id])
+        return True
 
-    def _delete_item_recursive(self, id : int, data : Item) -> bool:
-        found = False
-        idx = 0
-        for idx in range(len(data.get_children())):
-            if data.get_children()[idx].global_id == id:
-                found = True
+    def _remove_item(self, parent : Item, item : Item) -> None:
+        children = parent.get_children()
+        index = -1
+        for idx in range(len(children)):
+            if children[idx] is item:
+                del children[idx]
+                index = idx
                 break
-            if self._delete_item_recursive(id, data.get_children()[idx]):
-                return True
+        self._unindex_subtree(item)
+        self._touch(parent)
+        self._notify(Database.ITEM_REMOVED, item, parent, index)
 
-        if found:
-            del data.get_children()[idx]
-            return True
+    def reload(self, loader : Optional[str] = None) -> bool:
+        """
+        Reads the file again (e.g., after it was edited by hand) and applies the differences to the current entries.
+        Unchanged entries (and their global ids) are kept, so only the changed parts cause change events (and updates
+        of the views). In contrast to parse_file, the views do not have to be created again.
+        :param loader: One of Database.LOADERS. If not given, config['general']['loader'] is used.
+        :return: True if anything changed, False otherwise.
+        """
+        generation = self.generation
+        loaded = self.storage.load_version(loader)
+        if loaded is None:
+            loaded = Database.Item(text="Menu", type=Database.Item.TYPE_MENU)
+        self.apply_version(loaded)
+        self.storage.attach(self.data)
+        return self.generation != generation
+
+    def apply_version(self, root : Item) -> bool:
+        """
+        Changes the entries to match another version of them (e.g., read from the file or merged with the changes of
+        another process). Like reload, only the differences cause change events. The storage is not notified, since
+        the version is stored already (or is about to be stored).
+        :param root: The top-level menu of the other version. Its items are used for added entries.
+        :return: True if anything changed, False otherwise.
+        """
+        generation = self.generation
+        self.unsubscribe(self.storage.on_change)
+        mapping : Dict[int, int] = {}
+        try:
+            self._merge_item(self.data, root, mapping)
+        finally:
+            self._observers.insert(0, self.storage.on_change)
+        self.storage.rebind(mapping)
+        return self.generation != generation
+
+    @staticmethod
+    def _merge_key(item : Item) -> tuple:
+        """
+        :param item: An entry.
+        :return: The values identifying an entry when comparing two versions of a menu (see _merge_children).
+        """
+        if item.type == Database.Item.TYPE_MENU:
+            # The contents of a menu are compared separately
+            return item.type, item.text
+        return item.type, item.text, item.action
+
+    def _merge_item(self, item : Item, loaded : Item, mapping : Dict[int, int]) -> None:
+        """
+        Changes an entry and its sub-entries to match another version of it.
+        :param item: The current entry.
+        :param loaded: The other version (its items are used for added sub-entries).
+        :param mapping: Receives the global id of the other version -> global id of the kept entry.
+        :return: Nothing
+        """
+        mapping[loaded.global_id] = item.global_id
+        if (item.text, item.action, item.type, item.icon) != (loaded.text, loaded.action, loaded.type, loaded.icon):
+            self._update_item(item, loaded.text, loaded.action, loaded.type, loaded.icon)
+        self._merge_children(item, loaded, mapping)
+
+    def _merge_children(self, item : Item, loaded : Item, mapping : Dict[int, int]) -> None:
+        old = list(item.get_children())
+        new = loaded.get_children()
+        old_keys = [self._merge_key(child) for child in old]
+        new_keys = [self._merge_key(child) for child in new]
+        # Positions of matching entries (old, new), in ascending order
+        if old_keys == new_keys:
+            pairs = list(zip(range(len(old)), range(len(new))))
         else:
-            return False
+            pairs = []
+            for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old_keys, new_keys, autojunk=False).get_opcodes():
+                if tag == 'equal':
+                    pairs.extend(zip(range(i1, i2), range(j1, j2)))
+                elif tag == 'replace':
+                    # Entries of the same type are changed in place (e.g., a renamed menu keeps its contents)
+                    types = difflib.SequenceMatcher(None, [child.type for child in old[i1:i2]],
+                                                    [child.type for child in new[j1:j2]], autojunk=False)
+                    for a, b, size in types.get_matching_blocks():
+                        pairs.extend((i1 + a + k, j1 + b + k) for k in range(size))
+
+        matched = dict((j, i) for i, j in pairs)
+        kept = set(matched.values())
+        # Backwards, so that the positions of the remaining entries do not change
+        for i in reversed(range(len(old))):
+            if i not in kept:
+                self._remove_item(item, old[i])
+        # The kept entries are in the right order, the new ones are added in between
+        for j in range(len(new)):
+            if j in matched:
+                self._merge_item(old[matched[j]], new[j], mapping)
+            else:
+                self._insert_item(item, new[j], j)
+
+    def __len__(self) -> int:
+        """
+        :return: Number of entries (including the top-level menu and separators).
+        """
+        return len(self._items)
 
     def __str__(self) -> str:
+        import pprint
         return pprint.pformat(self.data)
@@ -1,8 +1,10 @@
+import os
 import shutil
 import gi
 
+from iconcache import thumbnail_cache
 from model import Database
-from config import *
+from config import config
 
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk as gtk
@@ -94,7 +96,7 @@ class NewEntryWindow(gtk.Window):
         col.pack_start(renderer, True)
         col.add_attribute(renderer, "text", 0)
         self.treeview.append_column(col)
-        self.treeview.set_model(self.database.get_menu_hierarchy())
+        self.treeview.set_model(self.database.get_menu_hierarchy().store)
         self.treeview.expand_all()
 
         self.scrollable_treelist = gtk.ScrolledWindow()
@@ -168,6 +170,12 @@ class NewEntryWindow(gtk.Window):
             except shutil.SameFileError:
                 pass # Okay in this case
             icon_path = os.path.basename(icon_path)
+            if config['icons']['thumbnails']:
+                try:
+                    thumbnail_cache.get(os.path.join(config['general']['image_dir'], icon_path))
+                except Exception as e:
+                    # Not fatal, the icon is scaled when the menu is created
+                    print("Could not create thumbnail:", str(e))
 
         item = Database.Item(text=title, action=action_text, type=action_type, icon=icon_path)
         if self.database.add_item(menu_item_id, item):
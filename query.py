@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Structured queries, e.g.
+
+    site:github.com type:www in:"Work/Infra" kube
+
+Supported terms (all terms must match, a leading "-" negates a term):
+ - site:HOST        the host of the URL is HOST or a subdomain of HOST
+ - type:TYPE        the entry type (www, menu, ...)
+ - in:PATH          the entry is located in the menu PATH (menu names separated by "/", the top-level menu is omitted)
+ - re:PATTERN       the text or the action (URL) matches the regular expression (case-insensitive),
+                    /PATTERN/ is the same
+ - any other term   the text contains the term (case-insensitive)
+Terms containing spaces can be quoted. A query that cannot be parsed (e.g., a quote is not closed) is searched for as
+plain text.
+"""
+import re
+import shlex
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from searchindex import SearchIndex, normalize
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+class ItemFields(NamedTuple):
+    """
+    Precomputed (normalized) fields of an entry that queries are evaluated on.
+    """
+    text : str
+    action : str
+    type : str
+    host : Optional[str]
+    # Normalized names of the menus containing the entry (without the top-level menu)
+    folder : Tuple[str, ...]
+
+
+def get_host(action : Optional[str]) -> Optional[str]:
+    """
+    :param action: The action of an entry (e.g., a URL).
+    :return: The host name of the URL (lower case), None if there is none.
+    """
+    if not action:
+        return None
+    try:
+        host = urlsplit(action).hostname
+        if host is None and "://" not in action:
+            # URL without scheme, e.g., "github.com/..."
+            host = urlsplit("//" + action).hostname
+    except ValueError:
+        return None
+    return host
+
+
+class FieldIndex:
+    """
+    The fields of all entries, with lookup tables for the fields that can be used to find candidates quickly.
+    """
+
+    def __init__(self):
+        self.fields : Dict[int, ItemFields] = {}
+        self.by_type : Dict[str, Set[int]] = {}
+        self.by_host : Dict[str, Set[int]] = {}
+        # Trigram index of the texts
+        self.texts : SearchIndex = SearchIndex()
+
+    def add(self, id : int, fields : ItemFields) -> None:
+        if id in self.fields:
+            self.remove(id)
+        self.fields[id] = fields
+        self.by_type.setdefault(fields.type, set()).add(id)
+        if fields.host is not None:
+            self.by_host.setdefault(fields.host, set()).add(id)
+        self.texts.add(id, fields.text)
+
+    def remove(self, id : int) -> None:
+        fields = self.fields.pop(id, None)
+        if fields is None:
+            return
+        self._discard(self.by_type, fields.type, id)
+        if fields.host is not None:
+            self._discard(self.by_host, fields.host, id)
+        self.texts.remove(id)
+
+    @staticmethod
+    def _discard(table : Dict[str, Set[int]], key : str, id : int) -> None:
+        ids = table.get(key)
+        if ids is not None:
+            ids.discard(id)
+            if not ids:
+                del table[key]
+
+
+class Predicate:
+    """
+    A single term of a query.
+    Predicates that can use a lookup table of the FieldIndex implement estimate() and candidates().
+    """
+    # Relative cost of matches() for a single entry (used to order the filters)
+    cost = 1
+
+    def __init__(self, negated : bool = False):
+        self.negated : bool = negated
+
+    def estimate(self, index : FieldIndex) -> Optional[int]:
+        """
+        :param index: The field index.
+        :return: Upper bound for the number of matching entries, None if the predicate cannot use a lookup table.
+        """
+        return None
+
+    def candidates(self, index : FieldIndex) -> Set[int]:
+        """
+        :param index: The field index.
+        :return: All ids that match (only if estimate() is not None).
+        """
+        raise NotImplementedError()
+
+    def matches(self, fields : ItemFields) -> bool:
+        raise NotImplementedError()
+
+    def test(self, fields : ItemFields) -> bool:
+        """
+        :param fields: The fields of an entry.
+        :return: Whether the entry satisfies the predicate (including negation).
+        """
+        return self.matches(fields) != self.negated
+
+    def __str__(self) -> str:
+        return ("-" if self.negated else "") + self.describe()
+
+    def describe(self) -> str:
+        raise NotImplementedError()
+
+
+class TypePredicate(Predicate):
+    def __init__(self, type : str, negated : bool = False):
+        super().__init__(negated)
+        self.type : str = type.lower()
+
+    def estimate(self, index : FieldIndex) -> Optional[int]:
+        return len(index.by_type.get(self.type, ()))
+
+    def candidates(self, index : FieldIndex) -> Set[int]:
+        return set(index.by_type.get(self.type, ()))
+
+    def matches(self, fields : ItemFields) -> bool:
+        return fields.type == self.type
+
+    def describe(self) -> str:
+        return "type:" + self.type
+
+
+class SitePredicate(Predicate):
+    def __init__(self, host : str, negated : bool = False):
+        super().__init__(negated)
+        self.host : str = host.lower()
+
+    def _hosts(self, index : FieldIndex) -> Iterable[str]:
+        return (host for host in index.by_host if self._host_matches(host))
+
+    def _host_matches(self, host : Optional[str]) -> bool:
+        return host is not None and (host == self.host or host.endswith("." + self.host))
+
+    def estimate(self, index : FieldIndex) -> Optional[int]:
+        return sum(len(index.by_host[host]) for host in self._hosts(index))
+
+    def candidates(self, index : FieldIndex) -> Set[int]:
+        result = set()
+        for host in self._hosts(index):
+            result.update(index.by_host[host])
+        return result
+
+    def matches(self, fields : ItemFields) -> bool:
+        return self._host_matches(fields.host)
+
+    def describe(self) -> str:
+        return "site:" + self.host
+
+
+class FolderPredicate(Predicate):
+    cost = 2
+
+    def __init__(self, path : str, negated : bool = False):
+        super().__init__(negated)
+        self.path : Tuple[str, ...] = tuple(normalize(name) for name in path.split("/") if name)
+
+    def matches(self, fields : ItemFields) -> bool:
+        return fields.folder[:len(self.path)] == self.path
+
+    def describe(self) -> str:
+        return "in:" + "/".join(self.path)
+
+
+class TextPredicate(Predicate):
+    cost = 3
+
+    def __init__(self, text : str, negated : bool = False):
+        super().__init__(negated)
+        self.text : str = normalize(text)
+
+    def estimate(self, index : FieldIndex) -> Optional[int]:
+        return index.texts.estimate(self.text)
+
+    def candidates(self, index : FieldIndex) -> Set[int]:
+        return index.texts.search(self.text)
+
+    def matches(self, fields : ItemFields) -> bool:
+        return self.text in fields.text
+
+    def describe(self) -> str:
+        return repr(self.text)
+
+
+class RegexPredicate(Predicate):
+    cost = 10
+
+    def __init__(self, pattern : str, negated : bool = False):
+        super().__init__(negated)
+        try:
+            self.regex = re.compile(pattern, re.IGNORECASE)
+        except re.error as e:
+            raise QuerySyntaxError("Invalid regular expression '" + pattern + "': " + str(e))
+
+    def matches(self, fields : ItemFields) -> bool:
+        return self.regex.search(fields.text) is not None or self.regex.search(fields.action) is not None
+
+    def describe(self) -> str:
+        return "re:" + self.regex.pattern
+
+
+"""
+Term prefixes and the corresponding predicates.
+"""
+PREFIXES = {
+    'site:': SitePredicate,
+    'type:': TypePredicate,
+    'in:': FolderPredicate,
+    're:': RegexPredicate,
+}
+
+
+def tokenize(query : str) -> List[str]:
+    """
+    Splits a query into terms (quoted terms may contain spaces).
+    :param query: The query.
+    :return: The terms, without the quotes.
+    :raises QuerySyntaxError: If a quote is not closed.
+    """
+    try:
+        lexer = shlex.shlex(query, posix=True)
+        lexer.whitespace_split = True
+        lexer.commenters = ''
+        return list(lexer)
+    except ValueError as e:
+        raise QuerySyntaxError("Invalid query: " + str(e))
+
+
+def parse(query : str) -> List[Predicate]:
+    """
+    Parses a query (see the module documentation).
+    :param query: The query.
+    :return: The predicates (terms) of the query.
+    :raises QuerySyntaxError: If the query is invalid (e.g., a quote is not closed).
+    """
+    predicates = []
+    for token in tokenize(query):
+        negated = len(token) > 1 and token.startswith("-")
+        if negated:
+            token = token[1:]
+        for prefix, predicate in PREFIXES.items():
+            if token.lower().startswith(prefix) and len(token) > len(prefix):
+                predicates.append(predicate(token[len(prefix):], negated))
+                break
+        else:
+            if len(token) > 2 and token.startswith("/") and token.endswith("/"):
+                predicates.append(RegexPredicate(token[1:-1], negated))
+            else:
+                predicates.append(TextPredicate(token, negated))
+    return predicates
+
+
+def parse_or_text(query : str) -> List[Predicate]:
+    """
+    Parses a query like parse, but an invalid query (e.g., "Bob's", whose quote is not closed) is searched for as
+    plain text, so that a query that is being typed does not fail.
+    :param query: The query.
+    :return: The predicates (terms) of the query.
+    """
+    try:
+        return parse(query)
+    except QuerySyntaxError:
+        return [TextPredicate(query)]
+
+
+def is_structured(query : str) -> bool:
+    """
+    :param query: A query.
+    :return: False if the query is a plain text (which is searched for as a whole), True if a term starts with a
+             prefix (e.g., "site:"), "-" or a quote (if all quotes are closed), or is a /regular expression/.
+    """
+    quoted = False
+    for token in query.split():
+        if len(token) > 1 and token.startswith("-"):
+            return True
+        if any(token.lower().startswith(prefix) for prefix in PREFIXES) or \
+                (len(token) > 2 and token.startswith("/") and token.endswith("/")):
+            return True
+        quoted = quoted or token[0] in "\"'"
+    if quoted:
+        try:
+            tokenize(query)
+        except QuerySyntaxError:
+            return False
+    return quoted
+
+
+class QueryPlan:
+    """
+    A compiled query: the most selective predicate that can use a lookup table provides the candidates,
+    all other predicates are applied to the candidates as filters (cheapest first).
+    """
+
+    def __init__(self, predicates : List[Predicate], index : FieldIndex):
+        self.source : Optional[Predicate] = None
+        estimates = [(p.estimate(index), p) for p in predicates if not p.negated]
+        estimates = [(estimate, p) for estimate, p in estimates if estimate is not None]
+        if estimates:
+            self.source = min(estimates, key=lambda e: e[0])[1]
+        self.filters : List[Predicate] = sorted((p for p in predicates if p is not self.source),
+                                                key=lambda p: (p.estimate(index) is None, p.cost))
+
+    def run(self, index : FieldIndex) -> List[int]:
+        """
+        :param index: The field index.
+        :return: The ids of all matching entries (sorted).
+        """
+        if self.source is not None:
+            candidates = self.source.candidates(index)
+        else:
+            candidates = index.fields.keys()
+        fields = index.fields
+        result = []
+        for id in candidates:
+            item_fields = fields[id]
+            if all(p.test(item_fields) for p in self.filters):
+                result.append(id)
+        result.sort()
+        return result
+
+    def explain(self) -> str:
+        """
+        :return: A human readable description of the plan.
+        """
+        source = "lookup " + str(self.source) if self.source is not None else "scan all"
+        return " -> ".join([source] + ["filter " + str(p) for p in self.filters])
+
+
+def compile_query(query : str, index : FieldIndex) -> QueryPlan:
+    """
+    Parses a query and creates the execution plan.
+    :param query: The query (searched for as plain text if it is invalid, see parse_or_text).
+    :param index: The field index the query is executed on.
+    :return: The plan.
+    """
+    return QueryPlan(parse_or_text(query), index)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Index of all entries for the command line modes (--query, --list, --get) when no indicator is running.
+
+Reading the bookmark file on every call is too slow for launchers like rofi or dmenu, which run a query on every key
+press. Instead, the entries and the fields queries are evaluated on (see query.ItemFields) are stored in a cache file
+next to the bookmark file (".<file_name>.index", marshal format). The cache is rebuilt when the bookmark file (or its
+journal) has changed since it was written. Loading it does not need the model, the storage backends or Gtk.
+"""
+import marshal
+import os
+from typing import Iterator, List, Optional
+
+from query import ItemFields, get_host, parse_or_text
+from searchindex import normalize
+
+"""
+Format of the cache file. Caches of other versions are rebuilt.
+"""
+CACHE_VERSION = 1
+
+"""
+Suffixes of the files whose changes invalidate the cache: the bookmark file, the journal of the XML storage and
+the write-ahead log of SQLite.
+"""
+WATCHED_SUFFIXES = ('', '.journal', '-wal')
+
+
+def cache_path(filename : str) -> str:
+    """
+    :param filename: The bookmark file.
+    :return: Path of the cache file.
+    """
+    directory, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(directory, "." + name + ".index")
+
+
+def file_signature(filename : str) -> list:
+    """
+    :param filename: The bookmark file.
+    :return: Identifies the current version of the bookmark file and its journal (size, modification time, inode).
+    """
+    signature = []
+    for suffix in WATCHED_SUFFIXES:
+        try:
+            stat = os.stat(filename + suffix)
+        except FileNotFoundError:
+            signature.append(None)
+        else:
+            signature.append((stat.st_size, stat.st_mtime_ns, stat.st_ino))
+    return signature
+
+
+class QueryCache:
+    """
+    The entries of a bookmark file, in the order of the file (without the top-level menu and separators).
+    Each entry is stored as tuple (id, text, action, type, icon, folder, fields), see describe().
+    """
+
+    def __init__(self, entries : List[tuple]):
+        self.entries : List[tuple] = entries
+
+    @staticmethod
+    def load(filename : str) -> Optional['QueryCache']:
+        """
+        Reads the cache of a bookmark file.
+        :param filename: The bookmark file.
+        :return: The cache, None if there is none or it is outdated.
+        """
+        try:
+            with open(cache_path(filename), 'rb') as f:
+                # marshal.load reads the file in small pieces, which is much slower
+                data = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(data, dict) or data.get('version') != CACHE_VERSION or \
+                data.get('signature') != file_signature(filename):
+            return None
+        return QueryCache(data['entries'])
+
+    @staticmethod
+    def build(filename : str) -> 'QueryCache':
+        """
+        Reads the bookmark file and writes its cache. If the cache cannot be written (e.g., the directory is
+        read-only), it is only kept in memory.
+        :param filename: The bookmark file.
+        :return: The cache (without entries if the file does not exist or is empty).
+        """
+        try:
+            if os.path.getsize(filename) == 0:
+                return QueryCache([])
+        except FileNotFoundError:
+            # Not created yet (by the indicator), nothing to cache
+            return QueryCache([])
+        # Imported here, the model is only needed if the cache is outdated
+        from model import Database
+        from backup import atomic_write
+        # Taken before reading, so that a change while reading invalidates the cache
+        signature = file_signature(filename)
+        database = Database(filename)
+        database.parse_file()
+        entries = []
+        stack = [(child, (), ()) for child in reversed(database.data.get_children())]
+        while stack:
+            item, folder, folder_fields = stack.pop()
+            if item.type != Database.Item.TYPE_SEPARATOR:
+                host = get_host(item.action) if item.type == Database.Item.TYPE_WEB else None
+                fields = (normalize(item.text), item.action or '', item.type, host, folder_fields)
+                entries.append((item.global_id, item.text, item.action, item.type, item.icon, folder, fields))
+            children = item.get_children()
+            if children:
+                stack.extend((child, folder + (item.text,), folder_fields + (normalize(item.text),))
+                             for child in reversed(children))
+        cache = QueryCache(entries)
+        try:
+            atomic_write(cache_path(filename), marshal.dumps({'version': CACHE_VERSION, 'signature': signature,
+                                                              'entries': entries}))
+        except OSError as e:
+            print("Could not write the query cache:", str(e))
+        return cache
+
+    @staticmethod
+    def open(filename : str) -> 'QueryCache':
+        """
+        :param filename: The bookmark file.
+        :return: The cache of the file, rebuilt if it is missing or outdated.
+        """
+        cache = QueryCache.load(filename)
+        if cache is None:
+            cache = QueryCache.build(filename)
+        return cache
+
+    @staticmethod
+    def describe(entry : tuple) -> dict:
+        """
+        :param entry: An entry of the cache.
+        :return: The entry in the format of model.Database.describe.
+        """
+        id, text, action, type, icon, folder, fields = entry
+        return {'id': id, 'text': text, 'action': action, 'type': type, 'icon': icon, 'folder': list(folder)}
+
+    def list(self) -> Iterator[dict]:
+        """
+        :return: All entries (see describe).
+        """
+        return (QueryCache.describe(entry) for entry in self.entries)
+
+    def get(self, id : int) -> Optional[dict]:
+        """
+        :param id: The id of an entry (as returned by list or query).
+        :return: The entry (see describe), None if there is no entry with this id.
+        """
+        for entry in self.entries:
+            if entry[0] == id:
+                return QueryCache.describe(entry)
+        return None
+
+    def query(self, query : str) -> Iterator[dict]:
+        """
+        Finds all entries matching a structured query (see the module query). Without the lookup tables of
+        query.FieldIndex, which would take longer to build than a scan of the entries takes.
+        :param query: The query (searched for as plain text if it is invalid, see query.parse_or_text).
+        :return: The matching entries (see describe), in the order of the file.
+        """
+        predicates = sorted(parse_or_text(query), key=lambda p: p.cost)
+        for entry in self.entries:
+            fields = ItemFields(*entry[6])
+            if all(p.test(fields) for p in predicates):
+                yield QueryCache.describe(entry)
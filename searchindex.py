@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+def normalize(text : Optional[str]) -> str:
+    """
+    Normalizes a text for (case-insensitive) searching.
+    :param text: The text (may be None).
+    :return: The normalized text.
+    """
+    if text is None:
+        return ''
+    return text.casefold()
+
+
+def trigrams(text : str) -> Set[str]:
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class SearchIndex:
+    """
+    Inverted trigram index for substring searches: maps each trigram (three consecutive characters of a normalized
+    text) to the ids containing it. A query only has to look at the ids containing all trigrams of the query.
+    """
+
+    def __init__(self):
+        # id -> normalized text
+        self._texts : Dict[int, str] = {}
+        # trigram -> ids
+        self._postings : Dict[str, Set[int]] = {}
+
+    def add(self, id : int, text : Optional[str]) -> None:
+        """
+        Adds (or replaces) the text of an id.
+        :param id: The id (e.g., the global id of an item).
+        :param text: The text.
+        :return: Nothing
+        """
+        if id in self._texts:
+            self.remove(id)
+        text = normalize(text)
+        self._texts[id] = text
+        for trigram in trigrams(text):
+            ids = self._postings.get(trigram)
+            if ids is None:
+                self._postings[trigram] = {id}
+            else:
+                ids.add(id)
+
+    def remove(self, id : int) -> None:
+        """
+        Removes an id from the index. Unknown ids are ignored.
+        :param id: The id.
+        :return: Nothing
+        """
+        text = self._texts.pop(id, None)
+        if text is None:
+            return
+        for trigram in trigrams(text):
+            ids = self._postings.get(trigram)
+            if ids is not None:
+                ids.discard(id)
+                if not ids:
+                    del self._postings[trigram]
+
+    def search(self, query : str, candidates : Optional[Iterable[int]] = None) -> Set[int]:
+        """
+        Finds all ids whose text contains the query (case-insensitive).
+        :param query: The text to search for.
+        :param candidates: If given, only these ids are considered (e.g., the matches of a shorter query).
+        :return: The matching ids.
+        """
+        query = normalize(query)
+        texts = self._texts
+        if candidates is not None:
+            return set(id for id in candidates if query in texts.get(id, ''))
+        if len(query) < 3:
+            # No trigrams, check all texts
+            return set(id for id, text in texts.items() if query in text)
+
+        postings = []
+        for trigram in trigrams(query):
+            ids = self._postings.get(trigram)
+            if ids is None:
+                return set()
+            postings.append(ids)
+        postings.sort(key=len)
+        result = set(postings[0])
+        for ids in postings[1:]:
+            result.intersection_update(ids)
+            if not result:
+                return result
+        # All trigrams occur in the text, but maybe not in the right order
+        return set(id for id in result if query in texts[id])
+
+    def estimate(self, query : str) -> int:
+        """
+        Cheap upper bound for the number of matches of a query (without running it).
+        :param query: The text to search for.
+        :return: The upper bound.
+        """
+        query = normalize(query)
+        if len(query) < 3:
+            return len(self._texts)
+        return min(len(self._postings.get(trigram, ())) for trigram in trigrams(query))
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+
+"""
+Scores of fuzzy_match. Matches in the action (URL) are scored lower than matches in the text (PENALTY_ACTION).
+"""
+SCORE_MATCH = 16
+BONUS_WORD_START = 8
+BONUS_CONSECUTIVE = 4
+PENALTY_GAP_START = 3
+PENALTY_GAP_EXTENSION = 1
+PENALTY_ACTION = 8
+
+
+def fuzzy_match(query : str, text : Optional[str]) -> Optional[Tuple[int, List[int]]]:
+    """
+    Checks whether the characters of the query appear in the text in the same order (not necessarily next to each
+    other), e.g., "gthb" matches "GitHub". Matches at the start of words and runs of consecutive characters
+    are scored higher, gaps between the matched characters lower.
+    :param query: The (normalized) query.
+    :param text: The text.
+    :return: None, if the text does not match. Otherwise, the score and the positions of the matched characters.
+    """
+    if not query or not text:
+        return None
+    # Fast check (most texts do not match at all)
+    remaining = iter(text.lower())
+    if not all(c in remaining for c in query):
+        return None
+    lower = [c.lower() for c in text]
+
+    # Find the first (shortest ending) occurrence of the query as subsequence ...
+    q = 0
+    end = -1
+    for i in range(len(lower)):
+        if lower[i] == query[q]:
+            q += 1
+            if q == len(query):
+                end = i
+                break
+    if end < 0:
+        return None
+    # ... and go back to find the tightest start.
+    q = len(query) - 1
+    start = end
+    for i in range(end, -1, -1):
+        if lower[i] == query[q]:
+            q -= 1
+            if q < 0:
+                start = i
+                break
+
+    positions = []
+    q = 0
+    for i in range(start, end + 1):
+        if q < len(query) and lower[i] == query[q]:
+            positions.append(i)
+            q += 1
+
+    score = 0
+    previous = -1
+    for i in positions:
+        score += SCORE_MATCH
+        if i == 0 or not text[i - 1].isalnum() or (text[i - 1].islower() and text[i].isupper()):
+            score += BONUS_WORD_START
+        if previous >= 0:
+            if i == previous + 1:
+                score += BONUS_CONSECUTIVE
+            else:
+                score -= PENALTY_GAP_START + PENALTY_GAP_EXTENSION * (i - previous - 2)
+        previous = i
+    return score, positions
@@ -1,5 +1,7 @@
 import os
+import threading
 import webbrowser
+from typing import List, Optional, Set
 
 import gi
 
@@ -9,9 +11,13 @@ gi.require_version('Gtk', '3.0')
 gi.require_version('Pango', '1.0')
 from gi.repository import Gtk as gtk
 from gi.repository import Gdk as gdk
+from gi.repository import GLib
 from gi.repository import Pango
-from gi.repository import GdkPixbuf as pixbuf
-from model import Database
+import query
+from iconcache import pixbuf_cache
+from linkcheck import STATE_DEAD, STATE_ERROR, LinkCache, LinkChecker, web_actions
+from model import ChangeEvent, Database
+from treemodels import ItemHierarchy
 
 
 # Partly based on:
@@ -29,6 +35,11 @@ class SearchWindow(gtk.Window):
 
         self.database = database
         self.filter_text = ''
+        # Query and matches of the last search (used to refine the matches when the query gets longer)
+        self.last_query = ''
+        self.last_matches : Set[int] = set()
+        # Pending (debounced) refresh, see on_search_changed
+        self.refresh_source : Optional[int] = None
 
         self.grid = gtk.Grid(margin_top=25, margin_bottom=25, margin_end=25, margin_start=25)
         self.grid.set_column_homogeneous(True)
@@ -39,9 +50,19 @@ class SearchWindow(gtk.Window):
         self.searchentry.grab_focus()
         self.grid.attach(self.searchentry, 0, 0, 3, 1)
 
+        self.fuzzy_checkbox = gtk.CheckButton(label="fuzzy (ranked)")
+        self.grid.attach(self.fuzzy_checkbox, 3,0,1,1)
+
         self.subtree_checkbox = gtk.CheckButton(label="show subtrees of matches")
         self.grid.attach(self.subtree_checkbox, 4,0,1,1)
 
+        self.check_links_button = gtk.Button(label="Check links")
+        self.grid.attach(self.check_links_button, 5,0,1,1)
+        # Results of the link checker (see linkcheck), shown in the status column
+        self.link_cache = LinkCache(config['links']['cache_file'], config['links']['max_age'])
+        # Running check, see on_check_links
+        self.link_checker = None
+
         self.treeview = gtk.TreeView(headers_visible=True)
         renderer = gtk.CellRendererText()
         col = gtk.TreeViewColumn(title="Name")
@@ -51,6 +72,7 @@ class SearchWindow(gtk.Window):
         col.set_reorderable(True)
         col.set_resizable(True)
         self.treeview.append_column(col)
+        self.name_column, self.name_renderer = col, renderer
 
         renderer = gtk.CellRendererText()
         col = gtk.TreeViewColumn(title="Type")
@@ -69,32 +91,42 @@ class SearchWindow(gtk.Window):
         col.set_reorderable(True)
         col.set_resizable(True)
         self.treeview.append_column(col)
+        self.action_column, self.action_renderer = col, renderer
+
+        renderer = gtk.CellRendererText()
+        col = gtk.TreeViewColumn(title="Status")
+        col.pack_start(renderer, True)
+        col.set_cell_data_func(renderer, self.render_link_status)
+        col.set_reorderable(True)
+        col.set_resizable(True)
+        self.treeview.append_column(col)
+
+        # Flat list of the best matches in fuzzy mode. The first six columns are the same as in the tree model,
+        # columns 6 and 7 contain the text and the action with the matched characters highlighted (Pango markup).
+        self.ranked_store = gtk.ListStore.new(types=[str, str, str, bool, Pango.Weight, int, str, str])
+        self.ranked_view = False
 
         self.treeview.expand_all()
 
         self.scrollable_treelist = gtk.ScrolledWindow()
         self.scrollable_treelist.set_vexpand(True)
 
-        # Create the filter with the liststore model
-        self.tree_store = self.database.get_item_hierarchy()
-        self.tree_store.foreach(self.reset_row, True)
-        self.filter_ = self.tree_store.filter_new()
-        # We do not use a filter function, but a column in the model that
-        # determines whether to display an entry or not.
-        self.filter_.set_visible_column(3)
-        self.treeview.set_model(self.filter_)
-
-        # Show all. Eventually remove in future ...
-        self.treeview.expand_all()
+        self.set_model(ItemHierarchy.acquire(self.database))
+        self.expand_default()
 
         self.scrollable_treelist.add(self.treeview)
-        self.grid.attach(self.scrollable_treelist, 0, 1, 5, 2)
+        self.grid.attach(self.scrollable_treelist, 0, 1, 6, 2)
 
         self.clipboard = gtk.Clipboard.get(gdk.SELECTION_CLIPBOARD)
 
         self.connect("key-press-event", self.on_key_event)
+        self.searchentry.connect("changed", self.on_search_changed)
+        self.connect("destroy", self.on_destroy)
+        self.database.subscribe(self.on_database_change)
         self.subtree_checkbox.connect("toggled", lambda source: self.refresh_results())
+        self.fuzzy_checkbox.connect("toggled", lambda source: self.refresh_results())
         self.treeview.connect('button-press-event', self.do_execute_action)
+        self.check_links_button.connect("clicked", self.on_check_links)
 
         self.set_up_context_menu()
 
@@ -120,12 +152,9 @@ class SearchWindow(gtk.Window):
         # www menu
         self.www_menu = gtk.Menu()
 
-        desired_width = desired_height = 25
-
         button_exec = gtk.ImageMenuItem("Open website")
         button_exec.connect('activate', lambda source: self.do_execute_action(source))
-        pb = pixbuf.Pixbuf.new_from_file(os.path.join(config['script_dir'], 'default_images', 'execute.png'))
-        pb = pb.scale_simple(desired_width, desired_height, pixbuf.InterpType.BILINEAR)
+        pb = pixbuf_cache.get(os.path.join(config['script_dir'], 'default_images', 'execute.png'))
         img = gtk.Image()
         img.set_from_pixbuf(pb)
         button_exec.set_image(img)
@@ -197,8 +226,6 @@ class SearchWindow(gtk.Window):
         :param event:
         :return: Nothing
         """
-        self.filter_text = self.searchentry.get_text()
-        self.refresh_results()
 
         shortcut = gtk.accelerator_get_label(event.keyval, event.state)
         #print(shortcut)
@@ -210,6 +237,117 @@ class SearchWindow(gtk.Window):
             if treeiter is not None and model[treeiter][1] == Database.Item.TYPE_WEB:
                 webbrowser.open(model[treeiter][2])
 
+    def on_search_changed(self, widget : gtk.Widget) -> None:
+        """
+        Schedules a refresh of the results when the search text was changed.
+        Further changes within config['search']['debounce'] milliseconds postpone the refresh, so that the results are
+        not computed for every single key press while typing.
+        :param widget:
+        :return: Nothing
+        """
+        if self.refresh_source is not None:
+            GLib.source_remove(self.refresh_source)
+        self.refresh_source = GLib.timeout_add(config['search']['debounce'], self.on_search_timeout)
+
+    def on_search_timeout(self) -> bool:
+        self.refresh_source = None
+        self.filter_text = self.searchentry.get_text()
+        self.refresh_results()
+        return False # do not call again
+
+    def on_destroy(self, widget : gtk.Widget) -> None:
+        if self.refresh_source is not None:
+            GLib.source_remove(self.refresh_source)
+            self.refresh_source = None
+        if self.link_checker is not None:
+            self.link_checker.cancel()
+            self.link_checker = None
+        self.database.unsubscribe(self.on_database_change)
+        # The model is reused by the next search window
+        self.update_rows(None, set())
+        self.hierarchy.release()
+
+    def on_database_change(self, event : ChangeEvent) -> None:
+        """
+        Updates the results after an entry was added, removed or changed. The model has already been updated
+        (see treemodels.ItemHierarchy), new entries are hidden while a query is displayed.
+        :param event: The change.
+        :return: Nothing
+        """
+        if self.filter_text == "" and not self.ranked_view:
+            # All rows are displayed anyway
+            return
+        # The previous matches cannot be refined
+        self.last_query = ''
+        self.last_matches = set()
+        self.refresh_results()
+
+    def render_link_status(self, column : gtk.TreeViewColumn, renderer : gtk.CellRendererText,
+                           model : gtk.TreeModel, iter : gtk.TreeIter, data = None) -> None:
+        """
+        Shows the result of the last link check of a website (see linkcheck), dead links in red.
+        """
+        result = None
+        if model[iter][1] == Database.Item.TYPE_WEB:
+            result = self.link_cache.get(model[iter][2])
+        renderer.set_property('text', result.label() if result is not None else '')
+        if result is not None and result.state in (STATE_DEAD, STATE_ERROR):
+            renderer.set_property('foreground', 'red')
+        else:
+            renderer.set_property('foreground-set', False)
+
+    def on_check_links(self, widget : gtk.Widget) -> None:
+        """
+        Checks the links that were not checked recently in the background (see linkcheck) and updates the status
+        column while the results arrive.
+        :param widget:
+        :return: Nothing
+        """
+        if self.link_checker is not None:
+            return
+        urls = self.link_cache.stale(web_actions(self.database))
+        if not urls:
+            self.check_links_button.set_label("All links checked")
+            return
+        checker = LinkChecker(config['links']['concurrency'], config['links']['per_host'], config['links']['timeout'])
+        self.link_checker = checker
+        self.check_links_button.set_sensitive(False)
+        progress = {'checked': 0}
+
+        def on_result(result):
+            # Called on the Gtk main loop
+            if self.link_checker is not checker:
+                return False
+            self.link_cache.update(result)
+            progress['checked'] += 1
+            self.check_links_button.set_label(str(progress['checked']) + " / " + str(len(urls)))
+            self.treeview.queue_draw()
+            return False
+
+        def on_done(error):
+            if self.link_checker is not checker:
+                return False
+            self.link_checker = None
+            try:
+                self.link_cache.save()
+            except OSError as e:
+                print("Could not write the link cache:", str(e))
+            self.check_links_button.set_label("Check links")
+            self.check_links_button.set_sensitive(True)
+            if error is not None:
+                print("Link check failed:", error)
+            return False
+
+        def run():
+            error = None
+            try:
+                checker.run(urls, lambda result: GLib.idle_add(on_result, result))
+            except Exception as e:
+                error = str(e)
+            GLib.idle_add(on_done, error)
+
+        threading.Thread(target=run, daemon=True).start()
+
     def copy_to_clipboard(self, what = 'action'):
         sel = self.treeview.get_selection()
         model, treeiter = sel.get_selected_rows()
@@ -221,77 +359,193 @@ class SearchWindow(gtk.Window):
         elif treeiter is not None and what == 'text':
             self.clipboard.set_text(model[treeiter][0], -1)
 
+    def set_model(self, hierarchy : ItemHierarchy) -> None:
+        """
+        Displays the entries of a database (see Database.get_item_hierarchy).
+        :param hierarchy: The entries.
+        :return: Nothing
+        """
+        self.hierarchy = hierarchy
+        self.last_query = ''
+        self.last_matches = set()
+
+        # Create the filter with the liststore model
+        self.filter_ = self.hierarchy.filter_new()
+        # We do not use a filter function, but a column in the model that
+        # determines whether to display an entry or not.
+        self.filter_.set_visible_column(3)
+        if not self.ranked_view:
+            self.treeview.set_model(self.filter_)
+
     def refresh_results(self) -> None:
         """
         Refresh the results in the table view.
+        The matches are looked up in the search index of the database (structured queries, see the module query,
+        are run by Database.query). If the query extends the previous one, only the previous matches are checked.
+        Only rows whose visibility or weight changes are updated, and only the paths to the matches are expanded.
         :return: Nothing
         """
         search_query = self.filter_text.lower()
         show_subtrees_of_matches = self.subtree_checkbox.get_active()
+        self.use_ranked_view(self.fuzzy_checkbox.get_active())
+        if self.ranked_view:
+            self.show_ranked_results(search_query)
+            return
         if search_query == "":
-            self.tree_store.foreach(self.reset_row, True)
-            self.treeview.expand_all()
+            matches = set()
+            self.update_rows(None, matches)
+            self.expand_default()
         else:
-            self.tree_store.foreach(self.reset_row, False)
-            self.tree_store.foreach(self.show_matches, search_query, show_subtrees_of_matches)
-            self.treeview.expand_all()
-        self.filter_.refilter()
+            if search_query == self.last_query:
+                matches = self.last_matches
+            elif query.is_structured(self.filter_text):
+                # A query that is not completely typed, yet, (e.g., an unclosed quote) is searched for as plain text
+                matches = set(item.global_id for item in self.database.query(self.filter_text))
+                # Longer structured queries may match more entries (e.g., "-a" vs. "-ab"), i.e., they cannot be
+                # refined. Hence, the query is not remembered.
+                search_query = ""
+            elif self.last_query != "" and search_query.startswith(self.last_query):
+                # Every match of the new query is a match of the previous query
+                matches = self.database.search(search_query, self.last_matches)
+            else:
+                matches = self.database.search(search_query)
+            self.update_rows(self.get_visible_ids(matches, show_subtrees_of_matches), matches)
+            self.expand_matches(matches, show_subtrees_of_matches)
+        self.last_query = search_query
+        self.last_matches = matches
+
+    def use_ranked_view(self, ranked : bool) -> None:
+        """
+        Switches between the tree of all entries and the flat list of the best matches (fuzzy mode).
+        :param ranked: True for the list of best matches.
+        :return: Nothing
+        """
+        if ranked == self.ranked_view:
+            return
+        self.ranked_view = ranked
+        for col, renderer, text_column, markup_column in ((self.name_column, self.name_renderer, 0, 6),
+                                                          (self.action_column, self.action_renderer, 2, 7)):
+            col.clear_attributes(renderer)
+            if ranked:
+                col.add_attribute(renderer, "markup", markup_column)
+            else:
+                col.add_attribute(renderer, "text", text_column)
+            col.add_attribute(renderer, "weight", 4)
+        if ranked:
+            self.treeview.set_model(self.ranked_store)
+        else:
+            self.ranked_store.clear()
+            self.treeview.set_model(self.filter_)
+        self.subtree_checkbox.set_sensitive(not ranked)
 
-    def reset_row(self, model : gtk.TreeModel, path : gtk.TreePath, iter : gtk.TreeIter, make_visible : bool) -> bool:
+    def show_ranked_results(self, search_query : str) -> None:
+        """
+        Shows the best matches of a fuzzy search, best first, with the matched characters highlighted.
+        :param search_query: The query.
+        :return: Nothing
+        """
+        self.ranked_store.clear()
+        if search_query == "":
+            return
+        for match in self.database.fuzzy_search(search_query, config['search']['top_k']):
+            item = self.database.get_item(match.global_id)
+            self.ranked_store.append([item.text, item.type, item.action or '', True, Pango.Weight.NORMAL,
+                                      item.global_id, self.highlight(item.text, match.text_positions),
+                                      self.highlight(item.action, match.action_positions)])
+
+    @staticmethod
+    def highlight(text : Optional[str], positions : List[int]) -> str:
         """
-        Resets the filter properties of a given entry.
-        :param model:
-        :param path:
-        :param iter:
-        :param make_visible:
-        :return: always False
+        Converts a text to Pango markup with some characters printed bold.
+        :param text: The text.
+        :param positions: Positions of the characters to highlight.
+        :return: Pango markup.
         """
-        self.tree_store.set_value(iter, 4, Pango.Weight.NORMAL)
-        self.tree_store.set_value(iter, 3, make_visible)
-        return False # do not stop iterating
+        if text is None:
+            return ''
+        positions = set(positions)
+        return ''.join("<b>" + GLib.markup_escape_text(c) + "</b>" if i in positions else GLib.markup_escape_text(c)
+                       for i, c in enumerate(text))
 
-    def make_path_visible(self, model : gtk.TreeModel, iter : gtk.TreeIter) -> None:
+    def get_filter_path(self, id : int) -> Optional[gtk.TreePath]:
         """
-        Makes the path from the root to iter visible.
-        :param model:
-        :param iter:
-        :return: nothing
+        :param id: Global id of an entry.
+        :return: Path of the entry in the (filtered) view, None if the entry is not displayed.
         """
-        while iter:
-            self.tree_store.set_value(iter, 3, True)
-            iter = model.iter_parent(iter)
+        path = self.hierarchy.get_item_path(id)
+        if path is None:
+            return None
+        return self.filter_.convert_child_path_to_path(path)
 
-    def make_subtree_visible(self, model : gtk.TreeModel, iter : gtk.TreeIter) -> None:
+    def expand_matches(self, matches : Set[int], show_subtrees_of_matches : bool) -> None:
         """
-        Make child rows visible.
-        :param model:
-        :param iter:
-        :return: nothing
+        Expands the rows necessary to show the matches.
+        :param matches: Global ids of the matching entries.
+        :param show_subtrees_of_matches: Whether the sub-entries of matches should be shown, too.
+        :return: Nothing
         """
-        for i in range(model.iter_n_children(iter)):
-            subtree = model.iter_nth_child(iter, i)
-            if model.get_value(subtree, 3):
-                # Subtree already visible
+        if show_subtrees_of_matches:
+            to_expand = matches
+        else:
+            to_expand = set()
+            for id in matches:
+                parent = self.database.get_parent(id)
+                if parent is not None:
+                    to_expand.add(parent.global_id)
+        for id in to_expand:
+            path = self.get_filter_path(id)
+            if path is None:
                 continue
-            self.tree_store.set_value(subtree, 3, True)
-            self.make_subtree_visible(model, subtree)
-
-    def show_matches(self, model : gtk.TreeModel,
-                           path : gtk.TreePath,
-                           iter : gtk.TreeIter,
-                           search_query : str,
-                           show_subtrees_of_matches : bool) -> bool:
-        text = model.get_value(iter, 0).lower()
-        if search_query in text:
-            # Highlight direct match with bold
-            self.tree_store.set_value(iter, 4, Pango.Weight.BOLD)
+            if show_subtrees_of_matches:
+                self.treeview.expand_to_path(path)
+                self.treeview.expand_row(path, True)
+            else:
+                self.treeview.expand_to_path(path)
+
+    def get_visible_ids(self, matches : Set[int], show_subtrees_of_matches : bool) -> Set[int]:
+        """
+        Computes the rows to display for a set of matches.
+        :param matches: Global ids of the matching entries.
+        :param show_subtrees_of_matches: Whether the sub-entries of matches are displayed, too.
+        :return: Global ids of the matches, their parents and (optionally) their sub-entries.
+        """
+        visible = set()
+        for id in matches:
             # Propagate visibility change up
-            self.make_path_visible(model, iter)
+            item = self.database.get_item(id)
+            while item is not None and item.global_id not in visible:
+                visible.add(item.global_id)
+                item = self.database.get_parent(item.global_id)
             if show_subtrees_of_matches:
                 # Propagate visibility change down
-                self.make_subtree_visible(model, iter)
-            return False
-        return False
+                stack = list(self.database.get_item(id).get_children())
+                while stack:
+                    item = stack.pop()
+                    if self.hierarchy.includes(item):
+                        visible.add(item.global_id)
+                        stack.extend(item.get_children())
+        return visible
+
+    def update_rows(self, visible_ids : Optional[Set[int]], bold_ids : Set[int]) -> None:
+        """
+        Updates the visibility and the weight of the rows. Only rows that change (and are displayed) are touched.
+        :param visible_ids: Global ids of the rows to display (None to display all rows).
+        :param bold_ids: Global ids of the rows to print bold.
+        :return: Nothing
+        """
+        self.hierarchy.set_visible_ids(visible_ids)
+        self.hierarchy.set_bold_ids(bold_ids)
+
+    def expand_default(self) -> None:
+        """
+        Expands all rows, unless the database is large (config['search']['expand_limit']). Then, only the entries of
+        the top-level menu are shown.
+        :return: Nothing
+        """
+        if len(self.database) <= config['search']['expand_limit']:
+            self.treeview.expand_all()
+        else:
+            self.treeview.expand_row(gtk.TreePath.new_first(), False)
 
     def do_execute_action(self, widget : gtk.Widget, event = None) -> None:
         """
@@ -337,16 +591,8 @@ class SearchWindow(gtk.Window):
             if self.database.delete_item_by_id(id):
                 try:
                     self.database.save_data()
-
-                    # Create the filter with the liststore model
-                    self.tree_store = self.database.get_item_hierarchy()
-                    self.tree_store.foreach(self.reset_row, True)
-                    self.filter_ = self.tree_store.filter_new()
-                    # We do not use a filter function, but a column in the model that
-                    # determines whether to display an entry or not.
-                    self.filter_.set_visible_column(3)
-                    self.treeview.set_model(self.filter_)
-                    self.treeview.expand_all()
+                    # The model has already removed the row (see treemodels.ItemHierarchy.on_change)
+                    self.refresh_results()
 
                 except Exception as e:
                     parent = self
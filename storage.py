@@ -0,0 +1,867 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Storage backends of the Database: the XML file (default) and an SQLite database.
+"""
+import fcntl
+import hashlib
+import io
+import os
+import sqlite3
+import sys
+import zlib
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import xml.etree.ElementTree as ET
+
+from config import config
+from backup import BackupStore, atomic_write, content_hash
+from journal import Journal
+from model import ChangeEvent, Database
+from searchindex import normalize
+
+
+class StorageBackend:
+    """
+    Where the entries of a Database are stored.
+
+    The database reads all entries with load() and calls attach() with the top-level menu it uses. Afterwards, every
+    change is reported to on_change() (see Database.subscribe) and made durable by save().
+    """
+
+    def __init__(self, database : Database, filename : str):
+        """
+        :param database: The database whose entries are stored.
+        :param filename: The file containing the entries.
+        """
+        self.database : Database = database
+        self.filename : str = filename
+        # Stored versions of the file, None if the backend does not support backups
+        self.backups : Optional[BackupStore] = None
+        # State of the file when it was last read or written by us, see changed_externally()
+        self._signature = None
+
+    def load(self, loader : Optional[str] = None) -> Optional[Database.Item]:
+        """
+        Reads all entries.
+        :param loader: Backend specific way of reading the file (see Database.LOADERS).
+        :return: The top-level menu, None if the file is empty.
+        """
+        raise NotImplementedError()
+
+    def load_version(self, loader : Optional[str] = None) -> Optional[Database.Item]:
+        """
+        Reads all entries again for Database.reload, including changes not written to the file itself (e.g., a
+        journal). The result is merged into the entries of the database, attach() is called afterwards.
+        :param loader: Backend specific way of reading the file (see Database.LOADERS).
+        :return: The top-level menu, None if the file is empty.
+        """
+        return self.load(loader)
+
+    def attach(self, root : Database.Item) -> None:
+        """
+        Called after load() with the top-level menu used by the database (a new one, if the file was empty).
+        :param root: The top-level menu.
+        :return: Nothing
+        """
+        pass
+
+    def on_change(self, event : ChangeEvent) -> None:
+        """
+        Called for every change of the database.
+        :param event: The change.
+        :return: Nothing
+        """
+        pass
+
+    def save(self) -> None:
+        """
+        Makes the changes since the last save durable.
+        :return: Nothing
+        """
+        raise NotImplementedError()
+
+    def compact(self) -> None:
+        """
+        Brings the file into its final form (e.g., folds a journal into it). Called on exit.
+        :return: Nothing
+        """
+        pass
+
+    def replace(self, root : Database.Item) -> None:
+        """
+        Replaces the whole contents of the file by a tree of entries (e.g., to migrate from another backend).
+        :param root: The top-level menu.
+        :return: Nothing
+        """
+        raise NotImplementedError()
+
+    def rebind(self, mapping : Dict[int, int]) -> None:
+        """
+        Called by Database.reload: the entries read by load() were merged into the entries of the database, i.e.,
+        some of them are represented by other items now.
+        :param mapping: Global id of a loaded item -> global id of the item representing it.
+        :return: Nothing
+        """
+        pass
+
+    def changed_externally(self) -> bool:
+        """
+        Checks whether the file was changed by someone else (e.g., edited by hand) since it was last read or
+        written by this backend.
+        :return: True if the file has to be read again.
+        """
+        return self._file_signature() != self._signature
+
+    def watched_files(self) -> List[str]:
+        """
+        :return: The files whose changes may be changes of the entries (see changed_externally).
+        """
+        return [self.filename]
+
+    def _remember_signature(self) -> None:
+        self._signature = self._file_signature()
+
+    def _file_signature(self):
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def restore_backup(self, digest : str) -> None:
+        raise ValueError("The storage backend of '" + self.filename + "' does not support backups.")
+
+
+class _VersionReader:
+    """
+    Wraps a file opened for reading (binary) and keeps the content hash and a compressed copy of everything read,
+    i.e., of the version of the file the entries were read from.
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.seek(0)
+
+    def read(self, size : int = -1) -> bytes:
+        data = self.fd.read(size)
+        self._hash.update(data)
+        self._compressed.append(self._compressor.compress(data))
+        return data
+
+    def seek(self, offset : int) -> None:
+        """
+        :param offset: Must be 0 (reading starts again).
+        """
+        self.fd.seek(offset)
+        self._hash = hashlib.sha256()
+        self._compressor = zlib.compressobj()
+        self._compressed : List[bytes] = []
+
+    def finish(self) -> Tuple[str, bytes]:
+        """
+        Reads the rest of the file.
+        :return: The content hash (see backup.content_hash) and the compressed content.
+        """
+        while self.read(65536):
+            pass
+        return self._hash.hexdigest(), b''.join(self._compressed) + self._compressor.flush()
+
+
+class XmlBackend(StorageBackend):
+    """
+    The entries are stored in an XML file, which is rewritten as a whole when saving.
+    In "journal" persistence mode, the changes are appended to a journal file next to it (see journal.Journal)
+    instead, and the XML file is only rewritten when compacting.
+
+    Several processes may use the same file: writes are serialized by an advisory lock (a file next to the XML
+    file). If the file or the journal were changed by someone else since we read them, the other version and ours
+    are merged (see merge.merge) with the version we read as common base, instead of overwriting the other changes.
+    """
+
+    def __init__(self, database : Database, filename : str, persistence : Optional[str] = None):
+        """
+        :param database: The database whose entries are stored.
+        :param filename: The XML file.
+        :param persistence: One of Database.PERSISTENCE_MODES. If not given, config['general']['persistence'] is used.
+        """
+        super().__init__(database, filename)
+        if persistence is None:
+            persistence = config['general']['persistence']
+        if persistence not in Database.PERSISTENCE_MODES:
+            raise ValueError("Unknown persistence mode '" + str(persistence) + "'. Expected one of: " +
+                             ', '.join(Database.PERSISTENCE_MODES))
+        self.persistence : str = persistence
+        self._journal = Journal(filename + ".journal")
+        # Journal records of mutations that have not been saved, yet.
+        self._pending : List[dict] = []
+        # Whether the journal is being applied (its records must not be recorded again)
+        self._replaying : bool = False
+        self.backups = BackupStore.for_file(filename, config['general']['backup_count'])
+        directory, name = os.path.split(os.path.abspath(filename))
+        self._lock_file : str = os.path.join(directory, "." + name + ".lock")
+        # The version of the file (and journal) our data is based on, i.e., the version we last read or wrote:
+        # content hash and compressed content of the XML file (None: not known, yet), the journal records included
+        # and the size of the journal.
+        self._base_hash : Optional[str] = None
+        self._base : Optional[bytes] = None
+        self._base_records : List[dict] = []
+        self._journal_size : int = 0
+        # Whether the journal has been applied to the entries returned by load_version already
+        self._journal_applied : bool = False
+
+    @contextmanager
+    def _locked(self, operation : int = fcntl.LOCK_EX) -> Iterator[None]:
+        """
+        Holds the lock of the file (exclusive for writing, shared for reading) while the with-block is executed.
+        :param operation: fcntl.LOCK_EX or fcntl.LOCK_SH
+        """
+        try:
+            lock = open(self._lock_file, 'a')
+        except OSError as e:
+            # E.g., read-only directory: nobody else can write either
+            print("Could not open lock file '" + self._lock_file + "':", str(e))
+            yield
+            return
+        with lock:
+            fcntl.flock(lock, operation)
+            yield
+
+    def load(self, loader : Optional[str] = None) -> Optional[Database.Item]:
+        if loader is None:
+            loader = config['general']['loader']
+        if loader not in Database.LOADERS:
+            raise ValueError("Unknown loader '" + str(loader) + "'. Expected one of: " + ', '.join(Database.LOADERS))
+
+        with self._locked(fcntl.LOCK_SH), open(self.filename, 'rb') as f:
+            self._remember_signature()
+            fd = _VersionReader(f)
+            if self._is_empty_file(fd):
+                root = None
+            else:
+                fd.seek(0)
+                if loader == 'iterparse':
+                    root = self._parse_file_iterparse(fd)
+                else:
+                    root = self._parse_file_xmltodict(fd)
+            self._base_hash, self._base = fd.finish()
+        return root
+
+    def load_version(self, loader : Optional[str] = None) -> Optional[Database.Item]:
+        # The journal is applied before the entries are merged into the database. Replaying it afterwards (see
+        # attach) would remove the entries added by it and add them again (with new global ids).
+        with self._locked(fcntl.LOCK_SH):
+            root = self.load(loader)
+            self._journal_size = self._journal.size()
+            self._base_records = list(self._journal.read())
+        if root is None and self._base_records:
+            root = Database.Item(text="Menu", type=Database.Item.TYPE_MENU)
+        for record in self._base_records:
+            self._apply_to_tree(root, record)
+        self._journal_applied = True
+        return root
+
+    def attach(self, root : Database.Item) -> None:
+        if self._journal_applied:
+            self._journal_applied = False
+            return
+        # Apply the changes written in "journal" mode to the data read from the XML file.
+        self._replaying = True
+        try:
+            with self._locked(fcntl.LOCK_SH):
+                self._journal_size = self._journal.size()
+                self._base_records = list(self._journal.read())
+            for record in self._base_records:
+                if not self._apply_record(record):
+                    print("Could not apply journal record:", record)
+        finally:
+            self._replaying = False
+
+    @staticmethod
+    def _is_empty_file(fd, chunk_size : int = 65536) -> bool:
+        """
+        Checks whether the file contains anything but spaces, without reading the whole file at once.
+        :param fd: File opened for reading.
+        :param chunk_size: Number of characters read at once.
+        :return: True if the file is empty (or contains spaces only).
+        """
+        while True:
+            chunk = fd.read(chunk_size)
+            if not chunk:
+                return True
+            if chunk.strip(b" "):
+                return False
+
+    def _parse_file_iterparse(self, fd) -> Database.Item:
+        """
+        Streaming loader: builds the items directly while reading the XML file.
+        Processed elements are removed from the element tree, so the XML tree never holds more than
+        the currently open menus and the current item.
+        :param fd: File opened for reading.
+        :return: The top-level menu.
+        """
+        root : Optional[Database.Item] = None
+        menus : List[Database.Item] = []
+        elements : List[ET.Element] = []
+        for event, element in ET.iterparse(fd, events=('start', 'end')):
+            if event == 'start':
+                if not elements and element.tag != 'menu':
+                    raise ValueError("Root element must be <menu>, found <" + element.tag + ">.")
+                if element.tag == 'menu' and (not elements or elements[-1].tag == 'menu'):
+                    menu = Database.Item(text=element.get('name', ''), type=Database.Item.TYPE_MENU)
+                    if menus:
+                        menus[-1].add_child(menu)
+                    else:
+                        root = menu
+                    menus.append(menu)
+                elements.append(element)
+                continue
+
+            elements.pop()
+            parent = elements[-1] if elements else None
+            if element.tag == 'menu' and (parent is None or parent.tag == 'menu'):
+                menus.pop()
+            elif element.tag == 'item' and parent is not None and parent.tag == 'menu':
+                menus[-1].add_child(self._item_from_element(element))
+            elif element.tag == 'icon' and parent is not None and parent.tag == 'menu':
+                menus[-1].set_icon(self._element_text(element))
+            else:
+                # Children of <item> are still needed when the item itself is finished.
+                continue
+
+            # Free the processed element
+            element.clear()
+            if parent is not None:
+                parent.remove(element)
+        return root
+
+    @staticmethod
+    def _element_text(element : ET.Element) -> Optional[str]:
+        return element.text.strip() if element.text is not None else None
+
+    def _item_from_element(self, element : ET.Element) -> Database.Item:
+        """
+        Converts an <item> element into a menu item.
+        :param element: The <item> element.
+        :return: The menu item (an entry or a separator).
+        """
+        if element.find('separator') is not None:
+            return Database.Item(type=Database.Item.TYPE_SEPARATOR)
+        dbitem = Database.Item()
+        for child in element:
+            if child.tag == 'text':
+                dbitem.set_text(self._element_text(child))
+            elif child.tag == 'action':
+                dbitem.set_action(self._element_text(child))
+                if child.get('type') is not None:
+                    # Only a handful of distinct types, so share the strings between all items
+                    dbitem.set_type(sys.intern(child.get('type')))
+            elif child.tag == 'icon':
+                dbitem.set_icon(self._element_text(child))
+        return dbitem
+
+    def _parse_file_xmltodict(self, fd) -> Database.Item:
+        """
+        Old loader: converts the whole file to a dictionary and builds the items afterwards.
+        Kept for comparison with the streaming loader.
+        :param fd: File opened for reading.
+        :return: The top-level menu.
+        """
+        import xmltodict
+        doc = xmltodict.parse(fd.read())
+        return self._parse_file_recursive(doc['menu'])
+
+    def _parse_file_recursive(self, xml_menu : dict) -> Database.Item:
+        menu = Database.Item(type=Database.Item.TYPE_MENU)
+        for key, value in xml_menu.items():
+            if key == '@name':
+                menu.set_text(value)
+            elif key == 'icon':
+                menu.set_icon(value)
+            elif key == 'item':
+                if not isinstance(value, list):
+                    value = [value]
+                for item in value:
+                    dbitem = Database.Item()
+                    item_key = ''
+                    for item_key, item_value in item.items():
+                        if item_key == 'text':
+                            dbitem.set_text(item_value)
+                        elif item_key == 'action':
+                            for action_key, action_value in item_value.items():
+                                if action_key == '#text':
+                                    dbitem.set_action(action_value)
+                                elif action_key == '@type':
+                                    dbitem.set_type(action_value)
+                        elif item_key == 'icon':
+                            dbitem.set_icon(item_value)
+                        elif item_key == 'separator':
+                            menu.add_child(Database.Item(type=Database.Item.TYPE_SEPARATOR))
+                            break
+                    if item_key != 'separator':
+                        menu.add_child(dbitem)
+            elif key == 'menu':
+                if not isinstance(value, list):
+                    value = [value]
+                for item in value:
+                    menu.add_child(self._parse_file_recursive(item))
+
+        return menu
+
+    def on_change(self, event : ChangeEvent) -> None:
+        if self._replaying or self.persistence != 'journal':
+            return
+        database = self.database
+        if event.kind == Database.ITEM_ADDED:
+            self._pending.append({'op': 'add', 'parent': database.get_index_path(event.parent.global_id),
+                                  'index': event.index, 'item': self._item_to_dict(event.item)})
+        elif event.kind == Database.ITEM_REMOVED:
+            self._pending.append({'op': 'delete',
+                                  'path': database.get_index_path(event.parent.global_id) + [event.index]})
+        elif event.kind == Database.ITEM_CHANGED:
+            item = event.item
+            self._pending.append({'op': 'update', 'path': database.get_index_path(item.global_id),
+                                  'values': {'text': item.text, 'action': item.action, 'type': item.type,
+                                             'icon': item.icon}})
+
+    def _apply_record(self, record : dict) -> bool:
+        """
+        Applies a single journal record.
+        :param record: The journal record.
+        :return: True if the record could be applied, False otherwise.
+        """
+        database = self.database
+        op = record.get('op')
+        if op == 'add':
+            parent = database.get_item_by_index_path(record['parent'])
+            if parent is None:
+                return False
+            return database.add_item(parent.global_id, self._item_from_dict(record['item']), record.get('index'))
+        elif op == 'delete':
+            item = database.get_item_by_index_path(record['path'])
+            if item is None:
+                return False
+            return database.delete_item_by_id(item.global_id)
+        elif op == 'update':
+            item = database.get_item_by_index_path(record['path'])
+            if item is None:
+                return False
+            values = record['values']
+            return database.update_item(item.global_id, values.get('text', ''), values.get('action'),
+                                        values.get('type', Database.Item.TYPE_WEB), values.get('icon'))
+        return False
+
+    def _item_to_dict(self, item : Database.Item) -> dict:
+        result = {'text': item.text, 'action': item.action, 'type': item.type, 'icon': item.icon}
+        if item.get_children():
+            result['children'] = [self._item_to_dict(child) for child in item.get_children()]
+        return result
+
+    @staticmethod
+    def _item_from_dict(values : dict) -> Database.Item:
+        item = Database.Item(text=values.get('text', ''), action=values.get('action'),
+                             type=values.get('type', Database.Item.TYPE_WEB), icon=values.get('icon'))
+        for child in values.get('children', []):
+            item.add_child(XmlBackend._item_from_dict(child))
+        return item
+
+    @staticmethod
+    def _apply_to_tree(root : Database.Item, record : dict) -> None:
+        """
+        Applies a journal record to a tree of entries that does not belong to a database (see _read_version).
+        :param root: The top-level menu.
+        :param record: The journal record.
+        :return: Nothing
+        """
+        def find(index_path):
+            item = root
+            for idx in index_path:
+                if idx >= len(item.get_children()):
+                    return None
+                item = item.get_children()[idx]
+            return item
+
+        op = record.get('op')
+        if op == 'add':
+            parent = find(record['parent'])
+            if parent is not None:
+                index = record.get('index')
+                children = parent.get_children()
+                children.insert(len(children) if index is None else index, XmlBackend._item_from_dict(record['item']))
+        elif op == 'delete' and record['path']:
+            parent = find(record['path'][:-1])
+            if parent is not None and record['path'][-1] < len(parent.get_children()):
+                del parent.get_children()[record['path'][-1]]
+        elif op == 'update':
+            item = find(record['path'])
+            if item is not None:
+                values = record['values']
+                item.set_text(values.get('text', ''))
+                item.set_action(values.get('action'))
+                item.set_type(values.get('type', Database.Item.TYPE_WEB))
+                item.set_icon(values.get('icon'))
+
+    def _read_version(self, contents : Optional[bytes], records : List[dict]) -> Database.Item:
+        """
+        Builds the entries of a version of the file (e.g., for merging).
+        :param contents: The content of the XML file (None if the file does not exist).
+        :param records: Journal records to apply.
+        :return: The top-level menu.
+        """
+        if contents is None or not contents.strip(b" "):
+            root = Database.Item(text="Menu", type=Database.Item.TYPE_MENU)
+        else:
+            root = self._parse_file_iterparse(io.BytesIO(contents))
+        for record in records:
+            self._apply_to_tree(root, record)
+        return root
+
+    def changed_externally(self) -> bool:
+        # Other processes in "journal" mode only append to the journal
+        return super().changed_externally() or self._journal.size() != self._journal_size
+
+    def watched_files(self) -> List[str]:
+        return [self.filename, self._journal.filename]
+
+    def _changed_by_others(self) -> bool:
+        """
+        Checks whether the XML file or the journal were changed by someone else since we read or wrote them.
+        Must be called while holding the lock.
+        :return: True if the changes have to be merged.
+        """
+        if self._base_hash is None:
+            # Never read, nothing to merge with
+            return False
+        if self._journal.size() != self._journal_size:
+            return True
+        if self._file_signature() == self._signature:
+            return False
+        # Same content, e.g., only touched
+        return self._read_file()[1] != self._base_hash
+
+    def _read_file(self) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        :return: The content of the XML file and its hash (None, None if it does not exist).
+        """
+        try:
+            with open(self.filename, "rb") as f:
+                contents = f.read()
+        except FileNotFoundError:
+            return None, None
+        return contents, content_hash(contents)
+
+    def _merge(self, contents : Optional[bytes]) -> None:
+        """
+        Merges the version of the file written by someone else into our data (three-way merge, the version we read
+        is the common base). The changes are applied to the database (see Database.apply_version), i.e., the views
+        are updated.
+        :param contents: The current content of the XML file.
+        :return: Nothing
+        """
+        import merge
+        base = self._read_version(zlib.decompress(self._base) if self._base is not None else None,
+                                  self._base_records)
+        theirs = self._read_version(contents, list(self._journal.read()))
+        self.database.apply_version(merge.merge(base, self.database.data, theirs))
+
+    def save(self) -> None:
+        """
+        In "full" persistence mode, the whole XML file is rewritten (see compact()).
+        In "journal" mode, only the changes since the last save are appended to the journal. The journal is
+        folded into the XML file when it exceeds config['general']['journal_max_size'] (bytes) or
+        config['general']['journal_max_age'] (seconds), or when it was changed by someone else in the meantime.
+        :return: Nothing
+        """
+        with self._locked():
+            if self.persistence == 'journal' and not self._changed_by_others():
+                self._journal.append(self._pending)
+                self._base_records.extend(self._pending)
+                self._pending = []
+                self._journal_size = self._journal.size()
+                if self._journal.size() <= config['general']['journal_max_size'] and \
+                        self._journal.age() <= config['general']['journal_max_age']:
+                    return
+            self._write_current()
+
+    def compact(self) -> None:
+        """
+        Writes pending changes and the journal (if any) to the XML file and removes the journal.
+        Does nothing if there is nothing to fold into the file.
+        :return: Nothing
+        """
+        if not self._pending and not self._journal.exists():
+            return
+        with self._locked():
+            self._write_current()
+
+    def _write_current(self) -> None:
+        """
+        Writes the data of the database to the XML file, after merging the changes of others (if any).
+        Must be called while holding the lock.
+        :return: Nothing
+        """
+        contents, digest = self._read_file()
+        if self._base_hash is not None and contents is not None and \
+                (digest != self._base_hash or self._journal.size() != self._journal_size):
+            self._merge(contents)
+        if contents is not None:
+            # Keep the version from before our changes (or the one we merged with), too
+            self.backups.add(contents)
+        self._write_file(self.database.data, digest)
+
+    def replace(self, root : Database.Item) -> None:
+        with self._locked():
+            self._write_file(root, self._read_file()[1])
+
+    def _write_file(self, root : Database.Item, current_hash : Optional[str]) -> None:
+        """
+        Writes a tree of entries to the XML file. Must be called while holding the lock.
+
+        The file is replaced atomically, and each written version is kept in the backup store
+        (see backup.BackupStore, the number of versions is set by config['general']['backup_count']).
+        If the file content would not change, nothing is written.
+        :param root: The top-level menu.
+        :param current_hash: Content hash of the file before writing (None if it does not exist).
+        :return: Nothing
+        """
+        data = ET.Element("menu")
+        data.set("name", root.text)
+        if root.icon is not None:
+            ET.SubElement(data, 'icon').text = root.icon
+        self._save_data_recursive(root, data)
+        ET.indent(data, space=" ", level=0)
+        contents = ET.tostring(data)
+        digest = content_hash(contents)
+
+        if digest != current_hash:
+            self.backups.add(contents)
+            atomic_write(self.filename, contents)
+        self._set_base(contents, digest)
+        # The file now contains all changes
+        self._pending = []
+        self._journal.clear()
+        self._journal_size = 0
+
+    def _set_base(self, contents : bytes, digest : str) -> None:
+        self._remember_signature()
+        self._base_hash = digest
+        self._base = zlib.compress(contents)
+        self._base_records = []
+
+    def _save_data_recursive(self, parent : Database.Item, parent_tag : ET.Element):
+        for item in parent.get_children():
+            if item.type == Database.Item.TYPE_MENU:
+                element = ET.SubElement(parent_tag, 'menu')
+                element.set('name', item.text)
+                if item.icon is not None:
+                    ET.SubElement(element, 'icon').text = item.icon
+                self._save_data_recursive(item, element)
+            elif item.type == Database.Item.TYPE_SEPARATOR:
+                element = ET.SubElement(parent_tag, 'item')
+                ET.SubElement(element, 'separator')
+            else:
+                element = ET.SubElement(parent_tag, 'item')
+                ET.SubElement(element, 'text').text = item.text
+                if item.icon is not None:
+                    ET.SubElement(element, 'icon').text = item.icon
+                se = ET.SubElement(element, 'action')
+                se.text = item.action
+                se.set('type', item.type)
+
+    def restore_backup(self, digest : str) -> None:
+        """
+        Replaces the XML file by a version from the backup store and discards the journal.
+        The current file is added to the backup store before. The data of the database is not reloaded.
+        :param digest: Content hash of the version (see self.backups.versions()).
+        :return: Nothing
+        """
+        contents = self.backups.get(digest)
+        with self._locked():
+            if os.path.isfile(self.filename):
+                with open(self.filename, "rb") as f:
+                    self.backups.add(f.read())
+            self.backups.add(contents)
+            atomic_write(self.filename, contents)
+            self._set_base(contents, digest)
+            self._pending = []
+            self._journal.clear()
+            self._journal_size = 0
+
+
+class SqliteBackend(StorageBackend):
+    """
+    The entries are stored in an SQLite database as adjacency list (each row refers to the row of its parent).
+    Changes are applied as single-row inserts, updates and deletes; save() commits them. Starting up still reads
+    all rows, but with a single query instead of parsing a document.
+    """
+
+    """
+    Version of the table layout (stored in the table meta).
+    """
+    SCHEMA_VERSION = 1
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS items (
+            id INTEGER PRIMARY KEY,
+            parent INTEGER REFERENCES items(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            text TEXT,
+            action TEXT,
+            icon TEXT,
+            -- searchindex.normalize(text), for case-insensitive lookups
+            norm_text TEXT
+        );
+        CREATE INDEX IF NOT EXISTS items_parent ON items(parent, position);
+        CREATE INDEX IF NOT EXISTS items_norm_text ON items(norm_text);
+        CREATE INDEX IF NOT EXISTS items_action ON items(action);
+    """
+
+    def __init__(self, database : Database, filename : str):
+        super().__init__(database, filename)
+        # The connection is used by the thread that loads the file and afterwards by the Gtk main loop,
+        # but never by two threads at the same time.
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        self._connection.executescript(self.SCHEMA)
+        self._connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('schema_version', ?)",
+                                 (str(SqliteBackend.SCHEMA_VERSION),))
+        self._connection.commit()
+        # global id -> row id (the global ids change every time the file is read, the row ids do not)
+        self._rows : Dict[int, int] = {}
+
+    def load(self, loader : Optional[str] = None) -> Optional[Database.Item]:
+        self._remember_signature()
+        self._rows = {}
+        items : Dict[int, Database.Item] = {}
+        rows = self._connection.execute(
+            "SELECT id, parent, type, text, action, icon FROM items ORDER BY parent, position, id").fetchall()
+        for id, parent, type, text, action, icon in rows:
+            items[id] = Database.Item(text=text, action=action, type=sys.intern(type), icon=icon)
+        root = None
+        for id, parent, *_ in rows:
+            if parent is None:
+                root = items[id]
+            else:
+                items[parent].add_child(items[id])
+            self._rows[items[id].global_id] = id
+        return root
+
+    def attach(self, root : Database.Item) -> None:
+        if root.global_id not in self._rows:
+            # New (empty) file
+            self._insert(None, root, 0)
+
+    def _insert(self, parent_row : Optional[int], item : Database.Item, position : int) -> None:
+        """
+        Inserts the rows of an entry and all its sub-entries.
+        :param parent_row: Row id of the parent (None for the top-level menu).
+        :param item: The entry.
+        :param position: Position among the children of the parent.
+        :return: Nothing
+        """
+        stack = [(parent_row, item, position)]
+        while stack:
+            parent_row, item, position = stack.pop()
+            cursor = self._connection.execute(
+                "INSERT INTO items (parent, position, type, text, action, icon, norm_text) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (parent_row, position, item.type, item.text, item.action, item.icon, normalize(item.text)))
+            self._rows[item.global_id] = cursor.lastrowid
+            stack.extend((cursor.lastrowid, child, i) for i, child in enumerate(item.get_children()))
+
+    def on_change(self, event : ChangeEvent) -> None:
+        if event.kind == Database.ITEM_ADDED:
+            parent_row = self._rows.get(event.parent.global_id)
+            if parent_row is None:
+                return
+            # Positions may have gaps (after deletions), only the order matters
+            siblings = event.parent.get_children()
+            next_row = self._rows.get(siblings[event.index + 1].global_id) if event.index + 1 < len(siblings) else None
+            if next_row is None:
+                position = self._connection.execute(
+                    "SELECT COALESCE(MAX(position), -1) + 1 FROM items WHERE parent = ?", (parent_row,)).fetchone()[0]
+            else:
+                # Make room before the next entry
+                position = self._connection.execute("SELECT position FROM items WHERE id = ?",
+                                                    (next_row,)).fetchone()[0]
+                self._connection.execute("UPDATE items SET position = position + 1 WHERE parent = ? AND position >= ?",
+                                         (parent_row, position))
+            self._insert(parent_row, event.item, position)
+        elif event.kind == Database.ITEM_REMOVED:
+            row = self._rows.get(event.item.global_id)
+            if row is None:
+                return
+            # The rows of the sub-entries are deleted by the foreign key (ON DELETE CASCADE)
+            self._connection.execute("DELETE FROM items WHERE id = ?", (row,))
+            stack = [event.item]
+            while stack:
+                item = stack.pop()
+                self._rows.pop(item.global_id, None)
+                stack.extend(item.get_children())
+        elif event.kind == Database.ITEM_CHANGED:
+            row = self._rows.get(event.item.global_id)
+            if row is None:
+                return
+            item = event.item
+            self._connection.execute(
+                "UPDATE items SET type = ?, text = ?, action = ?, icon = ?, norm_text = ? WHERE id = ?",
+                (item.type, item.text, item.action, item.icon, normalize(item.text), row))
+
+    def save(self) -> None:
+        self._connection.commit()
+
+    def compact(self) -> None:
+        self._connection.commit()
+
+    def rebind(self, mapping : Dict[int, int]) -> None:
+        self._rows = {mapping.get(id, id): row for id, row in self._rows.items()}
+
+    def _file_signature(self):
+        # Changes only when another connection commits, i.e., our own writes are not noticed
+        return self._connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def replace(self, root : Database.Item) -> None:
+        self._connection.execute("DELETE FROM items")
+        self._rows = {}
+        self._insert(None, root, 0)
+        self._connection.commit()
+
+
+"""
+File extensions of SQLite databases (used when the storage is "auto").
+"""
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+
+
+def guess_storage(filename : str) -> str:
+    """
+    :param filename: A bookmark file.
+    :return: The storage backend for the file, based on its extension ("xml" unless it is an SQLite extension).
+    """
+    return 'sqlite' if filename.lower().endswith(SQLITE_EXTENSIONS) else 'xml'
+
+
+def create_backend(database : Database, filename : str, storage : Optional[str] = None,
+                   persistence : Optional[str] = None) -> StorageBackend:
+    """
+    Creates the storage backend of a database.
+    :param database: The database.
+    :param filename: The bookmark file.
+    :param storage: One of Database.STORAGES. If not given, config['general']['storage'] is used.
+    :param persistence: Persistence mode of the XML backend (see XmlBackend).
+    :return: The backend.
+    """
+    if storage is None:
+        storage = config['general']['storage']
+    if storage == 'auto':
+        storage = guess_storage(filename)
+    if storage == 'xml':
+        return XmlBackend(database, filename, persistence)
+    elif storage == 'sqlite':
+        return SqliteBackend(database, filename)
+    raise ValueError("Unknown storage '" + str(storage) + "'. Expected one of: " + ', '.join(Database.STORAGES))
@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import gi
+
+from model import ChangeEvent, Database
+
+gi.require_version('Gtk', '3.0')
+gi.require_version('Pango', '1.0')
+from gi.repository import GObject
+from gi.repository import Gtk as gtk
+from gi.repository import Pango
+
+
+class Hierarchy:
+    """
+    A Gtk tree store containing (some of) the entries of a database, starting with the top-level menu.
+    The store is kept up to date with the changes of the database (see Database.subscribe): only the rows of the
+    entries that were added, removed or changed are touched.
+    """
+
+    def __init__(self, database : Database):
+        """
+        :param database: The data to be displayed.
+        """
+        self.database : Database = database
+        self.store : gtk.TreeStore = self.create_store()
+        # global id -> row in the store (the iters of a tree store stay valid as long as the row exists)
+        self.rows : Dict[int, gtk.TreeIter] = {}
+        # Top-level menu of the database the store was created for (it is replaced when the file is read again)
+        self.root : Database.Item = database.data
+        self._insert(None, self.root, -1)
+        # Database.generation the store is up to date with
+        self.generation : int = database.generation
+        database.subscribe(self.on_change)
+
+    def close(self) -> None:
+        """
+        Stops updating the store.
+        :return: Nothing
+        """
+        self.database.unsubscribe(self.on_change)
+
+    def create_store(self) -> gtk.TreeStore:
+        raise NotImplementedError()
+
+    def includes(self, item : Database.Item) -> bool:
+        """
+        :param item: An entry (not the top-level menu, which is always included).
+        :return: Whether the entry has a row in the store.
+        """
+        raise NotImplementedError()
+
+    def values(self, item : Database.Item) -> list:
+        """
+        :param item: An entry.
+        :return: The values of its row.
+        """
+        raise NotImplementedError()
+
+    def update(self, row : gtk.TreeIter, item : Database.Item) -> None:
+        """
+        Updates the row of a changed entry.
+        :param row: The row.
+        :param item: The entry.
+        :return: Nothing
+        """
+        raise NotImplementedError()
+
+    def _insert(self, parent_row : gtk.TreeIter, item : Database.Item, position : int) -> None:
+        """
+        Inserts the rows of an entry and all its (included) sub-entries.
+        :param parent_row: Row of the parent (None for the top-level menu).
+        :param item: The entry.
+        :param position: Position among the rows of the parent (-1 to append).
+        :return: Nothing
+        """
+        stack = [(parent_row, item, position)]
+        while stack:
+            parent_row, item, position = stack.pop()
+            row = self.store.insert(parent_row, position, self.values(item))
+            self.rows[item.global_id] = row
+            stack.extend((row, child, -1) for child in reversed(item.get_children()) if self.includes(child))
+
+    def _remove(self, item : Database.Item) -> None:
+        """
+        Removes the rows of an entry and all its sub-entries.
+        :param item: The entry.
+        :return: Nothing
+        """
+        row = self.rows.get(item.global_id)
+        if row is None:
+            return
+        self.store.remove(row)
+        stack = [item]
+        while stack:
+            item = stack.pop()
+            self.rows.pop(item.global_id, None)
+            stack.extend(item.get_children())
+
+    def _position(self, parent : Database.Item, index : int) -> int:
+        """
+        :param parent: A menu.
+        :param index: Position of an entry among the children of the menu.
+        :return: Position of the entry among the rows of the menu.
+        """
+        return sum(1 for child in parent.get_children()[:index] if self.includes(child))
+
+    def on_change(self, event : ChangeEvent) -> None:
+        if self.root is not self.database.data:
+            # The file was read again, the store is outdated as a whole (see Database.get_item_hierarchy)
+            return
+        row = self.rows.get(event.item.global_id)
+        if event.kind == Database.ITEM_REMOVED:
+            self._remove(event.item)
+        else:
+            parent_row = self.rows.get(event.parent.global_id) if event.parent is not None else None
+            included = event.parent is None or (parent_row is not None and self.includes(event.item))
+            if row is not None and included:
+                self.update(row, event.item)
+            elif row is not None:
+                # E.g., a menu that became a website
+                self._remove(event.item)
+            elif included:
+                self._insert(parent_row, event.item, self._position(event.parent, event.index))
+        self.generation = self.database.generation
+
+
+class ItemHierarchy(GObject.Object, gtk.TreeModel):
+    """
+    All entries except separators as (read-only) Gtk tree model. The structure is:
+    (1) str:            label/text
+    (2) str:            item type (www/menu/...)
+    (3) str:            action
+    (4) bool:           true, unless changed by a view (see set_visible_ids); can be used to hide some elements
+    (5) Pango.Weight:   normal, unless changed by a view (see set_bold_ids); can be used to print some entries bold
+    (6) int:            global ID
+
+    The rows are not copied: the values are read from the entries of the database when Gtk asks for them, and the
+    iters simply contain the global ids. Only the children of menus that Gtk has looked at (i.e., that are displayed)
+    are cached, and signals are only emitted for their rows.
+    """
+    COLUMN_TYPES = [str, str, str, bool, Pango.Weight, int]
+    # Stamp of the iters created by this model
+    STAMP = 0x5eed
+
+    def __init__(self, database : Database):
+        """
+        :param database: The data to be displayed.
+        """
+        GObject.Object.__init__(self)
+        self.database : Database = database
+        self.root : Database.Item = database.data
+        # Global ids of the visible rows (None means all rows) and of the rows printed bold
+        self.visible_ids : Optional[Set[int]] = None
+        self.bold_ids : Set[int] = set()
+        # global id of a menu -> (revision of the menu, its children without separators, global id -> position)
+        self._children : Dict[int, Tuple[int, List[Database.Item], Dict[int, int]]] = {}
+        # Database.generation the model is up to date with
+        self.generation : int = database.generation
+        # Whether a view uses the columns (4) and (5), see acquire()
+        self.in_use : bool = False
+        # Whether the model was created for a single view (instead of being shared)
+        self.separate : bool = False
+        database.subscribe(self.on_change)
+
+    @staticmethod
+    def acquire(database : Database) -> 'ItemHierarchy':
+        """
+        Returns the shared model of a database (see Database.get_item_hierarchy) for a view that changes the columns
+        (4) and (5). If the shared model is used by another view, a separate model is created.
+        :param database: The database.
+        :return: The model. It has to be passed to release() when the view is closed.
+        """
+        hierarchy = database.get_item_hierarchy()
+        if hierarchy.in_use:
+            hierarchy = ItemHierarchy(database)
+            hierarchy.separate = True
+        hierarchy.in_use = True
+        return hierarchy
+
+    def release(self) -> None:
+        """
+        Called by the view when it does not use the model anymore (after it reset the columns (4) and (5)).
+        :return: Nothing
+        """
+        self.in_use = False
+        if self.separate:
+            self.close()
+
+    def close(self) -> None:
+        """
+        Stops following the changes of the database.
+        :return: Nothing
+        """
+        self.database.unsubscribe(self.on_change)
+
+    @staticmethod
+    def includes(item : Database.Item) -> bool:
+        """
+        :param item: An entry.
+        :return: Whether the entry has a row.
+        """
+        return item.type != Database.Item.TYPE_SEPARATOR
+
+    def is_visible(self, id : int) -> bool:
+        return self.visible_ids is None or id in self.visible_ids
+
+    def _get_children(self, item : Database.Item) -> Tuple[List[Database.Item], Dict[int, int]]:
+        """
+        :param item: A menu.
+        :return: The children of the menu that have a row, and their positions (by global id).
+        """
+        revision = self.database.get_revision(item.global_id)
+        cached = self._children.get(item.global_id)
+        if cached is None or cached[0] != revision:
+            children = [child for child in item.get_children() if self.includes(child)]
+            cached = (revision, children, {child.global_id: i for i, child in enumerate(children)})
+            self._children[item.global_id] = cached
+        return cached[1], cached[2]
+
+    def _create_iter(self, id : int) -> gtk.TreeIter:
+        iter = gtk.TreeIter()
+        iter.stamp = self.STAMP
+        iter.user_data = id
+        return iter
+
+    def _item(self, iter : Optional[gtk.TreeIter]) -> Optional[Database.Item]:
+        if iter is None:
+            return None
+        return self.database.get_item(iter.user_data)
+
+    def get_item_path(self, id : int) -> Optional[gtk.TreePath]:
+        """
+        :param id: Global id of an entry.
+        :return: The path of its row, None if it has no row.
+        """
+        item = self.database.get_item(id)
+        if item is None or not self.includes(item):
+            return None
+        indices = []
+        while item is not self.root:
+            parent = self.database.get_parent(item.global_id)
+            if parent is None:
+                return None
+            indices.append(self._get_children(parent)[1][item.global_id])
+            item = parent
+        indices.append(0)
+        return gtk.TreePath.new_from_indices(list(reversed(indices)))
+
+    def set_visible_ids(self, visible_ids : Optional[Set[int]]) -> None:
+        """
+        Changes the column (4). Signals are only sent for rows that change and are displayed.
+        :param visible_ids: Global ids of the rows whose column (4) is True (None for all rows).
+        :return: Nothing
+        """
+        previous = self.visible_ids
+        self.visible_ids = visible_ids
+        if previous is not None and visible_ids is not None:
+            self._rows_changed(previous ^ visible_ids)
+        elif previous is not visible_ids:
+            self._rows_changed(id for id in self._displayed_ids()
+                               if (previous is None or id in previous) != self.is_visible(id))
+
+    def set_bold_ids(self, bold_ids : Set[int]) -> None:
+        """
+        Changes the column (5).
+        :param bold_ids: Global ids of the rows whose column (5) is bold.
+        :return: Nothing
+        """
+        changed = self.bold_ids ^ bold_ids
+        self.bold_ids = bold_ids
+        self._rows_changed(changed)
+
+    def _displayed_ids(self) -> Iterable[int]:
+        """
+        :return: Global ids of the rows Gtk may have looked at (the top-level row and the children of cached menus).
+        """
+        yield self.root.global_id
+        for _, children, _ in list(self._children.values()):
+            for child in children:
+                yield child.global_id
+
+    def _rows_changed(self, ids : Iterable[int]) -> None:
+        """
+        Emits row-changed for the rows that are displayed (i.e., whose parent is cached).
+        :param ids: Global ids of the changed rows.
+        :return: Nothing
+        """
+        for id in list(ids):
+            parent = self.database.get_parent(id)
+            if (parent is not None and parent.global_id in self._children) or id == self.root.global_id:
+                path = self.get_item_path(id)
+                if path is not None:
+                    self.row_changed(path, self._create_iter(id))
+
+    def on_change(self, event : ChangeEvent) -> None:
+        if self.root is not self.database.data:
+            # The file was read again, the model is outdated as a whole (see Database.get_item_hierarchy)
+            return
+        if event.kind == Database.ITEM_REMOVED:
+            stack = [event.item]
+            while stack:
+                item = stack.pop()
+                self._children.pop(item.global_id, None)
+                self.bold_ids.discard(item.global_id)
+                if self.visible_ids is not None:
+                    self.visible_ids.discard(item.global_id)
+                stack.extend(item.get_children())
+
+        if event.parent is None:
+            self.row_changed(gtk.TreePath.new_first(), self._create_iter(event.item.global_id))
+        elif event.parent.global_id in self._children:
+            # Rows below the parent were displayed, compare with the current children
+            old_children, old_positions = self._children.pop(event.parent.global_id)[1:]
+            parent_path = self.get_item_path(event.parent.global_id)
+            new_children, new_positions = self._get_children(event.parent)
+            id = event.item.global_id
+            if parent_path is not None:
+                if id in old_positions and id in new_positions:
+                    self.row_changed(self._child_path(parent_path, new_positions[id]), self._create_iter(id))
+                elif id in old_positions:
+                    self.row_deleted(self._child_path(parent_path, old_positions[id]))
+                elif id in new_positions:
+                    self.row_inserted(self._child_path(parent_path, new_positions[id]), self._create_iter(id))
+                    if any(self.includes(child) for child in event.item.get_children()):
+                        self.row_has_child_toggled(self._child_path(parent_path, new_positions[id]),
+                                                   self._create_iter(id))
+                if bool(old_children) != bool(new_children):
+                    self.row_has_child_toggled(parent_path, self._create_iter(event.parent.global_id))
+        self.generation = self.database.generation
+
+    @staticmethod
+    def _child_path(parent_path : gtk.TreePath, position : int) -> gtk.TreePath:
+        return gtk.TreePath.new_from_indices(parent_path.get_indices() + [position])
+
+    # Gtk.TreeModel interface
+
+    def do_get_flags(self) -> gtk.TreeModelFlags:
+        return gtk.TreeModelFlags.ITERS_PERSIST
+
+    def do_get_n_columns(self) -> int:
+        return len(ItemHierarchy.COLUMN_TYPES)
+
+    def do_get_column_type(self, column : int):
+        return ItemHierarchy.COLUMN_TYPES[column]
+
+    def do_get_iter(self, path : gtk.TreePath):
+        indices = path.get_indices()
+        if not indices or indices[0] != 0:
+            return False, None
+        item = self.root
+        for index in indices[1:]:
+            children = self._get_children(item)[0]
+            if index >= len(children):
+                return False, None
+            item = children[index]
+        return True, self._create_iter(item.global_id)
+
+    def do_get_path(self, iter : gtk.TreeIter) -> gtk.TreePath:
+        return self.get_item_path(iter.user_data)
+
+    def do_get_value(self, iter : gtk.TreeIter, column : int):
+        item = self._item(iter)
+        if column == 0:
+            return item.text
+        elif column == 1:
+            return item.type or ''
+        elif column == 2:
+            return item.action or ''
+        elif column == 3:
+            return self.is_visible(item.global_id)
+        elif column == 4:
+            return Pango.Weight.BOLD if item.global_id in self.bold_ids else Pango.Weight.NORMAL
+        return item.global_id
+
+    def do_iter_next(self, iter : gtk.TreeIter) -> bool:
+        parent = self.database.get_parent(iter.user_data)
+        if parent is None:
+            # Only one top-level row
+            return False
+        children, positions = self._get_children(parent)
+        position = positions[iter.user_data] + 1
+        if position >= len(children):
+            return False
+        iter.user_data = children[position].global_id
+        return True
+
+    def do_iter_previous(self, iter : gtk.TreeIter) -> bool:
+        parent = self.database.get_parent(iter.user_data)
+        if parent is None:
+            return False
+        children, positions = self._get_children(parent)
+        position = positions[iter.user_data] - 1
+        if position < 0:
+            return False
+        iter.user_data = children[position].global_id
+        return True
+
+    def do_iter_children(self, parent : Optional[gtk.TreeIter]):
+        return self.do_iter_nth_child(parent, 0)
+
+    def do_iter_has_child(self, iter : gtk.TreeIter) -> bool:
+        return self.do_iter_n_children(iter) > 0
+
+    def do_iter_n_children(self, iter : Optional[gtk.TreeIter]) -> int:
+        if iter is None:
+            return 1
+        return len(self._get_children(self._item(iter))[0])
+
+    def do_iter_nth_child(self, parent : Optional[gtk.TreeIter], n : int):
+        if parent is None:
+            if n == 0:
+                return True, self._create_iter(self.root.global_id)
+            return False, None
+        children = self._get_children(self._item(parent))[0]
+        if n >= len(children):
+            return False, None
+        return True, self._create_iter(children[n].global_id)
+
+    def do_iter_parent(self, child : gtk.TreeIter):
+        parent = self.database.get_parent(child.user_data)
+        if parent is None:
+            return False, None
+        return True, self._create_iter(parent.global_id)
+
+
+class MenuHierarchy(Hierarchy):
+    """
+    All submenus (without entries): (0) the text (str) and (1) the global id (int).
+    """
+
+    def create_store(self) -> gtk.TreeStore:
+        return gtk.TreeStore.new(types=[str, int])
+
+    def includes(self, item : Database.Item) -> bool:
+        return item.type == Database.Item.TYPE_MENU
+
+    def values(self, item : Database.Item) -> list:
+        return [item.text, item.global_id]
+
+    def update(self, row : gtk.TreeIter, item : Database.Item) -> None:
+        self.store.set_value(row, 0, item.text)